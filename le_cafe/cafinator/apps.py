@@ -5,3 +5,6 @@ class CafinatorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cafinator'
     verbose_name = 'The arranger of Coffee meetings'
+
+    def ready(self):
+        from . import signals  # noqa F401
@@ -0,0 +1,50 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+# bumped whenever members, meetups or meet records change, part of every cached fragment key
+DATA_VERSION_KEY = 'cafinator:data_version'
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+
+def _new_version():
+    # time based so a version lost from the cache never restarts at a number already used in a key
+    return int(time.time() * 1000)
+
+
+def data_version():
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        cache.add(DATA_VERSION_KEY, _new_version(), None)
+        version = cache.get(DATA_VERSION_KEY)
+    return version
+
+
+def _bump():
+    try:
+        cache.incr(DATA_VERSION_KEY)
+    except ValueError:
+        cache.set(DATA_VERSION_KEY, _new_version(), None)
+
+
+def bump_data_version():
+    """
+    Invalidate every cached fragment, now and again on commit so a page rendered from
+    uncommitted data by another request can not be served afterwards
+    """
+    _bump()
+    transaction.on_commit(_bump)
+
+
+def cached_fragment(in_str_name, request, build):
+    """
+    Rendered fragment for the view and query string at the current data version,
+    build() renders it on a miss
+    """
+    key = f'cafinator:fragment:{in_str_name}:{data_version()}:{request.GET.urlencode()}'
+    fragment = cache.get(key)
+    if fragment is None:
+        fragment = build()
+        cache.set(key, fragment, FRAGMENT_TIMEOUT)
+    return fragment
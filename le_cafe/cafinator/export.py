@@ -0,0 +1,73 @@
+import csv
+import json
+
+from .models import MeetPair, MeetRecord, Meetup, Member
+
+# rows fetched from the database at a time, and written out together
+EXPORT_CHUNK_SIZE = 2000
+
+# what can be exported, name: (model, columns), the columns as values_list fields
+EXPORTS = {
+    'members': (Member, ['id', 'full_name', 'email', 'active', 'team_id', 'team__name']),
+    'meetups': (Meetup, ['id', 'member_low_id', 'member_high_id', 'named', 'meetings', 'active', 'team_id']),
+    'records': (MeetRecord, ['id', 'recorded', 'team_id', 'detail']),
+    'record_pairs': (MeetPair, ['id', 'record_id', 'recorded', 'member_low_id', 'member_high_id']),
+}
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    # file-like object handing back what csv.writer writes, instead of keeping it
+    def write(self, value):
+        return value
+
+
+def export_rows(in_str_dataset, in_int_chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Rows of a dataset in pk order, read in chunks so memory does not grow with the table
+    Parameters
+    ==========
+    in_str_dataset : name in EXPORTS
+    in_int_chunk_size : rows fetched at a time
+    Returns
+    =======
+    columns - names of the columns
+    rows - iterator of value tuples
+    """
+    model, columns = EXPORTS[in_str_dataset]
+    rows = model.objects.order_by('pk').values_list(*columns).iterator(chunk_size=in_int_chunk_size)
+    return columns, rows
+
+
+def export_lines(in_str_dataset, in_str_format, in_int_chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    The dataset as text in the format given, a block of up to in_int_chunk_size lines at a time.
+    The first block follows the first chunk from the database, so a response streaming it starts at once
+    Parameters
+    ==========
+    in_str_dataset : name in EXPORTS
+    in_str_format : ndjson, one JSON object per line, or csv with a header line
+    in_int_chunk_size : rows fetched and written at a time
+    Returns
+    =======
+    generator of str
+    """
+    columns, rows = export_rows(in_str_dataset, in_int_chunk_size)
+    if in_str_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+        format_row = writer.writerow
+    else:
+        def format_row(row):
+            return json.dumps(dict(zip(columns, row)), default=str) + '\n'
+    block = []
+    for row in rows:
+        block.append(format_row(row))
+        if len(block) >= in_int_chunk_size:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
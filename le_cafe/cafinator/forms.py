@@ -1,5 +1,6 @@
 from django import forms
 
+from .meeting import PAIRING_STRATEGIES
 from .models import Meetup, Member
 
 
@@ -18,3 +19,17 @@ class MeetingForm(forms.ModelForm):
 class SetMeetingForm(forms.Form):
     meetings = forms.CharField(widget=forms.Textarea(attrs={'rows': 8, "cols": 30}), required=False, strip=True)
     created = forms.DateField(required=False)
+    strategy = forms.ChoiceField(choices=[(name, label) for name, (label, selector) in PAIRING_STRATEGIES.items()],
+                                 initial='random', required=False)
+
+
+class CombinationFilterForm(forms.Form):
+    active = forms.ChoiceField(choices=[('', 'All'), ('yes', 'Active'), ('no', 'Inactive')], required=False)
+    member = forms.ModelChoiceField(queryset=Member.objects.all(), required=False)
+    meetings = forms.IntegerField(min_value=0, required=False)
+    after = forms.RegexField(regex=r'^\d+_\d+$', required=False, widget=forms.HiddenInput)
+
+
+class MemberImportForm(forms.Form):
+    file = forms.FileField(help_text='CSV with a header line, or JSON, with full_name, email, active and team (a name)')
+    dry_run = forms.BooleanField(required=False, help_text='Only check the rows, nothing is saved')
@@ -0,0 +1,87 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .meeting import create_meetings
+from .models import GenerationJob
+
+logger = logging.getLogger('coffee_log')
+
+# seconds a job may run. A worker past it rolls its round back and fails the job,
+# a job still running after it is taken to belong to a worker that stopped and is queued again
+JOB_TIMEOUT = 600
+
+
+def reclaim_stale_jobs(in_int_timeout=JOB_TIMEOUT):
+    """
+    Queue again the jobs left running longer than the timeout. A job runs in one transaction,
+    so a worker that died with it wrote nothing and the job can simply run again. A worker still
+    running the job can not keep its round, run_job only commits while the job is still its own
+    Returns
+    =======
+    reclaimed - number of jobs queued again
+    """
+    reclaimed = GenerationJob.objects.stale(timezone.now() - timedelta(seconds=in_int_timeout)).update(
+        status=GenerationJob.QUEUED, started=None)
+    if reclaimed:
+        logger.warning(f'{reclaimed} jobs running longer than {in_int_timeout} seconds queued again')
+    return reclaimed
+
+
+def claim_next_job():
+    """
+    Take the oldest queued job, the conditional update makes sure only one worker gets it
+    Returns
+    =======
+    job - the claimed GenerationJob or None when the queue is empty
+    """
+    for job in GenerationJob.objects.queued()[:5]:
+        claimed = GenerationJob.objects.filter(pk=job.pk, status=GenerationJob.QUEUED).update(
+            status=GenerationJob.RUNNING, started=timezone.now())
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def _finish_job(in_obj_job, **fields):
+    # the end of the job is written only while the worker still holds it, the claim's started time is its lease
+    fields['finished'] = timezone.now()
+    owned = GenerationJob.objects.filter(pk=in_obj_job.pk, status=GenerationJob.RUNNING,
+                                         started=in_obj_job.started).update(**fields)
+    if owned:
+        for name, value in fields.items():
+            setattr(in_obj_job, name, value)
+    return owned
+
+
+def run_job(in_obj_job, in_int_timeout=JOB_TIMEOUT):
+    """
+    Generate the round for the job in its own transaction and link the MeetRecord written for it.
+    The round is rolled back when the job ran past the timeout, or was queued again meanwhile
+    Returns
+    =======
+    local_int_success - pass or fail
+    """
+    logger.info(f'Start job {in_obj_job.pk}')
+    local_int_success = 1
+    try:
+        with transaction.atomic():
+            local_int_success, record = create_meetings(in_obj_job.strategy)
+            if local_int_success != 0:
+                raise RuntimeError('New meeting set failed')
+            if timezone.now() > in_obj_job.started + timedelta(seconds=in_int_timeout):
+                local_int_success = 1
+                raise RuntimeError(f'Ran past the {in_int_timeout} second timeout')
+            # locks the job row, so it either stays this worker's until the commit or was reclaimed before
+            if not _finish_job(in_obj_job, record=record, status=GenerationJob.DONE):
+                local_int_success = 1
+                raise RuntimeError('Queued again while it ran, the round is left to the worker that has it now')
+    except Exception as e:
+        logger.error(f'Job {in_obj_job.pk} failed: {e}')
+        _finish_job(in_obj_job, status=GenerationJob.FAILED, error=f'{e}'[:300])
+    finally:
+        logger.info(f'END job {in_obj_job.pk} {in_obj_job.status}')
+        return local_int_success
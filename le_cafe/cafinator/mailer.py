@@ -0,0 +1,169 @@
+import logging
+import queue
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.mail import EmailMessage, get_connection
+
+from .models import Member
+
+logger = logging.getLogger('coffee_log')
+
+# defaults for the delivery pool, loadconfig reads each from the optional Reference of the same name
+# (email_workers, email_batch_size, email_retries)
+MAIL_WORKERS = 4  # concurrent SMTP connections
+MAIL_BATCH_SIZE = 50  # messages a worker takes from the queue at a time
+MAIL_RETRIES = 2  # extra attempts for a message, each on a fresh connection
+MAIL_RETRY_DELAY = 0.5  # seconds, multiplied by the attempt number
+# the round emails go to the SMTP server in the email_smtp and email_port references, whatever EMAIL_BACKEND is
+MAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+
+
+def split_addresses(in_str_addresses):
+    # the DL and cc reference values can hold several addresses separated by , or ;
+    return [address.strip() for address in re.split(r'[,;]', in_str_addresses or '') if address.strip()]
+
+
+def make_member_body(in_str_name, in_str_partner, in_bool_test):
+    """
+    Create the body of the personal email to a member
+    Parameters
+    ----------
+        in_str_name : member receiving the email
+        in_str_partner : who they are meeting
+        in_bool_test : modifier to add test text
+    Return
+    ------
+        body text
+    """
+    new_body = f'Good day {in_str_name},\n\n for the following 2 weeks you are meeting {in_str_partner}.\n\n'
+    new_body += 'May your coffee be strong and your Mondays short,\n\n Pii Caffinator'
+    if in_bool_test:
+        new_body += '\n\n NB - this is only a test message'
+    return new_body
+
+
+def build_round_messages(in_dict_config, in_lis_pairs, in_str_body, in_bool_test=False):
+    """
+    The digest to the DL followed by one personal message per member with an email address
+    Parameters
+    ==========
+    in_dict_config : config from loadconfig
+    in_lis_pairs : the member pks of the meetings of the round [(2, 4), (8, 12)]
+    in_str_body : body of the digest
+    Returns
+    =======
+    messages - list of EmailMessage
+    """
+    subject = in_dict_config.get('email_subject')
+    from_email = in_dict_config.get('email_from')
+    messages = [EmailMessage(subject, in_str_body, from_email, split_addresses(in_dict_config.get('email_to')),
+                             cc=split_addresses(in_dict_config.get('email_cc')))]
+
+    members = Member.objects.only('full_name', 'email').in_bulk({pk for pair in in_lis_pairs for pk in pair})
+    for pk_1, pk_2 in in_lis_pairs:
+        if pk_1 not in members or pk_2 not in members:
+            continue
+        for member, partner in ((members[pk_1], members[pk_2]), (members[pk_2], members[pk_1])):
+            if member.email:
+                messages.append(EmailMessage(subject, make_member_body(member.full_name, partner.full_name,
+                                                                       in_bool_test), from_email, [member.email]))
+    return messages
+
+
+def _deliver_worker(in_dict_config, jobs):
+    """
+    Send batches from the queue over one connection that is kept open between batches,
+    a failed message is retried on a new connection
+    Returns
+    =======
+    sent - number of messages delivered
+    failed - recipients of the messages that could not be delivered
+    """
+    retries = int(in_dict_config.get('email_retries', MAIL_RETRIES))
+    connection = None
+    sent = 0
+    failed = []
+    while True:
+        try:
+            batch = jobs.get_nowait()
+        except queue.Empty:
+            break
+        for message in batch:
+            for attempt in range(retries + 1):
+                try:
+                    if connection is None:
+                        connection = get_connection(MAIL_BACKEND, host=in_dict_config.get('email_smtp'),
+                                                    port=in_dict_config.get('email_port'), fail_silently=False)
+                        connection.open()
+                    connection.send_messages([message])
+                    sent += 1
+                    break
+                except Exception as e:
+                    logger.warning(f'Sending to {message.to} failed on attempt {attempt + 1}: {e}')
+                    try:
+                        if connection is not None:
+                            connection.close()
+                    except Exception:
+                        pass
+                    connection = None
+                    if attempt == retries:
+                        failed.extend(message.to)
+                    else:
+                        time.sleep(MAIL_RETRY_DELAY * (attempt + 1))
+    if connection is not None:
+        connection.close()
+    return sent, failed
+
+
+def deliver(in_lis_messages, in_dict_config):
+    """
+    Send the messages in batches over a small pool of reused SMTP connections
+    Parameters
+    ==========
+    in_lis_messages : list of EmailMessage
+    in_dict_config : config from loadconfig, email_workers/email_batch_size/email_retries are optional
+    Returns
+    =======
+    local_int_success - pass or fail (0 only when every message was sent)
+    local_dict_report - sent count and failed recipients
+    """
+    logger.info('Start')
+    workers = max(1, int(in_dict_config.get('email_workers', MAIL_WORKERS)))
+    batch_size = max(1, int(in_dict_config.get('email_batch_size', MAIL_BATCH_SIZE)))
+    jobs = queue.Queue()
+    for start in range(0, len(in_lis_messages), batch_size):
+        jobs.put(in_lis_messages[start:start + batch_size])
+
+    local_dict_report = {'sent': 0, 'failed': []}
+    workers = min(workers, max(1, jobs.qsize()))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_deliver_worker, in_dict_config, jobs) for _ in range(workers)]
+        for future in futures:
+            sent, failed = future.result()
+            local_dict_report['sent'] += sent
+            local_dict_report['failed'].extend(failed)
+    local_int_success = 0 if not local_dict_report['failed'] else 1
+    logger.info(f'END sent {local_dict_report["sent"]}, failed {len(local_dict_report["failed"])}')
+    return local_int_success, local_dict_report
+
+
+def send_round_emails(in_dict_config, in_lis_pairs, in_str_body, in_bool_test=False):
+    """
+    Mail the digest to the DL and the personal notices to the members of the round
+    Parameters
+    ==========
+    in_lis_pairs : the member pks of the meetings of the round, as in its MeetPair rows
+    Returns
+    =======
+    local_int_success - pass or fail
+    local_dict_report - whether the digest was sent, the members notified, sent count and failed recipients
+    """
+    digest, *notices = build_round_messages(in_dict_config, in_lis_pairs, in_str_body, in_bool_test)
+    digest_success, digest_report = deliver([digest], in_dict_config)
+    notice_success, notice_report = deliver(notices, in_dict_config)
+    local_dict_report = {'digest': digest_success == 0, 'members': notice_report['sent'],
+                         'sent': digest_report['sent'] + notice_report['sent'],
+                         'failed': digest_report['failed'] + notice_report['failed']}
+    return 0 if digest_success == 0 and notice_success == 0 else 1, local_dict_report
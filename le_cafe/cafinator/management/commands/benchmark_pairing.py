@@ -0,0 +1,131 @@
+import json
+import platform
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from cafinator.meeting import (
+    PAIRING_STRATEGIES,
+    create_meetings,
+    make_meeting_combinations,
+    store_pairs,
+    update_meetup_list,
+)
+from cafinator.models import Meetup, Member
+from cafinator.pairing import round_robin_round
+
+
+class Rollback(Exception):
+    """Raised to discard a synthetic org once it has been measured"""
+
+
+class Command(BaseCommand):
+    help = ('Seed synthetic orgs and measure wall time, query count and peak memory of the pairing pipeline. '
+            'Every org is created inside a transaction that is rolled back afterwards. '
+            'Meant for an empty database, the members there are hidden while an org is measured')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 2000, 10000],
+                            help='number of members in each synthetic org')
+        parser.add_argument('--history', type=int, default=10,
+                            help='rounds of meeting history seeded before measuring')
+        parser.add_argument('--strategies', nargs='+', choices=sorted(PAIRING_STRATEGIES), default=['array'],
+                            help='pairing strategies measured through create_meetings')
+        parser.add_argument('--no-memory', action='store_true',
+                            help='skip tracemalloc, which slows every stage down while it traces allocations')
+        parser.add_argument('--storage', choices=['dense', 'sparse'], default='dense',
+                            help='store every pair, or only the pairs that have met (CAFINATOR_SPARSE_PAIRS)')
+        parser.add_argument('--label', default='', help='recorded with the results, e.g. the commit measured')
+        parser.add_argument('--output', default='', help='file to write the JSON results to, stdout if blank')
+        parser.add_argument('--force', action='store_true',
+                            help='run even though the database has members, which are deleted and restored '
+                                 'for every org and are missing for other requests meanwhile')
+
+    def handle(self, *args, **options):
+        if Member.objects.exists() and not options['force']:
+            raise CommandError('The database has members, run the benchmark on an empty database or pass --force')
+        self.results = []
+        self.trace_memory = not options['no_memory']
+        self.sparse = options['storage'] == 'sparse'
+        for size in options['sizes']:
+            try:
+                with transaction.atomic(), override_settings(CAFINATOR_SPARSE_PAIRS=self.sparse):
+                    self.run_org(size, options['history'], options['strategies'])
+                    raise Rollback()
+            except Rollback:
+                pass
+            # the stats and fragments cached from the synthetic org are gone with it
+            Meetup.data_changed()
+
+        report = json.dumps({
+            'label': options['label'],
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'memory_traced': self.trace_memory,
+            'storage': options['storage'],
+            'results': self.results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report)
+            self.stdout.write(self.style.SUCCESS(f'{len(self.results)} measurements written to {options["output"]}'))
+        else:
+            self.stdout.write(report)
+
+    def run_org(self, size, history, strategies):
+        Member.objects.all().delete()
+        with self.measure(size, 'seed_members'):
+            Member.objects.bulk_create([Member(full_name=f'Member {i:05d}', email=f'member{i}@example.com')
+                                        for i in range(size)], batch_size=1000)
+        with self.measure(size, 'make_meeting_combinations'):
+            make_meeting_combinations()
+        with self.measure(size, 'update_meetup_list'):
+            update_meetup_list()
+        with self.measure(size, 'seed_history'):
+            self.seed_history(history)
+
+        # a handful of members leave so the reconcile has real work to do
+        leavers = list(Member.objects.active().values_list('id', flat=True)[:max(1, size // 100)])
+        Member.objects.filter(pk__in=leavers).update(active=False)
+        with self.measure(size, 'update_meetup_list_changed'):
+            update_meetup_list()
+        for strategy in strategies:
+            with self.measure(size, f'create_meetings_{strategy}'):
+                create_meetings(strategy)
+
+    def seed_history(self, history):
+        # a realistic history: each past round is a round robin round over a shuffled member order
+        member_ids = list(Member.objects.active().values_list('id', flat=True))
+        random.shuffle(member_ids)
+        for round_number in range(history):
+            pairs = round_robin_round(member_ids, round_number)
+            if self.sparse:
+                store_pairs(pairs)
+            Meetup.objects.increment_pairs(pairs)
+
+    @contextmanager
+    def measure(self, size, stage):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            yield
+        seconds = time.perf_counter() - start
+        peak = 0
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        self.results.append({
+            'members': size,
+            'stage': stage,
+            'seconds': round(seconds, 4),
+            'queries': len(queries),
+            'peak_memory_kb': round(peak / 1024, 1),
+            'stored_pairs': Meetup.objects.count(),
+        })
+        self.stderr.write(f'{size:>6} {stage:<30} {seconds:9.3f}s {len(queries):>7} queries {peak / 1024:10.1f} KB')
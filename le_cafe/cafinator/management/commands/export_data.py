@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from cafinator.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, EXPORTS, export_lines
+
+
+class Command(BaseCommand):
+    help = 'Write members, pairs or the round history as NDJSON or CSV, a chunk of rows at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(EXPORTS), help='what to export')
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson', help='output format')
+        parser.add_argument('--output', help='file to write, standard output when not given')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help='rows read at a time')
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['dataset'], options['format'], options['chunk_size'])
+        if not options['output']:
+            for block in lines:
+                self.stdout.write(block, ending='')
+            return
+        with open(options['output'], 'w', newline='') as f:
+            for block in lines:
+                f.write(block)
+        self.stderr.write(f'{options["dataset"]} written to {options["output"]}')
@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cafinator.member_import import import_members, read_member_rows
+
+
+class Command(BaseCommand):
+    help = ('Add or update members from a CSV or JSON file, matched on full_name, '
+            'with the meetings updated once for the whole file')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV with a header line, or JSON (a list of objects or one per line)')
+        parser.add_argument('--format', choices=['csv', 'json'],
+                            help='format of the file, taken from its extension when not given')
+        parser.add_argument('--dry-run', action='store_true', help='check the rows without saving anything')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('csv' if options['path'].lower().endswith('.csv') else 'json')
+        try:
+            with open(options['path'], encoding='utf-8-sig') as f:
+                rows = read_member_rows(f.read(), file_format)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read {options["path"]}: {e}')
+        success, error, report = import_members(rows, options['dry_run'])
+        for rejected in report['rejected']:
+            self.stderr.write(f'Row {rejected["row"]} {rejected["full_name"]}: {json.dumps(rejected["errors"])}')
+        if success != 0:
+            raise CommandError(f'Import failed: {error}')
+        summary = (f'{report["created"]} created, {report["updated"]} updated, {report["unchanged"]} unchanged, '
+                   f'{len(report["rejected"])} rejected, pairs {report["pairs"]}')
+        if options['dry_run']:
+            self.stdout.write(f'Dry run, nothing saved: {summary}')
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cafinator.meeting import PAIRING_STRATEGIES, create_meetings
+from cafinator.models import Team
+from cafinator.teams import TEAM_TIMEOUT, TEAM_WORKERS, generate_team_rounds
+from cafinator.views import get_latest_meeting_record
+
+
+class Command(BaseCommand):
+    help = 'Set the next round of meetings for the active members'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strategy', choices=sorted(PAIRING_STRATEGIES), default='random',
+                            help='pairing strategy used to pick the round')
+        parser.add_argument('--team', nargs='+', default=[],
+                            help='names of the teams to set a round for, each in its own transaction')
+        parser.add_argument('--all-teams', action='store_true',
+                            help='set a round for every team, in parallel worker processes')
+        parser.add_argument('--workers', type=int, default=TEAM_WORKERS, help='worker processes for the teams')
+        parser.add_argument('--timeout', type=int, default=TEAM_TIMEOUT,
+                            help='seconds the teams may take, a team still running is rolled back')
+
+    def handle(self, *args, **options):
+        if options['team'] or options['all_teams']:
+            self.make_team_rounds(options)
+            return
+        if create_meetings(options['strategy'])[0] != 0:
+            raise CommandError('New meeting set failed')
+        last_mtg, last_set = get_latest_meeting_record()
+        self.stdout.write(last_mtg)
+        self.stdout.write(self.style.SUCCESS(f'New meeting set created {last_set}'))
+
+    def make_team_rounds(self, options):
+        teams = None
+        if options['team']:
+            teams = list(Team.objects.filter(name__in=options['team']))
+            unknown = set(options['team']) - {team.name for team in teams}
+            if unknown:
+                raise CommandError(f'Unknown teams: {", ".join(sorted(unknown))}')
+        success, report = generate_team_rounds(options['strategy'], teams, options['workers'], options['timeout'])
+        for outcome, names in report.items():
+            for name in names:
+                self.stdout.write(f'{name}: {outcome}')
+        if success != 0:
+            raise CommandError(f'{len(report["failed"]) + len(report["timed_out"])} teams did not get a new round')
+        self.stdout.write(self.style.SUCCESS(f'New meeting sets created for {len(report["done"])} teams'))
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from cafinator.meeting import prune_unmet_pairs
+
+
+class Command(BaseCommand):
+    help = ('Delete the stored pairs that never met, run once when switching to sparse pair storage '
+            '(CAFINATOR_SPARSE_PAIRS), where a pair without a row counts as never met')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='prune with sparse storage off, the next reconcile stores the pairs again')
+
+    def handle(self, *args, **options):
+        if not settings.CAFINATOR_SPARSE_PAIRS and not options['force']:
+            raise CommandError('Sparse pair storage is off, set CAFINATOR_SPARSE_PAIRS or use --force')
+        rows = prune_unmet_pairs()
+        self.stdout.write(self.style.SUCCESS(f'{rows} pairs that never met deleted'))
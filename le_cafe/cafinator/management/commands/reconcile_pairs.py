@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cafinator.reconcile import ALL_PAIRS, reconcile_stale_pairs
+
+
+class Command(BaseCommand):
+    help = ('Bring every stored pair in line with the members, '
+            'run after a reconcile on commit failed and left the pairs stale')
+
+    def handle(self, *args, **options):
+        local_int_success, local_str_error = reconcile_stale_pairs({ALL_PAIRS: False})
+        if local_int_success != 0:
+            raise CommandError(f'Pairs not reconciled: {local_str_error}')
+        self.stdout.write(self.style.SUCCESS('Pairs reconciled'))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cafinator.jobs import JOB_TIMEOUT, claim_next_job, reclaim_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Worker that generates the rounds of meetings queued from the make meetings page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='stop once the queue is empty')
+        parser.add_argument('--sleep', type=float, default=2.0, help='seconds to wait when the queue is empty')
+        parser.add_argument('--job-timeout', type=int, default=JOB_TIMEOUT,
+                            help='seconds a job may run, its round is rolled back after that, '
+                                 'and the job of a worker that stopped is queued again')
+
+    def handle(self, *args, **options):
+        while True:
+            reclaim_stale_jobs(options['job_timeout'])
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+            run_job(job, options['job_timeout'])
+            self.stdout.write(f'Job {job.pk} {job.status}')
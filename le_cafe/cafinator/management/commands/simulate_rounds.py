@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cafinator.models import Team
+from cafinator.simulation import SIMULATION_ROUNDS, SIMULATION_STRATEGIES, Simulation
+
+
+class Command(BaseCommand):
+    help = ('Play future rounds on the current meeting counts in memory, without writing anything, '
+            'and report how fast everyone meets and how evenly the meetings spread')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=SIMULATION_ROUNDS, help='rounds to play')
+        parser.add_argument('--strategy', choices=sorted(SIMULATION_STRATEGIES), default='random',
+                            help='pairing strategy the rounds are picked with')
+        parser.add_argument('--team', help='name of the team to simulate, every team when not given')
+        parser.add_argument('--seed', type=int, help='random seed, for repeatable runs')
+        parser.add_argument('--per-round', action='store_true', help='include the metrics of every round')
+        parser.add_argument('--json', action='store_true', help='write the full report as JSON')
+
+    def handle(self, *args, **options):
+        team = None
+        if options['team']:
+            team = Team.objects.filter(name=options['team']).first()
+            if team is None:
+                raise CommandError(f'Unknown team: {options["team"]}')
+        simulation = Simulation.load(team, options['seed'])
+        report = simulation.run(options['rounds'], options['strategy'], options['per_round'])
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for row in report['per_round']:
+            self.stdout.write(f'round {row["round"]}: coverage {row["coverage"]}, variance {row["variance"]}, '
+                              f'spread {row["spread"]}, {row["ms"]} ms')
+        self.stdout.write(f'{report["members"]} members, {report["pairs"]} pairs, '
+                          f'{report["meetings_per_round"]} meetings a round, {report["strategy"]} strategy')
+        for stage in ('start', 'end'):
+            metrics = report[stage]
+            self.stdout.write(f'{stage}: coverage {metrics["coverage"]}, mean {metrics["mean"]}, '
+                              f'variance {metrics["variance"]}, min {metrics["min"]}, max {metrics["max"]}')
+        full = report['rounds_to_full_coverage']
+        self.stdout.write(f'everyone has met after {full} rounds' if full is not None
+                          else f'not everyone has met after {report["rounds"]} rounds')
+        self.stdout.write(self.style.SUCCESS(f'{report["rounds"]} rounds, {report["round_ms"]["mean"]} ms a round, '
+                                             f'{report["rounds_per_second"]} rounds a second'))
@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+import cafinator.meeting  # noqa: F401 registers the timed stages
+from cafinator.timing import report, reset
+
+
+class Command(BaseCommand):
+    help = ('Show the latency histograms of the timed meeting stages, summed over the processes sharing the cache. '
+            'A process adds its timings to the cache at most FLUSH_INTERVAL seconds after timing a call')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='write the full histograms as JSON')
+        parser.add_argument('--reset', action='store_true', help='clear the histograms after the report')
+
+    def handle(self, *args, **options):
+        stages = report()
+        if options['json']:
+            self.stdout.write(json.dumps(stages, indent=2))
+        elif not stages:
+            self.stdout.write('No timings recorded')
+        else:
+            self.stdout.write(f'{"stage":<32}{"timed":>8}{"calls":>8}{"mean ms":>10}{"p50":>8}{"p90":>8}{"p99":>8}')
+            for name, stage in stages.items():
+                self.stdout.write(f'{name:<32}{stage["timed"]:>8}{stage["estimated_calls"] or "":>8}'
+                                  f'{stage["mean_ms"]:>10}{_bound(stage["p50_ms"]):>8}'
+                                  f'{_bound(stage["p90_ms"]):>8}{_bound(stage["p99_ms"]):>8}')
+        if options['reset']:
+            reset()
+            self.stdout.write(self.style.SUCCESS('Timings cleared'))
+
+
+def _bound(in_ms):
+    # percentiles are bucket upper bounds, None is the open bucket above the last bound
+    return f'<={in_ms}' if in_ms is not None else 'slower'
@@ -1,18 +1,40 @@
 import logging
 import random
-from django.db import connection
+import time
 
-from .models import Meetup, Member, MeetRecord, Reference
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+
+from .mailer import MAIL_BATCH_SIZE, MAIL_RETRIES, MAIL_WORKERS
+from .models import MeetPair, Meetup, Member, MeetRecord, Reference
+from .optimizer import select_optimized_pairs
+from .pairing import select_matching_pairs, select_round_robin_pairs
+from .querystats import log_queries
+from .state import get_team_combinations, select_array_pairs
+from .timing import timed
 
 logger = logging.getLogger('coffee_log')
 
+BULK_BATCH_SIZE = 500
+# seconds select_random_pairs may spend picking a round, it returns the meetings found so far after that
+RANDOM_PAIRS_BUDGET = 5.0
+# meetings checked between looks at the clock
+DEADLINE_CHECK_EVERY = 1000
+# a pair is current while both members are active and still in the team the pair was made for
+CURRENT_PAIR = Q(member_low__active=True, member_high__active=True) & (
+    Q(team__isnull=True, member_low__team__isnull=True, member_high__team__isnull=True)
+    | Q(member_low__team=F('team'), member_high__team=F('team')))
+
 
+@timed()
+@log_queries('fix_combination_detail')
 def fix_combination_detail():
     """
     Retrospectively add the detail names to the model. Should not be required in future
     Admin function to update the Meetup data (combination of who's meeting who) with actual names
     and not just the primary keys referring to the members
-    eg. 1|2 adding Jack|Jill in a secondary column
+    eg. (1, 2) adding Jack|Jill in a secondary column
 
     Parameters
     ==========
@@ -21,99 +43,100 @@ def fix_combination_detail():
     =======
     local_int_success - pass or fail
     """
-    logger.info('Start')
     local_int_success = 1
-    objects = Meetup.objects.all()
+    objects = list(Meetup.objects.all())
     members = list(Member.objects.values_list('id', 'full_name'))
     dict_members = {key: value for key, value in members}
     try:
         for obj in objects:
-            combo = str(obj.combination)
-            parts = combo.split('|')
-            person_1 = dict_members.get(int(parts[0]))
-            person_2 = dict_members.get(int(parts[1]))
+            person_1 = dict_members.get(obj.member_low_id)
+            person_2 = dict_members.get(obj.member_high_id)
             detail_names = person_1 + ' | ' + person_2
             obj.named = detail_names
-            obj.save()
+        Meetup.objects.bulk_update(objects, ['named'], batch_size=BULK_BATCH_SIZE)
+        Meetup.data_changed()
 
         local_int_success = 0
     except Exception as e:
         logger.error(f'Encountered {e}')
     finally:
-        logger.info('END')
         return local_int_success
 
 
-def add_meetings(in_lis_mtg):
+@timed()
+def add_meetings(in_lis_mtg, in_int_meetings=0):
     """
     Creates all possible combinations of meetings between all members listed
     Has no exclusions for existing combinations or inactive members
-    Was good for a start but little to no value as from Mar 21
+    The rows are written with a single bulk_create rather than one insert per combination
 
     Parameters
     ==========
-    in_lis_mtg : meetings list
+    in_lis_mtg : meetings list of member pk pairs [(1, 2),]
+    in_int_meetings : meetings the pairs start at
     Returns
     =======
     local_int_success - pass or fail
     local_str_error - error generated internally
+    local_int_incomplete - number of combinations not created
     """
-    logger.info('Start')
     local_int_success = 1
     local_str_error = ''
     local_int_target = len(in_lis_mtg)
     local_int_actual = 0
     try:
-        members = list(Member.objects.values_list('id', 'full_name'))
-        dict_members = {key: value for key, value in members}
-        for perm in in_lis_mtg:
-            combo = str(perm)
-            parts = combo.split('|')
-            person_1 = dict_members.get(int(parts[0]))
-            person_2 = dict_members.get(int(parts[1]))
+        members = Member.objects.values_list('id', 'full_name', 'team_id')
+        dict_members = {key: (name, team) for key, name, team in members}
+        new_meetups = []
+        for low, high in in_lis_mtg:
+            person_1, team = dict_members.get(low)
+            person_2, team_2 = dict_members.get(high)
             detail_names = person_1 + ' | ' + person_2
-            Meetup.objects.create(combination=perm, active=True, named=detail_names)
-            local_int_actual += 1
+            new_meetups.append(Meetup(member_low_id=low, member_high_id=high, active=True, named=detail_names,
+                                      team_id=team, meetings=in_int_meetings))
+        local_int_actual = len(Meetup.objects.bulk_create(new_meetups, batch_size=BULK_BATCH_SIZE))
+        Meetup.data_changed()
         local_int_success = 0
     except Exception as e:
         logger.error(f'Encountered {e}')
         local_str_error = f'{e}'
     finally:
         local_int_incomplete = local_int_target - local_int_actual
-        logger.info('END')
         return local_int_success, local_str_error, local_int_incomplete
 
 
+@timed()
 def make_permutations_all_new():
     """
     using only active members create the permutations of meetings
     Only for use with a blank canvas with no pre-existing meetings
     @30/3/21 untested due to amendment of the method below to
+    With sparse pair storage nothing is stored, the pairs are only returned
     """
-    logger.info('Start')
     members = list(Member.objects.values_list('id', 'full_name'))
     dict_members = {key: value for key, value in members}
-    member_ids = list(Member.objects.active().order_by('id').values_list('id', flat=True))
-    permutations = []
-    while len(member_ids) > 1:
-        for m in member_ids[1:]:
-            permutations.append(str(member_ids[0]) + '|' + str(m))
-        member_ids.pop(0)
+    team_combinations = get_team_combinations()
+    permutations = list(team_combinations)
+    if settings.CAFINATOR_SPARSE_PAIRS:
+        return permutations
 
     # now create this into the object Meetup
-    for perm in permutations:
-        combo = str(perm)
-        parts = combo.split('|')
-        person_1 = dict_members.get(int(parts[0]))
-        person_2 = dict_members.get(int(parts[1]))
+    new_meetups = []
+    for low, high in permutations:
+        person_1 = dict_members.get(low)
+        person_2 = dict_members.get(high)
         detail_names = person_1 + ' | ' + person_2
-        Meetup.objects.create(combination=perm, active=True, named=detail_names)
+        new_meetups.append(Meetup(member_low_id=low, member_high_id=high, active=True, named=detail_names,
+                                  team_id=team_combinations[(low, high)]))
+    Meetup.objects.bulk_create(new_meetups, batch_size=BULK_BATCH_SIZE)
+    Meetup.data_changed()
 
     new_objects = Meetup.objects.count()
     logger.info(f'Meetups created {new_objects}')
     return permutations
 
 
+@timed()
 def get_meetings(in_str_set):
     """
     Function to return the queryset of meetup list selected based on the input value
@@ -126,16 +149,19 @@ def get_meetings(in_str_set):
     =======
     local_int_success - pass or fail
     local_str_error - error generated internally
-    meetings - list of tuple
+    meetings - list of tuple [((1, 2), True),]
     """
-    logger.info('Start')
     local_int_success = 1
     local_str_error = ''
     try:
         if in_str_set == 'all':
-            meetings = list(Meetup.objects.all().values_list('combination', 'active'))
+            qs = Meetup.objects.all().values_list('member_low_id', 'member_high_id', 'active')
         elif in_str_set == 'active':
-            meetings = list(Meetup.objects.active().values_list('combination', 'active'))
+            qs = Meetup.objects.active().values_list('member_low_id', 'member_high_id', 'active')
+        else:
+            qs = None
+        if qs is not None:
+            meetings = [((low, high), active) for low, high, active in qs]
         else:
             meetings = None
         local_int_success = 0
@@ -143,53 +169,50 @@ def get_meetings(in_str_set):
         logger.error(f'Encountered {e}')
         local_str_error = f'{e}'
     finally:
-        logger.info('END')
         # return local_int_success, local_str_error
         # TODO refactor return
         return meetings
 
 
-def make_meeting_combinations():
+@timed()
+def make_meeting_combinations(in_team=None):
     """
-    using only active members create the permutations of meetings
+    using only active members create the permutations of meetings, members only meet their own team
     this will be used to either make meetup records, set them as active or inactive
     Parameters
     ==========
-    None
+    in_team : Team or pk to limit the pairs to, all teams when None
     Returns
     =======
     local_int_success - pass or fail
     local_str_error - error generated internally
-    local_lis_permutations - all permutations of meetings for active members ('3|5')
+    local_lis_permutations - all permutations of meetings for active members [(3, 5),]
     """
-    logger.info('Start')
     local_int_success = 1
     local_str_error = ''
     try:
-        # members = list(Member.objects.values_list('id', 'full_name'))
-        # dict_members = {key: value for key, value in members}
-        member_ids = list(Member.objects.active().order_by('id').values_list('id', flat=True))
-        permutations = []
-        while len(member_ids) > 1:
-            for m in member_ids[1:]:
-                permutations.append(str(member_ids[0]) + '|' + str(m))
-            member_ids.pop(0)
-
+        permutations = list(get_team_combinations(in_team))
         local_int_success = 0
     except Exception as e:
         logger.error(f'Encountered {e}')
         local_str_error = f'{e}'
 
     finally:
-        logger.info('END')
         # return local_int_success, local_str_error TODO
         return permutations
 
 
+@timed()
+@log_queries('update_meetup_list')
 def update_meetup_list():
     """
-    Function to be called each time a team member is added, removed or made inactive
+    Function to be called each time a team member is added, removed, made inactive or moved to another team
     This will then add/remove/deactivate the meetings associated with the member
+    Meetups are (de)activated with one update each, joined on the status and team of both members,
+    the active combinations are then compared to the stored ones as a set and the missing ones
+    bulk created, so the number of queries does not grow with the number of members.
+    A stored pair whose members have since joined the same new team is moved to that team.
+    With sparse pair storage nothing is created, the missing pairs count as never met
     Parameters
     ==========
     None
@@ -197,109 +220,319 @@ def update_meetup_list():
     =======
     local_int_success - pass or fail
     local_str_error - error generated internally
+    local_int_missed - number of new meetups that could not be created
+    local_dict_summary - rows activated, deactivated and created
     """
-    logger.info('Start')
     local_int_success = 1
     local_str_error = ''
     local_int_missed = 0
+    local_dict_summary = {'activated': 0, 'deactivated': 0, 'created': 0}
     try:
-        current_meetings = get_meetings('all')  # [('1|2', True),]
-        active_member_combos = make_meeting_combinations()  # ['1|2',]
-        for meeting in current_meetings:
-            if (meeting[0] in active_member_combos) and meeting[1]:
-                # active meeting found, remove it from the list, items remaining will be new or inactive
-                active_member_combos.remove(meeting[0])
-            elif (meeting[0] in active_member_combos) and not meeting[1]:
-                local_obj_meeting = Meetup.objects.get(combination=meeting[0])
-                local_obj_meeting.active = True
-                local_obj_meeting.save()
-                active_member_combos.remove(meeting[0])
-            elif meeting[0] not in active_member_combos:
-                # as above but set to inactive
-                local_obj_meeting = Meetup.objects.get(combination=meeting[0])
-                local_obj_meeting.active = False
-                local_obj_meeting.save()
-                logger.info(f'Meeting {meeting[0]} can not be active any more, updated')
-            else:
-                logger.warning(f'Meetup {meeting[0]} conditions are unusual: {meeting[1]}')
-
-        logger.info(f'remaining meetings to add {len(active_member_combos)}')
-        if len(active_member_combos) > 0:
-            local_int_success, local_str_error, local_int_missed = add_meetings(active_member_combos)
+        local_dict_summary['activated'] = Meetup.objects.deactive().filter(CURRENT_PAIR).update(active=True)
+        local_dict_summary['deactivated'] = Meetup.objects.active().exclude(CURRENT_PAIR).update(active=False)
+        if settings.CAFINATOR_SPARSE_PAIRS:
+            local_dict_summary['activated'] += move_stored_pairs()
+            Meetup.data_changed()
         else:
-            local_int_missed = 0
+            active_member_combos = get_team_combinations()  # {(1, 2): team,}
+            existing_combos = {(low, high): active for low, high, active in
+                               Meetup.objects.values_list('member_low_id', 'member_high_id', 'active')}
+            # team: [(1, 2),] stored pairs that are still inactive with their members in a new team
+            moved_combos = {}
+            for pair, team in active_member_combos.items():
+                if existing_combos.get(pair) is False:
+                    moved_combos.setdefault(team, []).append(pair)
+            for team, pairs in moved_combos.items():
+                for start in range(0, len(pairs), BULK_BATCH_SIZE):
+                    local_dict_summary['activated'] += Meetup.objects.pairs(
+                        pairs[start:start + BULK_BATCH_SIZE]).update(team_id=team, active=True)
+            Meetup.data_changed()
+
+            new_combos = sorted(pair for pair in active_member_combos if pair not in existing_combos)
+            logger.debug('remaining meetings to add %s', len(new_combos))
+            if new_combos:
+                local_int_success, local_str_error, local_int_missed = add_meetings(new_combos)
+                local_dict_summary['created'] = len(new_combos) - local_int_missed
+        if local_str_error == '':
+            local_int_success = 0
+    except Exception as e:
+        logger.error(f'Encountered {e}')
+        local_str_error = f'{e}'
+    finally:
+        logger.debug('meetup list updated %s', local_dict_summary)
+        return local_int_success, local_str_error, local_int_missed, local_dict_summary
+
+
+@timed()
+def move_stored_pairs():
+    """
+    Activate the stored pairs whose members are active teammates again, in a team other than the
+    one the pair was made for, found in the database rather than from every combination
+    Returns
+    =======
+    rows - number of pairs moved
+    """
+    qs = Meetup.objects.deactive().filter(member_low__active=True, member_high__active=True).filter(
+        Q(member_low__team=F('member_high__team'))
+        | Q(member_low__team__isnull=True, member_high__team__isnull=True))
+    moved = {}  # team: [meetup pk,]
+    for pk, team in qs.values_list('id', 'member_low__team_id'):
+        moved.setdefault(team, []).append(pk)
+    rows = 0
+    for team, pks in moved.items():
+        for start in range(0, len(pks), BULK_BATCH_SIZE):
+            rows += Meetup.objects.filter(pk__in=pks[start:start + BULK_BATCH_SIZE]).update(team_id=team, active=True)
+    return rows
+
+
+@timed()
+def store_pairs(in_lis_mtg, in_dict_members=None):
+    """
+    Write a Meetup row, at 0 meetings, for each pair not stored yet. With sparse pair storage
+    a pair only gets its row once it meets
+    Parameters
+    ==========
+    in_lis_mtg : member pk pairs [(1, 2),]
+    in_dict_members : the Members of the pairs by pk, read when not given
+    Returns
+    =======
+    rows - number of pairs written, pairs already stored are left as they are
+    """
+    member_ids = {pk for pair in in_lis_mtg for pk in pair}
+    dict_members = in_dict_members or Member.objects.only('full_name', 'team', 'active').in_bulk(member_ids)
+    new_meetups = []
+    for low, high in in_lis_mtg:
+        person_1, person_2 = dict_members[low], dict_members[high]
+        if not (person_1.active and person_2.active and person_1.team_id == person_2.team_id):
+            raise ValueError(f'{person_1.full_name} and {person_2.full_name} are not active teammates')
+        new_meetups.append(Meetup(member_low_id=low, member_high_id=high, team_id=person_1.team_id,
+                                  named=person_1.full_name + ' | ' + person_2.full_name))
+    created = Meetup.objects.bulk_create(new_meetups, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+    return len(created)
+
+
+@timed()
+def prune_unmet_pairs():
+    """
+    Delete the stored pairs that never met, which sparse pair storage leaves implicit.
+    A single DELETE, so the rows are not loaded to send the delete signals
+    Returns
+    =======
+    rows - number of pairs deleted
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {connection.ops.quote_name(Meetup._meta.db_table)} WHERE meetings = 0')
+        rows = cursor.rowcount
+    Meetup.data_changed()
+    logger.debug('unmet pairs pruned %s', rows)
+    return rows
+
+
+@timed()
+def add_member_pairs(in_obj_member):
+    """
+    Create the pairs of one member with the active members of their team that are not stored yet,
+    a stored pair still inactive is (re)activated for the member's current team.
+    Reads and writes only the rows of this member, so the cost grows with the team not its square.
+    With sparse pair storage no pairs are created
+    Parameters
+    ==========
+    in_obj_member : the active Member
+    Returns
+    =======
+    local_int_success - pass or fail
+    local_str_error - error generated internally
+    local_int_missed - number of new meetups that could not be created
+    local_dict_summary - rows activated and created
+    """
+    local_int_success = 1
+    local_str_error = ''
+    local_int_missed = 0
+    local_dict_summary = {'activated': 0, 'created': 0}
+    try:
+        member_pk = in_obj_member.pk
+        stored = {(low, high): active for low, high, active in
+                  Meetup.objects.involving(member_pk).values_list('member_low_id', 'member_high_id', 'active')}
+        pairs = [(min(member_pk, other), max(member_pk, other)) for other in
+                 Member.objects.teammates(in_obj_member).values_list('id', flat=True)]
+        inactive_pairs = [pair for pair in pairs if stored.get(pair) is False]
+        for start in range(0, len(inactive_pairs), BULK_BATCH_SIZE):
+            local_dict_summary['activated'] += Meetup.objects.pairs(
+                inactive_pairs[start:start + BULK_BATCH_SIZE]).update(team_id=in_obj_member.team_id, active=True)
+        Meetup.data_changed()
+
+        new_pairs = [pair for pair in pairs if pair not in stored]
+        if new_pairs and not settings.CAFINATOR_SPARSE_PAIRS:
+            local_int_success, local_str_error, local_int_missed = add_meetings(new_pairs)
+            local_dict_summary['created'] = len(new_pairs) - local_int_missed
+        if local_str_error == '':
+            local_int_success = 0
+    except Exception as e:
+        logger.error(f'Encountered {e}')
+        local_str_error = f'{e}'
+    finally:
+        logger.debug('member pairs added %s', local_dict_summary)
+        return local_int_success, local_str_error, local_int_missed, local_dict_summary
+
+
+@timed()
+def deactivate_member_pairs(in_obj_member):
+    """
+    Deactivate every active pair of one member, with a single update on the member columns
+    Returns
+    =======
+    local_int_success - pass or fail
+    local_str_error - error generated internally
+    local_int_rows - number of pairs deactivated
+    """
+    local_int_success = 1
+    local_str_error = ''
+    local_int_rows = 0
+    try:
+        local_int_rows = Meetup.objects.involving(in_obj_member.pk).filter(active=True).update(active=False)
+        Meetup.data_changed()
         local_int_success = 0
     except Exception as e:
         logger.error(f'Encountered {e}')
         local_str_error = f'{e}'
     finally:
+        logger.debug('member pairs deactivated %s', local_int_rows)
+        return local_int_success, local_str_error, local_int_rows
 
-        logger.info('END')
-        return local_int_success, local_str_error, local_int_missed
+
+@timed()
+def reactivate_member_pairs(in_obj_member):
+    """
+    Reactivate the inactive pairs of one member that are current again, i.e. with an active member
+    of the team the pair was made for, with a single update on the member columns
+    Returns
+    =======
+    local_int_success - pass or fail
+    local_str_error - error generated internally
+    local_int_rows - number of pairs reactivated
+    """
+    local_int_success = 1
+    local_str_error = ''
+    local_int_rows = 0
+    try:
+        local_int_rows = Meetup.objects.involving(in_obj_member.pk).filter(active=False).filter(
+            CURRENT_PAIR).update(active=True)
+        Meetup.data_changed()
+        local_int_success = 0
+    except Exception as e:
+        logger.error(f'Encountered {e}')
+        local_str_error = f'{e}'
+    finally:
+        logger.debug('member pairs reactivated %s', local_int_rows)
+        return local_int_success, local_str_error, local_int_rows
 
 
-def record_meetup(in_lis_meeting_names):
+@timed()
+def update_member_pairs(in_obj_member, in_bool_moved=False):
     """
-    Write the meetup record to the database
+    Bring the pairs of one member in line after it was added, (de)activated or moved to another team,
+    through the delta operations above rather than a reconcile of every pair
+    Parameters
+    ==========
+    in_obj_member : the saved Member
+    in_bool_moved : the member changed team, so the pairs with the old team go
+    Returns
+    =======
+    same as update_meetup_list
+    """
+    local_int_missed = 0
+    local_dict_summary = {'activated': 0, 'deactivated': 0, 'created': 0}
+    local_int_success, local_str_error = 0, ''
+    if not in_obj_member.active or in_bool_moved:
+        local_int_success, local_str_error, local_dict_summary['deactivated'] = deactivate_member_pairs(in_obj_member)
+    if in_obj_member.active and local_int_success == 0:
+        local_int_success, local_str_error, local_dict_summary['activated'] = reactivate_member_pairs(in_obj_member)
+    if in_obj_member.active and local_int_success == 0:
+        local_int_success, local_str_error, local_int_missed, added = add_member_pairs(in_obj_member)
+        local_dict_summary['activated'] += added['activated']
+        local_dict_summary['created'] = added['created']
+    return local_int_success, local_str_error, local_int_missed, local_dict_summary
+
+
+@timed()
+def record_meetup(in_lis_meeting_names, in_lis_pairs=None, in_team=None):
+    """
+    Write the meetup record to the database, with a row per pair of the round
     Parameters
     ==========
     in_lis_meeting_names e.g. Jan meets Kim
+    in_lis_pairs the member pks of the same meetings [(2, 4), (8, 12)]
+    in_team the Team or pk the round was set for, None for a round over all teams
     Returns
     =======
     local_int_success - pass or fail
     local_str_error - error generated internally
+    local_obj_record - the MeetRecord written, None when it failed
     """
-    logger.info('Start')
     local_int_success = 1
     local_str_error = ''
+    local_obj_record = None
     combined = ''
     try:
         for item in in_lis_meeting_names:
             combined += item + '\n'
         combined = combined.strip()
-        MeetRecord.objects.create(detail=combined)
+        record = MeetRecord.objects.create(detail=combined, team_id=getattr(in_team, 'pk', in_team))
+        MeetPair.objects.bulk_create([MeetPair(record=record, member_low_id=low, member_high_id=high,
+                                               recorded=record.recorded) for low, high in in_lis_pairs or []],
+                                     batch_size=BULK_BATCH_SIZE)
+        local_obj_record = record
         local_int_success = 0
     except Exception as e:
         local_str_error = f'{e}'
     finally:
-        return local_int_success, local_str_error
+        return local_int_success, local_str_error, local_obj_record
 
 
+@timed()
+@log_queries('update_meetings')
 def update_meetings(in_lis_mtg):
     """
     go update the meeting table with the meetings selected to keep track of
     unique meeting combinations - avoids the same people meeting again until
     all combinations have been used
+    The names come from a single in_bulk lookup and the counters are incremented
+    in the database (meetings = meetings + 1) so concurrent rounds can not lose a meeting.
+    With sparse pair storage the pairs meeting for the first time are stored first
     Parameters
     ==========
-    in_lis_mtg in the form of ['2|4','8|12']
+    in_lis_mtg in the form of [(2, 4), (8, 12)]
     Returns
     =======
     local_int_success - pass or fail
     local_str_error - error generated internally
+    meetings_names - e.g. Jan meeting Kim
     """
-    logger.info("Start")
     local_int_success = 1
     local_str_error = ''
     meetings_names = []
     try:
-        for item in in_lis_mtg:
-            ppl = item.split('|')
-            person_1 = Member.objects.get(pk=int(ppl[0])).full_name
-            person_2 = Member.objects.get(pk=int(ppl[1])).full_name
-            meetings_names.append(person_1 + ' meeting ' + person_2)
-            item_model = Meetup.objects.get(combination=item)
-            item_model.increment()
+        member_ids = {pk for pair in in_lis_mtg for pk in pair}
+        dict_members = Member.objects.only('full_name', 'team', 'active').in_bulk(member_ids)
+        for low, high in in_lis_mtg:
+            meetings_names.append(dict_members[low].full_name + ' meeting ' + dict_members[high].full_name)
+        with transaction.atomic():
+            if settings.CAFINATOR_SPARSE_PAIRS:
+                store_pairs(in_lis_mtg, dict_members)
+            updated = Meetup.objects.increment_pairs(in_lis_mtg)
+            if updated != len(in_lis_mtg):
+                raise ValueError(f'{len(in_lis_mtg) - updated} of the meetings are not known combinations')
 
         local_int_success = 0
     except Exception as e:
         logger.error(f'Error is {e}')
         local_str_error = f'{e}'
+        meetings_names = []
     finally:
-        logger.info('END')
         return local_int_success, local_str_error, meetings_names
 
 
+@timed()
 def get_db_value(in_sql_str, in_out_format_str):
     """
     Get a single value return from the DB, will fail if a set is returned
@@ -307,7 +540,6 @@ def get_db_value(in_sql_str, in_out_format_str):
     :param in_out_format_str: how the item should be returned
     :return:
     """
-    logger.info('Start')
     try:
         with connection.cursor() as cursor:
             cursor.execute(in_sql_str)
@@ -323,65 +555,75 @@ def get_db_value(in_sql_str, in_out_format_str):
         return None
 
 
-def get_unique_pairs(in_lis_mtg, in_lis_members):
+@timed()
+def get_unique_pairs(in_lis_mtg, in_set_members=(), in_int_limit=None, in_float_deadline=None):
     """
-    To find the first unique sets of meetings taking the items as they are in order
-    Has application when there are a small number of options
-    :param in_lis_mtg:
-    :param in_lis_members:
-    :return:
+    Walk the meetings in a random order and keep each one whose members are both still free,
+    so the pairs kept are disjoint. Neither argument is changed. The walk is a single pass over
+    the meetings, and stops early at the limit or the deadline
+    Parameters
+    ==========
+    in_lis_mtg : meetings to pick from [(3, 5),]
+    in_set_members : members already meeting, none of their meetings is picked
+    in_int_limit : most meetings to pick, all it can when None
+    in_float_deadline : time.monotonic() to stop at, no deadline when None
+    Returns
+    =======
+    unique - picked meetings [(3, 5),]
+    members - the members given and those of the picked meetings
     """
-    logger.info('Start')
     unique = []
-    members = in_lis_members
-    random.shuffle(in_lis_mtg)
-    for mtg in in_lis_mtg:
-        mtg_member = mtg.split('|')
-        if mtg_member[0] not in members and mtg_member[1] not in members:
-            members.append(mtg_member[0])
-            members.append(mtg_member[1])
-            unique.append(mtg)
+    members = set(in_set_members)
+    order = list(in_lis_mtg)
+    random.shuffle(order)
+    for checked, (low, high) in enumerate(order):
+        if in_int_limit is not None and len(unique) >= in_int_limit:
+            break
+        check_clock = in_float_deadline is not None and not checked % DEADLINE_CHECK_EVERY
+        if check_clock and time.monotonic() > in_float_deadline:
+            logger.warning(f'Pair selection stopped at the deadline after {checked} of {len(order)} meetings')
+            break
+        if low not in members and high not in members:
+            members.add(low)
+            members.add(high)
+            unique.append((low, high))
     return unique, members
 
 
-def get_random_pairs(in_lst_choices, in_int_selections, in_lst_already_chosen):
+@timed()
+def get_random_pairs(in_lst_choices, in_int_selections, in_lst_already_chosen=(), in_float_deadline=None):
     """
     makes random selections from the available sets,
-    checking that the members have not been set up for a meeting before
+    checking that the members have not been set up for a meeting before.
+    Always returns after at most one pass over the choices, with fewer selections when the
+    choices do not hold enough disjoint pairs or the deadline passes
     in_lst_choices : pairs to pick from
     in_int_selections: number of combinations to add
-    in_lst_already_chosen : combination pairs already selected
-    """
-    logger.info('Start')
-    combinations = in_lst_already_chosen
-    permutations = in_lst_choices
-    individuals = get_individuals(in_lst_already_chosen)
-    unique_pairs, all_individuals = get_unique_pairs(permutations, individuals)
-    if len(unique_pairs) <= in_int_selections:
-        logger.info('small set of pairs available')
-        return 0, unique_pairs, all_individuals
-    else:
-        new_ppl = []
-        while len(combinations) < in_int_selections:
-            pick = random.choice(permutations)
-            new_ppl = pick.split('|')
-            if new_ppl[0] not in individuals and new_ppl[1] not in individuals:
-                individuals.append(new_ppl[0])
-                individuals.append(new_ppl[1])
-                combinations.append(pick)
-        return 0, combinations, individuals
+    in_lst_already_chosen : combination pairs already selected, not changed
+    in_float_deadline : time.monotonic() to stop at
+    Returns
+    =======
+    local_int_success - pass or fail
+    local_lis_pairs - the new selections only [(3, 5),]
+    local_set_members - members of the already chosen and new selections
+    """
+    local_lis_pairs, local_set_members = get_unique_pairs(in_lst_choices, get_individuals(in_lst_already_chosen),
+                                                          in_int_selections, in_float_deadline)
+    if len(local_lis_pairs) < in_int_selections:
+        logger.debug('small set of pairs available')
+    return 0, local_lis_pairs, local_set_members
 
 
+@timed()
 def get_individuals(in_lst_combinations):
-    logger.info('Start')
-    individuals = []
-    for pair in in_lst_combinations:
-        members = pair.split('|')
-        individuals.append(members[0])
-        individuals.append(members[1])
+    individuals = set()
+    for low, high in in_lst_combinations:
+        individuals.add(low)
+        individuals.add(high)
     return individuals
 
 
+@timed()
 def get_mtg_combinations(in_qs_mtg):
     """
     Extracts meeting combinations and the combination primary key from queryset
@@ -395,13 +637,12 @@ def get_mtg_combinations(in_qs_mtg):
     meeting_combinations list
     meeting_pks list
     """
-    logger.info('Start')
     local_int_success = 1
     meeting_combinations = []
     meeting_pks = []
     try:
         for item in in_qs_mtg:
-            meeting_combinations.append(item.combination)
+            meeting_combinations.append(item.pair)
             meeting_pks.append(item.pk)
         local_int_success = 0
     except Exception as e:
@@ -410,77 +651,134 @@ def get_mtg_combinations(in_qs_mtg):
         return local_int_success, meeting_combinations, meeting_pks
 
 
-def create_meetings():
+@timed()
+def select_random_pairs(in_int_required, in_team=None):
+    """
+    Randomly pick disjoint meetings, starting with the combinations that have met the least
+    and moving up a bucket of meeting counts at a time until enough are found.
+    The buckets run from the least to the most meetings in Meetup.stats, each is walked once,
+    so it stops with the meetings found so far after the last bucket or once RANDOM_PAIRS_BUDGET seconds have passed.
+    With sparse pair storage the teammates without a stored pair are in the bucket of 0 meetings
+    Parameters
+    ==========
+    in_int_required : number of meetings to set
+    in_team : Team or pk to pick from, all teams when None
+    Returns
+    =======
+    local_int_success - pass or fail
+    planned_mtgs - selected member pairs [(3, 5),]
+    """
+    deadline = time.monotonic() + RANDOM_PAIRS_BUDGET
+    planned_mtgs = []
+    never_met = []
+    if settings.CAFINATOR_SPARSE_PAIRS:
+        stored = set(Meetup.objects.active(in_team).values_list('member_low_id', 'member_high_id'))
+        never_met = [pair for pair in get_team_combinations(in_team) if pair not in stored]
+    # from the lowest to the highest meeting count, both from the cached Meetup.stats
+    stats = Meetup.stats(in_team)
+    least = 0 if never_met or stats['least'] is None else stats['least']
+    most = 0 if stats['most'] is None else stats['most']
+    for meetings in range(least, most + 1):
+        if len(planned_mtgs) >= in_int_required or time.monotonic() > deadline:
+            break
+        pool = list(Meetup.objects.done_times(meetings, in_team).values_list('member_low_id', 'member_high_id'))
+        if meetings == 0:
+            pool.extend(never_met)
+        local_int_success, local_lis_mtgs, local_set_members = get_random_pairs(
+            pool, in_int_required - len(planned_mtgs), planned_mtgs, deadline)
+        planned_mtgs.extend(local_lis_mtgs)
+    if len(planned_mtgs) < in_int_required:
+        logger.warning(f'Only {len(planned_mtgs)} of {in_int_required} meetings could be picked')
+    return 0, planned_mtgs
+
+
+# the strategies create_meetings can use to pick a round, name: (label, selector)
+# a selector takes the number of meetings required and the team to select for
+PAIRING_STRATEGIES = {
+    'random': ('Random least met pairs', select_random_pairs),
+    'matching': ('Maximum weight matching', select_matching_pairs),
+    'array': ('Least met pairs (count matrix)', select_array_pairs),
+    'round_robin': ('Round robin, everyone meets once', select_round_robin_pairs),
+    'optimized': ('Best scored round within a time budget', select_optimized_pairs),
+}
+
+
+@timed()
+@log_queries('create_meetings')
+def create_meetings(in_str_strategy='random', in_team=None):
     """
     Managed the creation of meetings based on the number of members there are
     Completes by creating the set record in the database table
 
+    Parameters
+    ==========
+    in_str_strategy : name of the pairing strategy in PAIRING_STRATEGIES
+    in_team : Team or pk to set the round for, one round over all teams when None
     Outputs
     =======
     local_int_success : 0/1 success or failure
+    local_obj_record : the MeetRecord of the round, None when it failed
     """
-    logger.info('Start')
-    planned_mtgs = []  # to be a list of strings that represent pks for the members
-    selected_mtg_keys = []
-    selected_member_keys = []
+    planned_mtgs = []  # to be a list of tuples of the pks for the members
     local_lst_meetings = ""
-    # local_lis_mtgs looks like this  ['12|15', '2|16', '11|14', '5|9', '7|13', '3|8', '4|6']
+    local_obj_record = None
+    # planned_mtgs looks like this  [(12, 15), (2, 16), (11, 14), (5, 9), (7, 13), (3, 8), (4, 6)]
     try:
-        meetings_required = Member.meetings_to_set()
-        meetings_set = 0
-        i = 0
-        local_lis_individuals = []
-        while meetings_required > meetings_set:
-            meetings_now_reqd = meetings_required - meetings_set
-            least_allocated = Meetup.least_scheduled_combinations() + i
-            # least_allocated = get_db_value('SELECT min(meetings) FROM cafinator_meetup WHERE active = 1', 'int') + i
-            qs_first_pool = Meetup.objects.done_times(least_allocated)
-            local_int_success, local_list_pool_pairs, pool_mtg_keys = get_mtg_combinations(qs_first_pool)
-            local_int_success, local_lis_mtgs, local_lis_individuals = get_random_pairs(local_list_pool_pairs,
-                                                                                        meetings_now_reqd,
-                                                                                        planned_mtgs)
-            planned_mtgs.extend(local_lis_mtgs)
-            meetings_found = len(planned_mtgs)
-            meetings_set += meetings_found
-            i += 1
-
-        logger.info(f'meetings found {planned_mtgs}, all up {meetings_found}')
+        label, select_pairs = PAIRING_STRATEGIES[in_str_strategy]
+        meetings_required = Member.meetings_to_set(in_team)
+        local_int_success, planned_mtgs = select_pairs(meetings_required, in_team)
+        if local_int_success != 0:
+            raise ValueError(f'{label} could not select meetings')
+
+        logger.debug('meetings found %s, all up %s', planned_mtgs, len(planned_mtgs))
         local_int_success, local_str_error, local_lst_meetings = update_meetings(planned_mtgs)
-        local_int_success, local_str_error = record_meetup(local_lst_meetings)
+        if local_int_success != 0:
+            raise ValueError(f'meetings not updated {local_str_error}')
+        local_int_success, local_str_error, local_obj_record = record_meetup(local_lst_meetings, planned_mtgs,
+                                                                             in_team)
     except Exception as e:
         local_int_success = 1
+        local_obj_record = None
         logger.error(f'Error in test : {e}')
     finally:
         # assuming we have enough meetings
-        logger.info(f'The following people are meeting: {local_lst_meetings}')
-        return local_int_success
+        logger.debug('The following people are meeting: %s', local_lst_meetings)
+        return local_int_success, local_obj_record
 
 
+@timed()
 def loadconfig():
     """
-    Load the config values from the DB table
+    Load the config values from the DB table, through the Reference rows cached in this process
     parameters
     ==========
     none
     Returns
     =======
     local_int_success int 0/1
-    local_dict_config dict with the config elements
+    local_dict_config dict with the config elements, email_workers/email_batch_size/email_retries
+        from the Reference rows of the same name when there are any
     """
-    logger.info('Load config start')
+    logger.debug('Load config start')
     local_int_success = 1
     local_dict_config = {}
     try:
-        local_dict_config['email_smtp'] = Reference.objects.get(name='email_smtp').ref_str
-        local_dict_config['email_port'] = Reference.objects.get(name='email_port').ref_int
-        local_dict_config['email_from'] = Reference.objects.get(name='email_from').ref_str
-        local_dict_config['email_cc'] = Reference.objects.get(name='email_cc').ref_str
-        local_dict_config['email_subject'] = Reference.objects.get(name='email_subject').ref_str
-        local_dict_config['email_to'] = Reference.objects.get(name='email_to').ref_str
+        references = Reference.objects.cached()
+        local_dict_config['email_smtp'] = references['email_smtp'].ref_str
+        local_dict_config['email_port'] = references['email_port'].ref_int
+        local_dict_config['email_from'] = references['email_from'].ref_str
+        local_dict_config['email_cc'] = references['email_cc'].ref_str
+        local_dict_config['email_subject'] = references['email_subject'].ref_str
+        local_dict_config['email_to'] = references['email_to'].ref_str
+        # the delivery pool settings are optional, without a Reference the mailer default is used
+        for name, default in (('email_workers', MAIL_WORKERS), ('email_batch_size', MAIL_BATCH_SIZE),
+                              ('email_retries', MAIL_RETRIES)):
+            reference = references.get(name)
+            local_dict_config[name] = default if reference is None or reference.ref_int is None else reference.ref_int
         local_int_success = 0
     except Exception as e:
         local_str_error = f'Validation failed {e}'
         logger.error(local_str_error)
     finally:
-        logger.info('Config complete')
+        logger.debug('Config complete')
         return local_int_success, local_dict_config
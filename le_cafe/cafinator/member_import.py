@@ -0,0 +1,117 @@
+import csv
+import io
+import json
+import logging
+
+from django.db import transaction
+from django.forms import model_to_dict
+
+from .caching import bump_data_version
+from .forms import MemberForm
+from .meeting import BULK_BATCH_SIZE, update_meetup_list
+from .models import Member, Team
+
+logger = logging.getLogger('coffee_log')
+
+# columns read from an import, the export of members (team__name) can be imported again
+IMPORT_FIELDS = ['full_name', 'email', 'active', 'team']
+
+
+def read_member_rows(in_str_text, in_str_format):
+    """
+    Parse an import file into one dict per member
+    Parameters
+    ==========
+    in_str_text : content of the file
+    in_str_format : csv with a header line, or json, either a list of objects or one object per line
+    Returns
+    =======
+    rows - [{'full_name': 'Jan', 'team': 'Sales'},]
+    """
+    if in_str_format == 'csv':
+        rows = list(csv.DictReader(io.StringIO(in_str_text)))
+    elif in_str_text.lstrip().startswith('['):
+        rows = json.loads(in_str_text)
+    else:
+        rows = [json.loads(line) for line in in_str_text.splitlines() if line.strip()]
+    for row in rows:
+        if 'team' not in row and 'team__name' in row:
+            row['team'] = row['team__name']
+    return rows
+
+
+def import_members(in_lis_rows, in_bool_dry_run=False):
+    """
+    Create or update the members in the rows, matched on full_name, and reconcile the pairs once for all of them.
+    Each row is checked with the MemberForm rules, a column left out keeps the value the member has,
+    and a new member is active unless the row says otherwise. The team is given by name.
+    Members are written with bulk_create and bulk_update and everything runs in one transaction,
+    so nothing is kept when the reconciliation fails
+    Parameters
+    ==========
+    in_lis_rows : member dicts as from read_member_rows
+    in_bool_dry_run : check and count the rows, then roll back
+    Returns
+    =======
+    local_int_success - pass or fail
+    local_str_error - error generated internally
+    local_dict_report - numbers created, updated and unchanged, the rejected rows with their errors,
+        and the pairs activated, deactivated and created
+    """
+    local_int_success = 1
+    local_str_error = ''
+    local_dict_report = {'created': 0, 'updated': 0, 'unchanged': 0, 'rejected': [], 'pairs': {}}
+    try:
+        teams = dict(Team.objects.values_list('name', 'id'))
+        names = {str(row.get('full_name') or '').strip() for row in in_lis_rows}
+        existing = Member.objects.in_bulk(names - {''}, field_name='full_name')
+        new_members, changed_members, changed_fields, seen = [], [], set(), set()
+        for line, row in enumerate(in_lis_rows, start=1):
+            name = str(row.get('full_name') or '').strip()
+            member = existing.get(name)
+            data = model_to_dict(member, IMPORT_FIELDS) if member else {'active': True}
+            data.update({field: row[field] for field in IMPORT_FIELDS if row.get(field) not in (None, '')})
+            errors = {}
+            if name in seen:
+                errors['full_name'] = ['Appears more than once in the import']
+            if member is None or 'team' in row:
+                team = row.get('team')
+                data['team'] = teams.get(team) if team not in (None, '') else None
+                if team not in (None, '') and data['team'] is None:
+                    errors['team'] = [f'No team named {team}']
+            seen.add(name)
+            form = MemberForm(data, instance=member)
+            if not form.is_valid():
+                errors.update({field: list(messages) for field, messages in form.errors.items()})
+            if errors:
+                local_dict_report['rejected'].append({'row': line, 'full_name': name, 'errors': errors})
+            elif member is None:
+                new_members.append(form.save(commit=False))
+            elif form.has_changed():
+                changed_members.append(form.instance)
+                changed_fields.update(form.changed_data)
+            else:
+                local_dict_report['unchanged'] += 1
+
+        with transaction.atomic():
+            Member.objects.bulk_create(new_members, batch_size=BULK_BATCH_SIZE)
+            if changed_members:
+                Member.objects.bulk_update(changed_members, sorted(changed_fields), batch_size=BULK_BATCH_SIZE)
+            local_dict_report['created'] = len(new_members)
+            local_dict_report['updated'] = len(changed_members)
+            if new_members or changed_members:
+                bump_data_version()
+                local_int_success, local_str_error, local_int_missed, local_dict_report['pairs'] = \
+                    update_meetup_list()
+                if local_int_success != 0 or local_int_missed:
+                    raise ValueError(f'Pair reconciliation failed {local_str_error}')
+            if in_bool_dry_run:
+                transaction.set_rollback(True)
+        local_int_success = 0
+    except Exception as e:
+        logger.error(f'Encountered {e}')
+        local_int_success = 1
+        local_str_error = f'{e}'
+        local_dict_report.update(created=0, updated=0)
+    finally:
+        return local_int_success, local_str_error, local_dict_report
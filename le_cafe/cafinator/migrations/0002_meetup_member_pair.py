@@ -0,0 +1,29 @@
+# Generated by Django 3.2.15 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafinator', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='meetup',
+            name='combination',
+            field=models.CharField(max_length=10, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='meetup',
+            name='member_low',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='meetups_low', to='cafinator.member'),
+        ),
+        migrations.AddField(
+            model_name='meetup',
+            name='member_high',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='meetups_high', to='cafinator.member'),
+        ),
+    ]
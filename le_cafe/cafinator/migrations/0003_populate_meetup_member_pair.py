@@ -0,0 +1,47 @@
+# Generated by Django 3.2.15 on 2026-10-18 09:14
+
+from django.db import migrations
+
+
+def combination_to_members(apps, schema_editor):
+    """
+    Split the 'a|b' combination strings into the member foreign keys, lowest id first.
+    Combinations referring to members that no longer exist can not be kept.
+    """
+    db_alias = schema_editor.connection.alias
+    Meetup = apps.get_model('cafinator', 'Meetup')
+    Member = apps.get_model('cafinator', 'Member')
+    member_ids = set(Member.objects.using(db_alias).values_list('id', flat=True))
+    updated = []
+    orphaned = []
+    for meetup in Meetup.objects.using(db_alias).all():
+        low, high = sorted(int(part) for part in meetup.combination.split('|'))
+        if low in member_ids and high in member_ids:
+            meetup.member_low_id = low
+            meetup.member_high_id = high
+            updated.append(meetup)
+        else:
+            orphaned.append(meetup.pk)
+    Meetup.objects.using(db_alias).bulk_update(updated, ['member_low', 'member_high'], batch_size=500)
+    Meetup.objects.using(db_alias).filter(pk__in=orphaned).delete()
+
+
+def members_to_combination(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Meetup = apps.get_model('cafinator', 'Meetup')
+    updated = []
+    for meetup in Meetup.objects.using(db_alias).all():
+        meetup.combination = f'{meetup.member_low_id}|{meetup.member_high_id}'
+        updated.append(meetup)
+    Meetup.objects.using(db_alias).bulk_update(updated, ['combination'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafinator', '0002_meetup_member_pair'),
+    ]
+
+    operations = [
+        migrations.RunPython(combination_to_members, members_to_combination),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.15 on 2026-10-18 09:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafinator', '0003_populate_meetup_member_pair'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='meetup',
+            name='member_low',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='meetups_low', to='cafinator.member'),
+        ),
+        migrations.AlterField(
+            model_name='meetup',
+            name='member_high',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='meetups_high', to='cafinator.member'),
+        ),
+        migrations.RemoveField(
+            model_name='meetup',
+            name='combination',
+        ),
+        migrations.AddIndex(
+            model_name='meetup',
+            index=models.Index(fields=['active', 'meetings'], name='meetup_active_meetings_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='meetup',
+            constraint=models.UniqueConstraint(fields=('member_low', 'member_high'), name='unique_meetup_pair'),
+        ),
+        migrations.AddConstraint(
+            model_name='meetup',
+            constraint=models.CheckConstraint(check=models.Q(('member_low__lt', models.F('member_high'))), name='meetup_pair_ordered'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafinator', '0004_meetup_pair_constraints'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='meetup',
+            index=models.Index(fields=['meetings', 'id'], name='meetup_meetings_id_idx'),
+        ),
+    ]
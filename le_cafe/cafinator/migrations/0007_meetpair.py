@@ -0,0 +1,41 @@
+# Generated by Django 3.2.15 on 2026-10-18 14:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafinator', '0006_generationjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='meetrecord',
+            name='detail',
+            field=models.TextField(),
+        ),
+        migrations.CreateModel(
+            name='MeetPair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recorded', models.DateField()),
+                ('member_high', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='meet_pairs_high', to='cafinator.member')),
+                ('member_low', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='meet_pairs_low', to='cafinator.member')),
+                ('record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pairs', to='cafinator.meetrecord')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='meetpair',
+            index=models.Index(fields=['member_low', 'recorded'], name='meetpair_low_recorded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='meetpair',
+            index=models.Index(fields=['member_high', 'recorded'], name='meetpair_high_recorded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='meetpair',
+            index=models.Index(fields=['recorded'], name='meetpair_recorded_idx'),
+        ),
+    ]
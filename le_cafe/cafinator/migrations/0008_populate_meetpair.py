@@ -0,0 +1,40 @@
+# Generated by Django 3.2.15 on 2026-10-18 14:05
+
+from django.db import migrations
+
+
+def detail_to_pairs(apps, schema_editor):
+    """
+    Rebuild the pairs of the recorded rounds from the 'X meeting Y' lines of the detail text,
+    lines naming a member that no longer exists are left in the text only
+    """
+    db_alias = schema_editor.connection.alias
+    MeetRecord = apps.get_model('cafinator', 'MeetRecord')
+    MeetPair = apps.get_model('cafinator', 'MeetPair')
+    Member = apps.get_model('cafinator', 'Member')
+    members = dict(Member.objects.using(db_alias).values_list('full_name', 'id'))
+    pairs = []
+    for record in MeetRecord.objects.using(db_alias).all():
+        for line in record.detail.splitlines():
+            names = [name.strip() for name in line.split(' meeting ')]
+            if len(names) != 2 or names[0] not in members or names[1] not in members:
+                continue
+            low, high = sorted((members[names[0]], members[names[1]]))
+            pairs.append(MeetPair(record=record, member_low_id=low, member_high_id=high, recorded=record.recorded))
+    MeetPair.objects.using(db_alias).bulk_create(pairs, batch_size=500)
+
+
+def remove_pairs(apps, schema_editor):
+    MeetPair = apps.get_model('cafinator', 'MeetPair')
+    MeetPair.objects.using(schema_editor.connection.alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafinator', '0007_meetpair'),
+    ]
+
+    operations = [
+        migrations.RunPython(detail_to_pairs, remove_pairs),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.15 on 2026-10-18 14:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafinator', '0008_populate_meetpair'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Team',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('desc', models.CharField(blank=True, max_length=200, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='meetrecord',
+            name='team',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='records', to='cafinator.team'),
+        ),
+        migrations.AddField(
+            model_name='meetup',
+            name='team',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='meetups', to='cafinator.team'),
+        ),
+        migrations.AddField(
+            model_name='member',
+            name='team',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='members', to='cafinator.team'),
+        ),
+        migrations.AddIndex(
+            model_name='meetup',
+            index=models.Index(fields=['team', 'active', 'meetings'], name='meetup_team_active_idx'),
+        ),
+    ]
@@ -1,4 +1,26 @@
-from django.db import models
+import threading
+import time
+from collections import namedtuple
+from functools import reduce
+from operator import or_
+
+from django.core.cache import cache
+from django.db import models, transaction
+
+from .caching import bump_data_version
+
+# pairs per statement when filtering on (member_low, member_high), keeps the OR chain within SQLite's depth limit
+PAIR_BATCH_SIZE = 500
+# cached lowest and highest meeting counts of the active meetups
+MEETUP_STATS_KEY = 'cafinator:meetup_stats'
+MEETUP_STATS_TIMEOUT = 60 * 60
+# seconds a process keeps the Reference rows before reading them again
+REFERENCE_TTL = 5 * 60
+
+# the Reference rows of this process, see ReferenceManager.cached
+ReferenceValue = namedtuple('ReferenceValue', ['ref_int', 'ref_str'])
+_reference_cache = {'values': None, 'expires': 0.0}
+_reference_lock = threading.Lock()
 
 
 class MemberManager(models.Manager):
@@ -6,12 +28,24 @@ class MemberManager(models.Manager):
         qs = super(MemberManager, self).all().order_by('full_name')
         return qs
 
-    def active(self):
-        qs = super(MemberManager, self).filter(active=True)
+    def in_team(self, in_team=None):
+        # members of one team (Team or pk), all members when no team is given
+        qs = super(MemberManager, self).all()
+        if in_team is not None:
+            qs = qs.filter(team=in_team)
+        return qs
+
+    def active(self, in_team=None):
+        qs = self.in_team(in_team).filter(active=True)
+        return qs
+
+    def deactive(self, in_team=None):
+        qs = self.in_team(in_team).filter(active=False)
         return qs
 
-    def deactive(self):
-        qs = super(MemberManager, self).filter(active=False)
+    def teammates(self, in_obj_member):
+        # the other active members of the member's team, or the other members without a team
+        qs = super(MemberManager, self).filter(active=True, team=in_obj_member.team_id).exclude(pk=in_obj_member.pk)
         return qs
 
 
@@ -20,18 +54,48 @@ class MeetupManager(models.Manager):
         qs = super(MeetupManager, self).all()
         return qs
 
-    def active(self):
-        qs = super(MeetupManager, self).filter(active=True)
+    def in_team(self, in_team=None):
+        # meetups of one team (Team or pk), all meetups when no team is given
+        qs = super(MeetupManager, self).all()
+        if in_team is not None:
+            qs = qs.filter(team=in_team)
+        return qs
+
+    def active(self, in_team=None):
+        qs = self.in_team(in_team).filter(active=True)
+        return qs
+
+    def deactive(self, in_team=None):
+        qs = self.in_team(in_team).filter(active=False)
+        return qs
+
+    def done_times(self, in_int, in_team=None):
+        qs = self.active(in_team).filter(meetings=in_int)
         return qs
 
-    def deactive(self):
-        qs = super(MeetupManager, self).filter(active=False)
+    def involving(self, in_int_member):
+        # the pairs of one member, through the indexes on both member columns
+        qs = super(MeetupManager, self).filter(
+            models.Q(member_low_id=in_int_member) | models.Q(member_high_id=in_int_member))
         return qs
 
-    def done_times(self, in_int):
-        qs = super(MeetupManager, self).filter(active=True).filter(meetings=in_int)
+    def pairs(self, in_lis_pairs):
+        # meetups for (low, high) member pk pairs, each matched on the unique pair index
+        if not in_lis_pairs:
+            return super(MeetupManager, self).none()
+        condition = reduce(or_, (models.Q(member_low_id=low, member_high_id=high) for low, high in in_lis_pairs))
+        qs = super(MeetupManager, self).filter(condition)
         return qs
 
+    def increment_pairs(self, in_lis_pairs):
+        # add a meeting to every pair in the database itself, one update per batch of pairs
+        updated = 0
+        for start in range(0, len(in_lis_pairs), PAIR_BATCH_SIZE):
+            batch = in_lis_pairs[start:start + PAIR_BATCH_SIZE]
+            updated += self.pairs(batch).update(meetings=models.F('meetings') + 1)
+        Meetup.data_changed()
+        return updated
+
 
 class RecordManager(models.Manager):
     def all(self):
@@ -42,68 +106,242 @@ class RecordManager(models.Manager):
         qs = super(RecordManager, self).all().order_by('pk').last()
         return qs
 
+    def with_pairs(self):
+        # the pairs of each record with both members, in two queries however many records are read
+        pairs = MeetPair.objects.select_related('member_low', 'member_high').order_by('pk')
+        qs = super(RecordManager, self).all().prefetch_related(models.Prefetch('pairs', queryset=pairs))
+        return qs
+
     def last_3(self):
-        qs = super(RecordManager, self).all().order_by('-pk')[:3]
+        qs = self.with_pairs().order_by('-pk')[:3]
+        return qs
+
+
+class PairManager(models.Manager):
+    def involving(self, in_int_member):
+        qs = super(PairManager, self).filter(
+            models.Q(member_low_id=in_int_member) | models.Q(member_high_id=in_int_member)).order_by('-recorded', '-pk')
         return qs
 
+    def between(self, in_int_member, in_int_other):
+        low, high = sorted((in_int_member, in_int_other))
+        qs = super(PairManager, self).filter(member_low_id=low, member_high_id=high).order_by('-recorded', '-pk')
+        return qs
+
+
+class ReferenceManager(models.Manager):
+    def cached(self):
+        """
+        The ref_int and ref_str of every Reference by name, read with one query and kept in this process
+        for REFERENCE_TTL seconds. Saving or deleting a Reference clears it in the process making the change,
+        the other processes pick the change up when their copy expires
+        """
+        with _reference_lock:
+            if _reference_cache['values'] is None or time.monotonic() >= _reference_cache['expires']:
+                rows = super(ReferenceManager, self).values_list('name', 'ref_int', 'ref_str')
+                _reference_cache['values'] = {name: ReferenceValue(ref_int, ref_str) for name, ref_int, ref_str in rows}
+                _reference_cache['expires'] = time.monotonic() + REFERENCE_TTL
+            return _reference_cache['values']
+
+
+class JobManager(models.Manager):
+    def queued(self):
+        qs = super(JobManager, self).filter(status=GenerationJob.QUEUED).order_by('pk')
+        return qs
+
+    def stale(self, in_dt_cutoff):
+        # jobs still running that were claimed before the cutoff
+        qs = super(JobManager, self).filter(status=GenerationJob.RUNNING, started__lt=in_dt_cutoff)
+        return qs
+
+
+class Team(models.Model):
+    """
+    A department or cohort, members only ever meet members of their own team.
+    Members without a team form one more pool of their own
+    """
+    name = models.CharField(max_length=100, blank=False, null=False, unique=True)
+    desc = models.CharField(max_length=200, blank=True, null=True)
+
+    def __str__(self):
+        return self.name
+
 
 class Member(models.Model):
     full_name = models.CharField(max_length=300, blank=False, null=False, unique=True)
     active = models.BooleanField(null=False, default=True)
     email = models.EmailField(blank=True, null=True)
+    team = models.ForeignKey(Team, on_delete=models.PROTECT, related_name='members', blank=True, null=True)
     objects = MemberManager()
 
+    def __str__(self):
+        return self.full_name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # remember what the pairs depend on, so a save can tell whether they need bringing in line
+        instance = super().from_db(db, field_names, values)
+        instance.pair_fields = (instance.__dict__.get('active'), instance.__dict__.get('team_id'))
+        return instance
+
     @staticmethod
-    def meetings_to_set():
+    def meetings_to_set(in_team=None):
         # based on the number of active Members, an uneven number will result in 1 person not set up each cycle
-        active_members = Member.objects.active().count()
-        meets = active_members // 2
+        # pairs never cross teams, so without a team given it is the sum over the teams
+        team_sizes = Member.objects.active(in_team).values('team').annotate(size=models.Count('id'))
+        meets = sum(team['size'] // 2 for team in team_sizes)
         return meets
 
 
 class Meetup(models.Model):
-    combination = models.CharField(max_length=10, blank=False, null=False, unique=True)
+    member_low = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='meetups_low')
+    member_high = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='meetups_high')
     named = models.CharField(max_length=610, blank=False, null=False, unique=True, default='Fill me!')
     meetings = models.PositiveSmallIntegerField(default=0)
     active = models.BooleanField(null=False, default=True)
+    # the team both members were in when the pair was made, the pair is only active while they still are
+    team = models.ForeignKey(Team, on_delete=models.PROTECT, related_name='meetups', blank=True, null=True)
     objects = MeetupManager()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['member_low', 'member_high'], name='unique_meetup_pair'),
+            models.CheckConstraint(check=models.Q(member_low__lt=models.F('member_high')),
+                                   name='meetup_pair_ordered'),
+        ]
+        indexes = [
+            models.Index(fields=['active', 'meetings'], name='meetup_active_meetings_idx'),
+            models.Index(fields=['meetings', 'id'], name='meetup_meetings_id_idx'),
+            models.Index(fields=['team', 'active', 'meetings'], name='meetup_team_active_idx'),
+        ]
+
     def increment(self):
-        self.meetings += 1
-        self.save()
+        # incremented in the database so a concurrent increment is not overwritten
+        Meetup.objects.filter(pk=self.pk).update(meetings=models.F('meetings') + 1)
+        self.refresh_from_db(fields=['meetings'])
+        Meetup.data_changed()
         return 0
 
+    @property
+    def pair(self):
+        # the member primary keys as an ordered tuple, lowest first
+        return self.member_low_id, self.member_high_id
+
     def members(self):
-        m = []
-        pair = self.combination.split('|')
-        m.append(pair[0])
-        m.append(pair[1])
-        return m
+        return list(self.pair)
 
     @staticmethod
-    def highest_mtgs():
-        hm = Meetup.objects.active().order_by(models.F('meetings')).last()
-        return hm.meetings
+    def stats(in_team=None):
+        """
+        Lowest and highest meeting count of the active meetups, overall or of one team, from the cache
+        when it is warm so generating a round does not rescan the table for every bucket.
+        The counts of every team are cached together, from one grouped aggregate
+        """
+        stats = cache.get(MEETUP_STATS_KEY)
+        if stats is None:
+            teams = {row.pop('team'): row for row in Meetup.objects.active().values('team').annotate(
+                least=models.Min('meetings'), most=models.Max('meetings')).order_by()}
+            stats = {'least': min((row['least'] for row in teams.values()), default=None),
+                     'most': max((row['most'] for row in teams.values()), default=None),
+                     'teams': teams}
+            cache.set(MEETUP_STATS_KEY, stats, MEETUP_STATS_TIMEOUT)
+        if in_team is None:
+            return stats
+        return stats['teams'].get(getattr(in_team, 'pk', in_team), {'least': None, 'most': None})
 
     @staticmethod
-    def next_highest_mtgs():
-        nhm = Meetup.objects.active().order_by(models.F('meetings')).first()
-        return nhm.meetings
+    def clear_stats():
+        # dropped now and again on commit, so a read from another request mid transaction can not stick
+        cache.delete(MEETUP_STATS_KEY)
+        transaction.on_commit(lambda: cache.delete(MEETUP_STATS_KEY))
+
+    @staticmethod
+    def data_changed():
+        # to be called after bulk writes to meetups, which do not send the model signals
+        Meetup.clear_stats()
+        bump_data_version()
+
+    @staticmethod
+    def highest_mtgs(in_team=None):
+        return Meetup.stats(in_team)['most']
+
+    @staticmethod
+    def next_highest_mtgs(in_team=None):
+        return Meetup.stats(in_team)['least']
 
     @classmethod
-    def least_scheduled_combinations(cls):
-        qs = Meetup.objects.active().values_list('meetings', flat=True).order_by('meetings')
-        return list(qs)[0]
+    def least_scheduled_combinations(cls, in_team=None):
+        return cls.stats(in_team)['least']
 
 
 class MeetRecord(models.Model):
     recorded = models.DateField(auto_now_add=True)
-    detail = models.CharField(max_length=300, blank=False, null=False)
+    detail = models.TextField(blank=False, null=False)
+    team = models.ForeignKey(Team, on_delete=models.SET_NULL, related_name='records', blank=True, null=True)
     objects = RecordManager()
 
+    def meeting_lines(self):
+        # 'X meeting Y' per pair of the round, records from before the pairs table only have the text
+        pairs = self.pairs.all()
+        if pairs:
+            return [pair.member_low.full_name + ' meeting ' + pair.member_high.full_name for pair in pairs]
+        return self.detail.strip().splitlines()
+
+
+class MeetPair(models.Model):
+    """
+    One meeting of a round, so the history can be queried per member and date
+    """
+    record = models.ForeignKey(MeetRecord, on_delete=models.CASCADE, related_name='pairs')
+    # indexed through the (member, recorded) indexes below
+    member_low = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='meet_pairs_low', db_index=False)
+    member_high = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='meet_pairs_high', db_index=False)
+    recorded = models.DateField()
+    objects = PairManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['member_low', 'recorded'], name='meetpair_low_recorded_idx'),
+            models.Index(fields=['member_high', 'recorded'], name='meetpair_high_recorded_idx'),
+            models.Index(fields=['recorded'], name='meetpair_recorded_idx'),
+        ]
+
 
 class Reference(models.Model):
     name = models.CharField(max_length=50, blank=False, null=False, unique=True)
     desc = models.CharField(max_length=200, blank=True, null=True)
     ref_int = models.IntegerField(default=0, blank=False)
     ref_str = models.CharField(max_length=300, null=True, blank=True)
+    objects = ReferenceManager()
+
+    @staticmethod
+    def clear_cached():
+        # dropped now and again on commit, so a read from another thread mid transaction can not stick
+        _reference_cache['values'] = None
+        transaction.on_commit(lambda: _reference_cache.update(values=None))
+
+
+class GenerationJob(models.Model):
+    """
+    A request to generate a round of meetings, picked up by the run_generation_jobs worker
+    so the generation runs outside the web request
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    strategy = models.CharField(max_length=20, default='random')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    record = models.ForeignKey(MeetRecord, on_delete=models.SET_NULL, blank=True, null=True)
+    error = models.CharField(max_length=300, blank=True, default='')
+    objects = JobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='job_status_idx'),
+        ]
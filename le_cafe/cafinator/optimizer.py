@@ -0,0 +1,264 @@
+import logging
+import math
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+
+from .models import MeetPair, MeetRecord, Member
+from .state import NO_PAIR, NO_TEAM, PairState
+from .timing import timed
+
+logger = logging.getLogger('coffee_log')
+
+# what a round costs: each earlier meeting of a pair, a pair that met in the latest rounds (less the longer ago)
+# and sitting out once more for each recent round the member already sat out
+COUNT_WEIGHT = 1.0
+RECENCY_WEIGHT = 2.0
+RECENCY_ROUNDS = 6
+BYE_WEIGHT = 1.0
+# cost of a pair that is not possible (not teammates, or an inactive pair)
+IMPOSSIBLE = 1e9
+# annealing temperature at the start and end of the budget, in units of one earlier meeting
+START_TEMPERATURE = 1.0
+END_TEMPERATURE = 0.01
+# moves tried between looks at the clock
+CLOCK_EVERY = 256
+# seconds allowed on top of the budget for the workers to hand back their rounds
+RESULT_GRACE = 0.05
+
+# the teams being optimized and their greedy first rounds, set before the workers are forked
+# so they inherit them rather than unpickle them
+_problems = []
+_starts = []
+
+
+class TeamProblem:
+    """
+    The costs of one team for the search: cost[a, b] of pairing members a and b and bye[a] of
+    leaving member a out, indexes local to the team. A round is an order of the members,
+    read as pairs (order[0], order[1]), (order[2], order[3]), ... with the last member out when the team is odd
+    """
+
+    def __init__(self, rows, cost, bye):
+        self.rows = rows  # index of each member in the pair state
+        self.cost = cost
+        self.bye = bye
+
+    def unit_cost(self, order, position):
+        # cost of the pair holding a position, or of the bye
+        if position == len(order) - 1 and len(order) % 2:
+            return self.bye[order[position]]
+        return self.cost[order[position], order[position ^ 1]]
+
+    def score(self, order):
+        return float(sum(self.unit_cost(order, position) for position in range(0, len(order), 2)))
+
+
+def load_problems(in_team=None):
+    """
+    Read the pair state, the latest rounds and the teams once, and turn them into a TeamProblem per team.
+    The costs are kept per team as float32, pairs across teams are never costed
+    Returns
+    =======
+    state - the PairState
+    problems - [TeamProblem,]
+    """
+    state = PairState.load(in_team)
+    members = len(state)
+    team_of = dict(Member.objects.active(in_team).values_list('id', Coalesce('team_id', Value(NO_TEAM))))
+    teams = np.array([team_of.get(int(pk), NO_TEAM) for pk in state.member_ids], dtype=np.int64)
+    team_rows = [rows for rows in (np.flatnonzero(teams == team) for team in np.unique(teams)) if len(rows) >= 2]
+    costs = []
+    local = np.full(members, -1, dtype=np.int64)  # index of each member within its team
+    group = np.full(members, -1, dtype=np.int64)  # position of its team in team_rows
+    for position, rows in enumerate(team_rows):
+        counts = state.counts[np.ix_(rows, rows)]
+        costs.append(np.where(counts == NO_PAIR, IMPOSSIBLE, counts * COUNT_WEIGHT).astype(np.float32))
+        local[rows] = np.arange(len(rows))
+        group[rows] = position
+
+    records = MeetRecord.objects.order_by('-pk')
+    if in_team is not None:
+        records = records.filter(team=in_team)
+    records = list(records.values_list('pk', 'team_id')[:RECENCY_ROUNDS])
+    age = {pk: position for position, (pk, team) in enumerate(records)}
+    paired = np.zeros((len(records), members), dtype=bool)
+    for record, low, high in MeetPair.objects.filter(record__in=age).values_list(
+            'record_id', 'member_low_id', 'member_high_id'):
+        if low in state.index and high in state.index:
+            i, j = state.index[low], state.index[high]
+            if group[i] >= 0 and group[i] == group[j]:
+                cost, a, b = costs[group[i]], local[i], local[j]
+                penalty = RECENCY_WEIGHT * (RECENCY_ROUNDS - age[record]) / RECENCY_ROUNDS
+                if cost[a, b] < IMPOSSIBLE:
+                    cost[a, b] += penalty
+                    cost[b, a] += penalty
+            paired[age[record], [i, j]] = True
+
+    # a member sat out a round that was set for its team, or for everyone, without being in it
+    byes = np.zeros(members)
+    for position, (pk, team) in enumerate(records):
+        in_round = np.ones(members, dtype=bool) if team is None else teams == team
+        byes += in_round & ~paired[position]
+
+    problems = [TeamProblem(rows, cost, byes[rows] * BYE_WEIGHT) for rows, cost in zip(team_rows, costs)]
+    return state, problems
+
+
+def greedy_order(in_obj_problem, rng, in_float_deadline=None):
+    """
+    A first round: members in random order each take the cheapest partner still free, found with one
+    numpy pass over the member's row. Once the deadline (time.time()) passes the members still free
+    are paired in their random order
+    """
+    order = rng.permutation(len(in_obj_problem.rows))
+    free = np.ones(len(order), dtype=bool)
+    result = []
+    for a in order.tolist():
+        if not free[a]:
+            continue
+        free[a] = False
+        if in_float_deadline is not None and time.time() >= in_float_deadline:
+            result.append(a)
+            result.extend(order[free[order]].tolist())
+            break
+        if not free.any():
+            result.append(a)
+            break
+        b = int(np.argmin(np.where(free, in_obj_problem.cost[a], np.inf)))
+        free[b] = False
+        result.extend([a, b])
+    return result
+
+
+def greedy_orders(in_lis_problems, in_int_seed, in_float_deadline=None):
+    # the greedy first round of every team
+    rng = np.random.default_rng(in_int_seed)
+    return [greedy_order(problem, rng, in_float_deadline) for problem in in_lis_problems]
+
+
+def anneal(in_lis_problems, in_lis_orders, in_float_deadline, in_int_seed):
+    """
+    Simulated annealing over swaps of two members of a team, starting from the given orders,
+    until the deadline (time.time()), keeping the cheapest rounds seen
+    Returns
+    =======
+    score - total cost of the best rounds
+    orders - best order per team
+    """
+    pick = random.Random(in_int_seed)
+    orders = [list(order) for order in in_lis_orders]
+    best = [list(order) for order in orders]
+    scores = [problem.score(order) for problem, order in zip(in_lis_problems, orders)]
+    best_scores = list(scores)
+    # only teams of three or more have another round to move to
+    movable = [index for index, order in enumerate(orders) if len(order) > 2]
+    sizes = [len(orders[index]) for index in movable]
+    start = time.time()
+    span = max(in_float_deadline - start, 1e-6)
+    temperature = START_TEMPERATURE
+    moves = 0
+    while movable:
+        moves += 1
+        if not moves % CLOCK_EVERY:
+            now = time.time()
+            if now >= in_float_deadline:
+                break
+            temperature = START_TEMPERATURE * (END_TEMPERATURE / START_TEMPERATURE) ** ((now - start) / span)
+        index = pick.choices(movable, sizes)[0]
+        problem, order = in_lis_problems[index], orders[index]
+        a, b = pick.sample(range(len(order)), 2)
+        if a // 2 == b // 2:
+            continue
+        before = problem.unit_cost(order, a) + problem.unit_cost(order, b)
+        order[a], order[b] = order[b], order[a]
+        delta = float(problem.unit_cost(order, a) + problem.unit_cost(order, b) - before)
+        if delta <= 0 or pick.random() < math.exp(-delta / temperature):
+            scores[index] += delta
+            if scores[index] < best_scores[index] - 1e-9:
+                best_scores[index] = scores[index]
+                best[index] = list(order)
+        else:
+            order[a], order[b] = order[b], order[a]
+    # the running scores add up many deltas, the best rounds are scored afresh
+    return sum(problem.score(order) for problem, order in zip(in_lis_problems, best)), best
+
+
+def _search(in_float_deadline, in_int_seed):
+    # a worker's search over the problems and first rounds it inherited
+    return anneal(_problems, _starts, in_float_deadline, in_int_seed)
+
+
+def search_round(in_lis_problems, in_int_budget_ms, in_int_workers, in_int_seed=None):
+    """
+    Build the greedy first round here, then run independent annealing searches from it, one per worker
+    process, and keep the best round any of them found by the end of the budget. The greedy round counts
+    against the budget and is what is returned when no worker hands back in time.
+    Without more than one worker, on a platform without fork, or in a daemonic process such as a worker
+    of generate_team_rounds, which may not start processes of its own, it searches here
+    Returns
+    =======
+    score - total cost of the round
+    orders - order per team
+    """
+    global _problems, _starts
+    deadline = time.time() + in_int_budget_ms / 1000
+    seed = random.randrange(2 ** 32) if in_int_seed is None else in_int_seed
+    starts = greedy_orders(in_lis_problems, seed, deadline)
+    if (in_int_workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods()
+            or multiprocessing.current_process().daemon):
+        return anneal(in_lis_problems, starts, deadline, seed)
+    if time.time() >= deadline:
+        return sum(problem.score(order) for problem, order in zip(in_lis_problems, starts)), starts
+    _problems, _starts = in_lis_problems, starts
+    executor = ProcessPoolExecutor(in_int_workers, mp_context=multiprocessing.get_context('fork'))
+    try:
+        futures = [executor.submit(_search, deadline, seed + worker) for worker in range(in_int_workers)]
+        done, late = wait(futures, timeout=max(0, deadline - time.time()) + RESULT_GRACE)
+        results = [future.result() for future in done if future.exception() is None]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        _problems, _starts = [], []
+    if late:
+        logger.warning(f'{len(late)} of {in_int_workers} optimizer workers missed the budget')
+    if not results:
+        # every worker failed or was late, the greedy round stands
+        return sum(problem.score(order) for problem, order in zip(in_lis_problems, starts)), starts
+    return min(results, key=lambda result: result[0])
+
+
+@timed()
+def select_optimized_pairs(in_int_required, in_team=None):
+    """
+    Select the meetings for a round as the cheapest round found within CAFINATOR_OPTIMIZER_BUDGET_MS,
+    scored on the earlier meetings of each pair, how recently they met and how often a member
+    left out has sat out lately. The search runs on CAFINATOR_OPTIMIZER_WORKERS processes.
+    An error is raised to the caller rather than returned as a failure, so its cause is not lost
+    Parameters
+    ==========
+    in_int_required : number of meetings to set
+    in_team : Team or pk to select for, all teams when None
+    Returns
+    =======
+    local_int_success - pass, failures are raised
+    local_lis_pairs - selected member pairs [(3, 5),]
+    """
+    local_lis_pairs = []
+    state, problems = load_problems(in_team)
+    score, orders = search_round(problems, settings.CAFINATOR_OPTIMIZER_BUDGET_MS,
+                                 settings.CAFINATOR_OPTIMIZER_WORKERS)
+    for problem, order in zip(problems, orders):
+        for position in range(0, len(order) - 1, 2):
+            a, b = problem.rows[order[position]], problem.rows[order[position + 1]]
+            if problem.cost[order[position], order[position + 1]] < IMPOSSIBLE:
+                low, high = sorted((int(state.member_ids[a]), int(state.member_ids[b])))
+                local_lis_pairs.append((low, high))
+    local_lis_pairs = local_lis_pairs[:in_int_required]
+    logger.debug('optimized round of %s meetings scored %s', len(local_lis_pairs), score)
+    return 0, local_lis_pairs
@@ -0,0 +1,146 @@
+import logging
+import random
+from itertools import groupby
+
+import networkx as nx
+from django.conf import settings
+from django.db.models import F
+
+from .models import Meetup, Member, Reference
+from .state import get_team_combinations
+from .timing import timed
+
+logger = logging.getLogger('coffee_log')
+
+# random jitter added to each edge weight so equally rare pairs are not matched the same way every round
+JITTER_STEPS = 10
+# Reference row holding the number of round robin rounds already set, suffixed with the team pk for a team
+ROUND_ROBIN_REF = 'round_robin_offset'
+
+
+@timed()
+def build_meeting_graph(in_team=None):
+    """
+    Build the graph of active members where every active meetup is an edge
+    weighted by how rarely that pair has met, a pair never met before has the highest weight.
+    The weights are scaled so the random jitter can only break ties, never outweigh a meeting.
+    With sparse pair storage the teammates without a stored meetup are edges that never met
+    Parameters
+    ==========
+    in_team : Team or pk to build the graph for, all teams when None
+    Returns
+    =======
+    graph - networkx Graph with member pks as nodes
+    """
+    graph = nx.Graph()
+    graph.add_nodes_from(Member.objects.active(in_team).values_list('id', flat=True))
+    pairs = list(Meetup.objects.active(in_team).values_list('member_low_id', 'member_high_id', 'meetings'))
+    if settings.CAFINATOR_SPARSE_PAIRS:
+        stored = {(low, high) for low, high, meetings in pairs}
+        pairs.extend((low, high, 0) for low, high in get_team_combinations(in_team) if (low, high) not in stored)
+    if not pairs:
+        return graph
+    most_meetings = max(meetings for low, high, meetings in pairs)
+    scale = (graph.number_of_nodes() // 2 + 1) * JITTER_STEPS
+    for low, high, meetings in pairs:
+        weight = (most_meetings + 1 - meetings) * scale + random.randrange(JITTER_STEPS)
+        graph.add_edge(low, high, weight=weight)
+    return graph
+
+
+@timed()
+def select_matching_pairs(in_int_required, in_team=None):
+    """
+    Select the meetings for a round as a maximum weight matching (Edmonds blossom) over the
+    active members, i.e. as many meetings as possible that together have met the least.
+    Runs in polynomial time regardless of how sparse the pool of unused pairs is
+    Parameters
+    ==========
+    in_int_required : number of meetings to set
+    in_team : Team or pk to select for, all teams when None
+    Returns
+    =======
+    local_int_success - pass or fail
+    local_lis_pairs - selected member pairs [(3, 5),]
+    """
+    local_int_success = 1
+    local_lis_pairs = []
+    try:
+        graph = build_meeting_graph(in_team)
+        matching = nx.max_weight_matching(graph, maxcardinality=True)
+        local_lis_pairs = [tuple(sorted(edge)) for edge in matching][:in_int_required]
+        random.shuffle(local_lis_pairs)
+        if len(local_lis_pairs) < in_int_required:
+            logger.warning(f'Only {len(local_lis_pairs)} of {in_int_required} meetings could be matched')
+        local_int_success = 0
+    except Exception as e:
+        logger.error(f'Encountered {e}')
+    finally:
+        return local_int_success, local_lis_pairs
+
+
+def round_robin_round(in_lis_members, in_int_round):
+    """
+    Round in_int_round of the circle method schedule for the members given: the first member stays
+    put while the others rotate one place per round, so every pair meets exactly once in n - 1 rounds
+    (n rounds for an odd count, where a bye rotates through the members)
+    Parameters
+    ==========
+    in_lis_members : member pks in a stable order
+    in_int_round : round number, taken modulo the length of the schedule
+    Returns
+    =======
+    pairs - member pk pairs [(3, 5),]
+    """
+    slots = list(in_lis_members)
+    if len(slots) % 2:
+        slots.append(None)  # whoever is drawn against the bye sits this round out
+    if len(slots) < 2:
+        return []
+    rotating = slots[1:]
+    shift = in_int_round % len(rotating)
+    rotating = rotating[shift:] + rotating[:shift]
+    circle = [slots[0]] + rotating
+    half = len(circle) // 2
+    pairs = []
+    for a, b in zip(circle[:half], reversed(circle[half:])):
+        if a is not None and b is not None:
+            pairs.append((min(a, b), max(a, b)))
+    return pairs
+
+
+def round_robin_ref(in_int_team):
+    # name of the Reference row holding the rotation of a team, the members without a team use the plain name
+    return ROUND_ROBIN_REF if in_int_team is None else f'{ROUND_ROBIN_REF}_{in_int_team}'
+
+
+@timed()
+def select_round_robin_pairs(in_int_required, in_team=None):
+    """
+    Select the next round of the round robin schedule over the active members and move the
+    stored rotation on by one. Each team has a schedule and rotation of its own
+    Parameters
+    ==========
+    in_int_required : number of meetings to set
+    in_team : Team or pk to select for, the next round of every team when None
+    Returns
+    =======
+    local_int_success - pass or fail
+    local_lis_pairs - selected member pairs [(3, 5),]
+    """
+    local_int_success = 1
+    local_lis_pairs = []
+    try:
+        members = Member.objects.active(in_team).order_by('team', 'id').values_list('team_id', 'id')
+        for team, team_members in groupby(members, key=lambda member: member[0]):
+            offset, created = Reference.objects.get_or_create(
+                name=round_robin_ref(team), defaults={'desc': 'Round robin rounds set so far', 'ref_int': 0})
+            member_ids = [pk for team_pk, pk in team_members]
+            local_lis_pairs.extend(round_robin_round(member_ids, offset.ref_int))
+            Reference.objects.filter(pk=offset.pk).update(ref_int=F('ref_int') + 1)
+        local_lis_pairs = local_lis_pairs[:in_int_required]
+        local_int_success = 0
+    except Exception as e:
+        logger.error(f'Encountered {e}')
+    finally:
+        return local_int_success, local_lis_pairs
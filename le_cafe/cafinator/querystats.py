@@ -0,0 +1,110 @@
+import heapq
+import json
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('coffee_log.sql')
+
+
+class QueryStats:
+    """
+    Count and time the statements run on the connections it is installed on (as an execute wrapper),
+    keeping the slowest few
+    """
+
+    def __init__(self, name='', slowest=5):
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+        self.keep = slowest
+        self.slowest = []  # heap of (seconds, sql), the quickest of those kept on top
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            if len(self.slowest) < self.keep:
+                heapq.heappush(self.slowest, (elapsed, sql))
+            elif self.keep:
+                heapq.heappushpop(self.slowest, (elapsed, sql))
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'queries': self.count,
+            'sql_ms': round(self.seconds * 1000, 2),
+            'slowest': [{'ms': round(seconds * 1000, 2), 'sql': sql} for seconds, sql in
+                        sorted(self.slowest, reverse=True)],
+        }
+
+    def server_timing(self):
+        # the Server-Timing entry for the database, shown per request in the browser dev tools
+        return f'db;dur={self.seconds * 1000:.1f};desc="{self.count} queries"'
+
+
+@contextmanager
+def track_queries(in_str_name='', in_int_slowest=None, using=None):
+    """
+    Record the queries run inside the block on every database, or the one given
+        with track_queries('update_meetings') as stats:
+            ...
+        stats.count, stats.seconds, stats.slowest
+    """
+    stats = QueryStats(in_str_name, settings.CAFINATOR_SLOW_QUERIES if in_int_slowest is None else in_int_slowest)
+    with ExitStack() as stack:
+        for alias in ([using] if using else connections):
+            stack.enter_context(connections[alias].execute_wrapper(stats))
+        yield stats
+
+
+def log_stats(in_obj_stats, **extra):
+    # one JSON line per block or request, for the log pipeline to parse
+    logger.info(json.dumps(dict(in_obj_stats.as_dict(), **extra)))
+
+
+@contextmanager
+def log_queries(in_str_name):
+    """
+    track_queries that writes its stats to the log when CAFINATOR_QUERY_STATS is on, and does nothing otherwise
+    """
+    if not settings.CAFINATOR_QUERY_STATS:
+        yield None
+        return
+    with track_queries(in_str_name) as stats:
+        yield stats
+    log_stats(stats)
+
+
+class QueryStatsMiddleware:
+    """
+    Log the query count, SQL time and slowest statements of each request with the name of the view,
+    and add them as a Server-Timing header when CAFINATOR_SERVER_TIMING is on.
+    Only loaded when CAFINATOR_QUERY_STATS is on
+    """
+
+    def __init__(self, get_response):
+        if not settings.CAFINATOR_QUERY_STATS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with track_queries(request.path) as stats:
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - start) * 1000
+        if request.resolver_match is not None:
+            stats.name = request.resolver_match.view_name
+        log_stats(stats, path=request.path, method=request.method, status=response.status_code,
+                  total_ms=round(total_ms, 2))
+        if settings.CAFINATOR_SERVER_TIMING:
+            response['Server-Timing'] = f'{stats.server_timing()}, app;dur={total_ms:.1f}'
+        return response
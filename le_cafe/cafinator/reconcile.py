@@ -0,0 +1,100 @@
+import logging
+import threading
+import weakref
+from functools import partial
+
+from django.db import transaction
+
+from .meeting import update_meetup_list, update_member_pairs
+from .models import Member, Reference
+
+logger = logging.getLogger('coffee_log')
+
+# members whose pairs are stale in this thread, pk: moved to another team, ALL_PAIRS for everyone,
+# and a weak reference to the on_commit hook added for them (_stale.members, _stale.hook).
+# Only the transaction holds the hook, so once it rolls back and drops the hook the reference is dead
+_stale = threading.local()
+ALL_PAIRS = 'all'
+# Reference row kept while a reconcile has failed, the next reconcile or reconcile_pairs brings every pair in line
+PAIRS_STALE_REF = 'pairs_stale'
+
+
+def mark_pairs_stale(in_obj_member=None, in_bool_moved=False):
+    """
+    Note that the pairs of a member, or of everyone when no member is given, no longer match the members.
+    They are brought in line once the transaction commits, for all the members marked in it together,
+    straight away when there is no transaction
+    Parameters
+    ==========
+    in_obj_member : the Member that was added, (de)activated or moved, None after a bulk change
+    in_bool_moved : the member changed team
+    """
+    hook = _stale.hook() if getattr(_stale, 'hook', None) else None
+    registered = hook is not None
+    if not registered:
+        # the first mark of the transaction, or the last one rolled back: its hook was dropped with it,
+        # and so are the marks it was added for
+        _stale.members = {}
+        hook = partial(reconcile_stale_pairs, _stale.members)
+    pending = _stale.members
+    key = ALL_PAIRS if in_obj_member is None else in_obj_member.pk
+    pending[key] = pending.get(key, False) or in_bool_moved
+    if not registered:
+        _stale.hook = weakref.ref(hook)
+        transaction.on_commit(hook)
+
+
+def reconcile_stale_pairs(in_dict_marks=None):
+    """
+    Bring the stale pairs in line, through the delta operations for a single member
+    and one update_meetup_list for more. When it fails the pairs are recorded as stale (PAIRS_STALE_REF),
+    and the next reconcile, or the reconcile_pairs command, brings every pair in line
+    Parameters
+    ==========
+    in_dict_marks : the marks the on_commit hook was added for, the pending marks of this thread when None
+    Returns
+    =======
+    local_int_success - pass or fail
+    local_str_error - error generated internally
+    """
+    marks = getattr(_stale, 'members', None) if in_dict_marks is None else in_dict_marks
+    if marks is not None and marks is getattr(_stale, 'members', None):
+        # the hook has run, the next mark starts a new batch with a hook of its own
+        del _stale.members
+        _stale.hook = None
+    # emptied as it is taken, so a hook left behind finds nothing to do
+    pending = dict(marks or {})
+    if marks:
+        marks.clear()
+    if not pending:
+        return 0, ''
+    if pairs_left_stale():
+        pending[ALL_PAIRS] = False  # an earlier reconcile failed, this one takes every pair
+    with transaction.atomic():
+        if ALL_PAIRS in pending or len(pending) > 1:
+            local_int_success, local_str_error, local_int_missed, local_dict_summary = update_meetup_list()
+        else:
+            (pk, moved), = pending.items()
+            member = Member.objects.filter(pk=pk).first()
+            if member is None:
+                return 0, ''  # deleted, its pairs went with it
+            local_int_success, local_str_error, local_int_missed, local_dict_summary = update_member_pairs(
+                member, moved)
+        if local_int_success != 0 or local_int_missed:
+            local_int_success = 1
+            transaction.set_rollback(True)
+    if local_int_success != 0:
+        # the members stay marked stale in the database, for a later reconcile or the reconcile_pairs command
+        Reference.objects.update_or_create(name=PAIRS_STALE_REF, defaults={
+            'desc': 'Pairs left stale by a failed reconcile', 'ref_str': f'{local_str_error}'[:200]})
+        logger.error(f'Stale pairs of {len(pending)} members not reconciled: {local_str_error}')
+        return 1, local_str_error
+    if ALL_PAIRS in pending:
+        Reference.objects.filter(name=PAIRS_STALE_REF).delete()
+    logger.debug('stale pairs of %s members reconciled %s', len(pending), local_dict_summary)
+    return 0, ''
+
+
+def pairs_left_stale():
+    # a reconcile failed and no later one has brought the pairs in line yet
+    return Reference.objects.filter(name=PAIRS_STALE_REF).exists()
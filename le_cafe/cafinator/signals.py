@@ -0,0 +1,40 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import bump_data_version
+from .models import MeetRecord, Meetup, Member, Reference, Team
+from .reconcile import mark_pairs_stale
+
+
+@receiver([post_save, post_delete], sender=Member)
+@receiver([post_save, post_delete], sender=Meetup)
+@receiver([post_save, post_delete], sender=MeetRecord)
+@receiver([post_save, post_delete], sender=Team)
+def data_changed(sender, **kwargs):
+    # bulk writes bypass these signals, they go through Meetup.data_changed() instead
+    bump_data_version()
+
+
+@receiver([post_save, post_delete], sender=Meetup)
+def meetup_changed(sender, **kwargs):
+    # a single saved or deleted meetup moves the meeting counts as much as a bulk write
+    Meetup.clear_stats()
+
+
+@receiver(post_save, sender=Member)
+def member_saved(sender, instance, created, raw=False, **kwargs):
+    # a member added, (de)activated or moved to another team leaves its pairs stale until the commit
+    if raw:
+        return
+    before = getattr(instance, 'pair_fields', None)
+    instance.pair_fields = (instance.active, instance.team_id)
+    if created and not instance.active:
+        return
+    if created or before != instance.pair_fields:
+        # without the values it was loaded with, a saved member may have changed team
+        mark_pairs_stale(instance, not created and (before is None or before[1] != instance.team_id))
+
+
+@receiver([post_save, post_delete], sender=Reference)
+def reference_changed(sender, **kwargs):
+    Reference.clear_cached()
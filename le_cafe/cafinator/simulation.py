@@ -0,0 +1,181 @@
+import time
+
+import networkx as nx
+import numpy as np
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+
+from .models import Member, Reference
+from .pairing import JITTER_STEPS, round_robin_ref, round_robin_round
+from .state import NO_PAIR, NO_TEAM, PairState
+
+# rounds simulated when not told otherwise
+SIMULATION_ROUNDS = 100
+
+
+class Simulation:
+    """
+    Rounds played out on the pair state in memory, nothing is written to the database.
+    Next to the count matrix the meeting counts of the pairs are kept as a histogram with their
+    sum and sum of squares, so coverage and fairness after a round follow from the pairs of that round
+    """
+
+    def __init__(self, state, teams, offsets=None, seed=None):
+        self.state = state
+        self.teams = teams  # team pk of each row of the matrix, NO_TEAM for the members without one
+        self.offsets = offsets or {}  # round robin rounds already set per team
+        self.rng = np.random.default_rng(seed)
+        lows, highs = np.triu_indices(len(state), k=1)
+        current = state.counts[lows, highs] != NO_PAIR
+        self.lows, self.highs = lows[current], highs[current]
+        counts = state.counts[self.lows, self.highs].astype(np.int64)
+        self.histogram = np.bincount(counts, minlength=1).tolist()  # number of pairs at each meeting count
+        self.total = int(counts.sum())
+        self.squares = int((counts ** 2).sum())
+        team_ids, sizes = np.unique(teams, return_counts=True)
+        self.required = int((sizes // 2).sum())
+        self.team_rows = {int(team): np.flatnonzero(teams == team).tolist() for team in team_ids}
+        self.played = 0
+
+    @classmethod
+    def load(cls, in_team=None, seed=None):
+        """
+        The current state of the active pairs, of one team or all of them, read once
+        """
+        state = PairState.load(in_team)
+        team_of = dict(Member.objects.active(in_team).values_list('id', Coalesce('team_id', Value(NO_TEAM))))
+        teams = np.array([team_of.get(int(pk), NO_TEAM) for pk in state.member_ids], dtype=np.int64)
+        refs = {round_robin_ref(None if team == NO_TEAM else team): team for team in set(teams.tolist())}
+        offsets = {refs[name]: ref_int for name, ref_int in
+                   Reference.objects.filter(name__in=refs).values_list('name', 'ref_int')}
+        return cls(state, teams, offsets, seed)
+
+    def apply(self, in_lis_pairs):
+        # add a meeting to each pair of matrix indexes, keeping the histogram and sums in step
+        counts = self.state.counts
+        for i, j in in_lis_pairs:
+            count = int(counts[i, j])
+            counts[i, j] = counts[j, i] = count + 1
+            self.histogram[count] -= 1
+            if count + 1 == len(self.histogram):
+                self.histogram.append(0)
+            self.histogram[count + 1] += 1
+            self.total += 1
+            self.squares += 2 * count + 1
+
+    def metrics(self):
+        """
+        Coverage (share of the pairs that have met) and the fairness of the meeting counts
+        Returns
+        =======
+        metrics - {'coverage', 'mean', 'variance', 'min', 'max', 'spread'}, None values without pairs
+        """
+        pairs = len(self.lows)
+        if not pairs:
+            return dict.fromkeys(['coverage', 'mean', 'variance', 'min', 'max', 'spread'])
+        held = [count for count, number in enumerate(self.histogram) if number]
+        mean = self.total / pairs
+        return {
+            'coverage': round(1 - self.histogram[0] / pairs, 4),
+            'mean': round(mean, 4),
+            'variance': round(self.squares / pairs - mean ** 2, 4),
+            'min': held[0],
+            'max': held[-1],
+            'spread': held[-1] - held[0],
+        }
+
+    def run(self, in_int_rounds=SIMULATION_ROUNDS, in_str_strategy='random', in_bool_per_round=False):
+        """
+        Play a number of rounds with a pairing strategy
+        Parameters
+        ==========
+        in_int_rounds : rounds to play
+        in_str_strategy : name in SIMULATION_STRATEGIES, the names of PAIRING_STRATEGIES but 'optimized'
+        in_bool_per_round : add the metrics and time of every round to the report
+        Returns
+        =======
+        report - {'strategy', 'members', 'pairs', 'meetings_per_round', 'rounds', 'start', 'end',
+            'rounds_to_full_coverage', 'round_ms', 'rounds_per_second', 'per_round'}
+        """
+        select = SIMULATION_STRATEGIES[in_str_strategy]
+        report = {
+            'strategy': in_str_strategy,
+            'members': len(self.state),
+            'pairs': len(self.lows),
+            'meetings_per_round': self.required,
+            'rounds': in_int_rounds,
+            'start': self.metrics(),
+            'rounds_to_full_coverage': 0 if len(self.lows) and not self.histogram[0] else None,
+            'per_round': [],
+        }
+        seconds = np.zeros(in_int_rounds)
+        for played in range(in_int_rounds):
+            start = time.perf_counter()
+            self.apply(select(self, self.required))
+            seconds[played] = time.perf_counter() - start
+            self.played += 1
+            if report['rounds_to_full_coverage'] is None and len(self.lows) and not self.histogram[0]:
+                report['rounds_to_full_coverage'] = played + 1
+            if in_bool_per_round:
+                report['per_round'].append(dict(self.metrics(), round=played + 1,
+                                                ms=round(seconds[played] * 1000, 3)))
+        report['end'] = self.metrics()
+        milliseconds = seconds * 1000
+        report['round_ms'] = {
+            'mean': round(float(milliseconds.mean()), 3) if in_int_rounds else None,
+            'p50': round(float(np.percentile(milliseconds, 50)), 3) if in_int_rounds else None,
+            'p99': round(float(np.percentile(milliseconds, 99)), 3) if in_int_rounds else None,
+            'max': round(float(milliseconds.max()), 3) if in_int_rounds else None,
+        }
+        report['rounds_per_second'] = round(in_int_rounds / seconds.sum()) if seconds.sum() else None
+        return report
+
+
+def simulate_random(in_obj_sim, in_int_required):
+    # the least met pairs first and a random order within each meeting count, as select_random_pairs
+    counts = in_obj_sim.state.counts[in_obj_sim.lows, in_obj_sim.highs]
+    order = np.lexsort((in_obj_sim.rng.random(len(counts)), counts))
+    taken = set()
+    pairs = []
+    for i, j in zip(in_obj_sim.lows[order].tolist(), in_obj_sim.highs[order].tolist()):
+        if len(pairs) >= in_int_required:
+            break
+        if i not in taken and j not in taken:
+            taken.update((i, j))
+            pairs.append((i, j))
+    return pairs
+
+
+def simulate_matching(in_obj_sim, in_int_required):
+    # maximum weight matching with the weights of build_meeting_graph
+    counts = in_obj_sim.state.counts[in_obj_sim.lows, in_obj_sim.highs].astype(np.int64)
+    if not len(counts):
+        return []
+    scale = (len(in_obj_sim.state) // 2 + 1) * JITTER_STEPS
+    weights = (counts.max() + 1 - counts) * scale + in_obj_sim.rng.integers(JITTER_STEPS, size=len(counts))
+    graph = nx.Graph()
+    graph.add_weighted_edges_from(zip(in_obj_sim.lows.tolist(), in_obj_sim.highs.tolist(), weights.tolist()))
+    return [tuple(edge) for edge in nx.max_weight_matching(graph, maxcardinality=True)][:in_int_required]
+
+
+def simulate_array(in_obj_sim, in_int_required):
+    return in_obj_sim.state.select_round_indices(in_int_required, in_obj_sim.rng)
+
+
+def simulate_round_robin(in_obj_sim, in_int_required):
+    # each team carries on from the rounds it already had set
+    pairs = []
+    for team, rows in in_obj_sim.team_rows.items():
+        pairs.extend(round_robin_round(rows, in_obj_sim.offsets.get(team, 0) + in_obj_sim.played))
+    return pairs[:in_int_required]
+
+
+# the in memory counterparts of PAIRING_STRATEGIES, each takes the Simulation and the meetings required.
+# 'optimized' is not supported: it spends its whole time budget on every round and reads the recent rounds
+# from the database, so a simulation of it would measure the budget rather than the pairing
+SIMULATION_STRATEGIES = {
+    'random': simulate_random,
+    'matching': simulate_matching,
+    'array': simulate_array,
+    'round_robin': simulate_round_robin,
+}
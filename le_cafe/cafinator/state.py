@@ -0,0 +1,160 @@
+import logging
+from itertools import chain
+from itertools import combinations as pair_combinations
+from itertools import groupby
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+
+from .models import Meetup, Member
+from .timing import timed
+
+logger = logging.getLogger('coffee_log')
+
+# marks a cell of the count matrix that is not an active pair (the diagonal, inactive members)
+NO_PAIR = np.iinfo(np.uint16).max
+# team of the members without one in the arrays
+NO_TEAM = -1
+
+
+def get_team_combinations(in_team=None):
+    """
+    Every pair of active members that are in the same team, members without a team
+    are paired among themselves
+    Parameters
+    ==========
+    in_team : Team or pk to limit the pairs to, all teams when None
+    Returns
+    =======
+    team_combinations - dict of member pk pair to the pk of their team {(3, 5): 2,}
+    """
+    members = Member.objects.active(in_team).order_by('team', 'id').values_list('team_id', 'id')
+    team_combinations = {}
+    for team, team_members in groupby(members, key=lambda member: member[0]):
+        member_ids = [pk for team_pk, pk in team_members]
+        team_combinations.update(dict.fromkeys(pair_combinations(member_ids, 2), team))
+    return team_combinations
+
+
+class PairState:
+    """
+    The meeting counts of all active pairs held as a dense, symmetric matrix so a round can be
+    selected with array operations instead of querysets.
+    Row/column i of the matrix belongs to the member with pk member_ids[i]
+    """
+
+    def __init__(self, member_ids, counts):
+        self.member_ids = member_ids
+        self.counts = counts
+        self.index = {int(pk): i for i, pk in enumerate(member_ids)}
+
+    @classmethod
+    @timed('PairState.load')
+    def load(cls, in_team=None):
+        """
+        Build the state from the active meetups, of one team or all of them, with a single query.
+        With sparse pair storage the active members are read as well and every pair of
+        teammates without a stored meetup starts at 0
+        """
+        qs = Meetup.objects.active(in_team).values_list('member_low_id', 'member_high_id', 'meetings')
+        rows = np.fromiter(chain.from_iterable(qs.iterator(chunk_size=10000)), dtype=np.int64).reshape(-1, 3)
+        lows, highs, meetings = rows[:, 0], rows[:, 1], rows[:, 2]
+        if settings.CAFINATOR_SPARSE_PAIRS:
+            members = Member.objects.active(in_team).order_by('id').values_list(
+                'id', Coalesce('team_id', Value(NO_TEAM)))
+            members = np.fromiter(chain.from_iterable(members.iterator(chunk_size=10000)),
+                                  dtype=np.int64).reshape(-1, 2)
+            member_ids, teams = members[:, 0], members[:, 1]
+            counts = np.where(teams[:, np.newaxis] == teams[np.newaxis, :], 0, NO_PAIR).astype(np.uint16)
+            np.fill_diagonal(counts, NO_PAIR)
+        else:
+            member_ids = np.unique(np.concatenate([lows, highs]))
+            counts = np.full((len(member_ids), len(member_ids)), NO_PAIR, dtype=np.uint16)
+        low_idx = np.searchsorted(member_ids, lows)
+        high_idx = np.searchsorted(member_ids, highs)
+        counts[low_idx, high_idx] = meetings
+        counts[high_idx, low_idx] = meetings
+        logger.debug('state of %s members, %s pairs', len(member_ids), len(rows))
+        return cls(member_ids, counts)
+
+    def __len__(self):
+        return len(self.member_ids)
+
+    def least_met(self):
+        # lowest meeting count of any active pair, None when there are no pairs
+        lowest = self.counts.min() if len(self) else NO_PAIR
+        return None if lowest == NO_PAIR else int(lowest)
+
+    def select_round(self, in_int_required, rng=None):
+        """
+        Pick up to in_int_required disjoint pairs. Members are visited in random order and each
+        is given the still available partner it has met the least, ties broken at random
+        Parameters
+        ==========
+        in_int_required : number of meetings to set
+        rng : numpy Generator, for repeatable selections
+        Returns
+        =======
+        pairs - member pk pairs [(3, 5),]
+        """
+        pairs = []
+        for i, j in self.select_round_indices(in_int_required, rng):
+            low, high = sorted((int(self.member_ids[i]), int(self.member_ids[j])))
+            pairs.append((low, high))
+        return pairs
+
+    def select_round_indices(self, in_int_required, rng=None):
+        # select_round by matrix index rather than member pk, for the callers that stay on the arrays
+        rng = rng or np.random.default_rng()
+        available = np.ones(len(self), dtype=bool)
+        pairs = []
+        for i in rng.permutation(len(self)):
+            if len(pairs) >= in_int_required:
+                break
+            if not available[i]:
+                continue
+            available[i] = False
+            scores = np.where(available, self.counts[i], NO_PAIR)
+            least = scores.min()
+            if least == NO_PAIR:
+                continue
+            j = rng.choice(np.flatnonzero(scores == least))
+            available[j] = False
+            pairs.append((int(i), int(j)))
+        return pairs
+
+    def apply(self, in_lis_pairs):
+        """
+        Add a meeting to each of the pairs in the matrix, the database is not touched
+        """
+        idx = np.array([(self.index[low], self.index[high]) for low, high in in_lis_pairs], dtype=np.int64)
+        if len(idx):
+            self.counts[idx[:, 0], idx[:, 1]] += 1
+            self.counts[idx[:, 1], idx[:, 0]] += 1
+
+
+@timed()
+def select_array_pairs(in_int_required, in_team=None):
+    """
+    Select the meetings for a round from the matrix of meeting counts
+    Parameters
+    ==========
+    in_int_required : number of meetings to set
+    in_team : Team or pk to select for, all teams when None
+    Returns
+    =======
+    local_int_success - pass or fail
+    local_lis_pairs - selected member pairs [(3, 5),]
+    """
+    local_int_success = 1
+    local_lis_pairs = []
+    try:
+        state = PairState.load(in_team)
+        local_lis_pairs = state.select_round(in_int_required)
+        local_int_success = 0
+    except Exception as e:
+        logger.error(f'Encountered {e}')
+    finally:
+        return local_int_success, local_lis_pairs
@@ -0,0 +1,104 @@
+import logging
+import multiprocessing
+import time
+from functools import partial
+
+from django.db import connections, transaction
+from django.db.models import Count, Q
+
+from .meeting import create_meetings
+from .models import Member, Team
+
+logger = logging.getLogger('coffee_log')
+
+# defaults for generate_team_rounds
+TEAM_WORKERS = 4  # teams generated at the same time, each in a process of its own
+TEAM_TIMEOUT = 300  # seconds all teams together may take, a team still running then is stopped and rolled back
+
+
+def generate_team_round(in_int_team, in_str_strategy='random'):
+    """
+    Set the round of one team in a transaction of its own, nothing of the round is kept when it fails
+    Parameters
+    ==========
+    in_int_team : pk of the team
+    in_str_strategy : name of the pairing strategy in PAIRING_STRATEGIES
+    Returns
+    =======
+    local_int_success - pass or fail
+    """
+    with transaction.atomic():
+        local_int_success = create_meetings(in_str_strategy, in_int_team)[0]
+        if local_int_success != 0:
+            transaction.set_rollback(True)
+    return local_int_success
+
+
+def _generate_team_round(in_int_team, in_str_strategy):
+    # a team's round in a pool worker, any error is reported as the team failing
+    try:
+        outcome = 'done' if generate_team_round(in_int_team, in_str_strategy) == 0 else 'failed'
+    except Exception as e:
+        logger.error(f'Team {in_int_team} failed: {e}')
+        outcome = 'failed'
+    return in_int_team, outcome
+
+
+def teams_to_generate():
+    # teams with at least one possible meeting
+    qs = Team.objects.annotate(active_members=Count('members', filter=Q(members__active=True)))
+    return list(qs.filter(active_members__gte=2).order_by('name'))
+
+
+def generate_team_rounds(in_str_strategy='random', in_lis_teams=None, in_int_workers=TEAM_WORKERS,
+                         in_int_timeout=TEAM_TIMEOUT):
+    """
+    Set the next round for every team. The teams are spread over a pool of worker processes, so a slow
+    team only holds up its own worker. The timeout is for the whole batch: a team still running or not yet
+    started then is terminated, which rolls its transaction back, while the teams that finished keep their rounds.
+    With one worker, or when called inside a transaction the workers could not see, the teams run
+    one after the other in this process. So do they on SQLite, which only has one writer at a time
+    Parameters
+    ==========
+    in_str_strategy : name of the pairing strategy in PAIRING_STRATEGIES
+    in_lis_teams : Teams to generate, every team with active members when None
+    in_int_workers : number of worker processes
+    in_int_timeout : seconds to wait for all the teams
+    Returns
+    =======
+    local_int_success - pass or fail (0 only when every team got its round)
+    local_dict_report - names of the teams done, failed and timed out
+    """
+    deadline = time.monotonic() + in_int_timeout
+    teams = teams_to_generate() if in_lis_teams is None else list(in_lis_teams)
+    local_dict_report = {'done': [], 'failed': [], 'timed_out': []}
+    unassigned = Member.objects.active().filter(team__isnull=True).count()
+    if unassigned:
+        logger.warning(f'{unassigned} active members without a team are not in any team round')
+
+    database = connections['default']
+    if in_int_workers <= 1 or len(teams) <= 1 or database.in_atomic_block or database.vendor == 'sqlite':
+        for team in teams:
+            outcome = 'done' if generate_team_round(team.pk, in_str_strategy) == 0 else 'failed'
+            local_dict_report[outcome].append(team.name)
+    else:
+        # the workers are forked from this process and must each open their own database connection
+        connections.close_all()
+        names = {team.pk: team.name for team in teams}
+        pool = multiprocessing.get_context('fork').Pool(min(in_int_workers, len(teams)))
+        try:
+            # the teams are reported as they finish, the deadline is for the whole batch
+            finished = pool.imap_unordered(partial(_generate_team_round, in_str_strategy=in_str_strategy), list(names))
+            for _ in teams:
+                try:
+                    pk, outcome = finished.next(max(0, deadline - time.monotonic()))
+                except multiprocessing.TimeoutError:
+                    break
+                local_dict_report[outcome].append(names.pop(pk))
+            local_dict_report['timed_out'].extend(names.values())
+        finally:
+            pool.terminate()
+            pool.join()
+
+    local_int_success = 0 if not local_dict_report['failed'] and not local_dict_report['timed_out'] else 1
+    return local_int_success, local_dict_report
@@ -1,3 +1,1187 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import MagicMock, Mock, patch
 
-# Create your tests here.
+import numpy as np
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .export import export_lines
+from .jobs import JOB_TIMEOUT, claim_next_job, run_job
+from .mailer import MAIL_BATCH_SIZE, MAIL_RETRIES, MAIL_WORKERS, send_round_emails
+from .member_import import import_members, read_member_rows
+from .meeting import (add_member_pairs, create_meetings, deactivate_member_pairs, get_random_pairs, get_unique_pairs,
+                      loadconfig, reactivate_member_pairs, record_meetup, select_random_pairs, update_meetings,
+                      update_member_pairs, update_meetup_list)
+from .models import (MEETUP_STATS_KEY, REFERENCE_TTL, GenerationJob, MeetPair, MeetRecord, Meetup, Member, Reference,
+                     Team)
+from .optimizer import (BYE_WEIGHT, COUNT_WEIGHT, RECENCY_WEIGHT, TeamProblem, anneal, greedy_order, greedy_orders,
+                        load_problems, search_round, select_optimized_pairs)
+from .pairing import ROUND_ROBIN_REF, round_robin_ref, round_robin_round
+from .querystats import track_queries
+from .reconcile import PAIRS_STALE_REF, mark_pairs_stale, pairs_left_stale, reconcile_stale_pairs
+from .simulation import Simulation
+from .state import PairState
+from .teams import generate_team_rounds
+from .timing import report, reset, timed
+
+
+class UpdateMeetupListTests(TestCase):
+    def setUp(self):
+        self.members = [Member.objects.create(full_name=f'Member {i}') for i in range(4)]
+
+    def test_creates_all_active_pairs(self):
+        success, error, missed, summary = update_meetup_list()
+        self.assertEqual(success, 0)
+        self.assertEqual(missed, 0)
+        self.assertEqual(summary, {'activated': 0, 'deactivated': 0, 'created': 6})
+        self.assertEqual(Meetup.objects.active().count(), 6)
+
+    def test_deactivates_and_reactivates_pairs(self):
+        update_meetup_list()
+        member = self.members[0]
+        member.active = False
+        member.save()
+        success, error, missed, summary = update_meetup_list()
+        self.assertEqual(summary, {'activated': 0, 'deactivated': 3, 'created': 0})
+        self.assertEqual(Meetup.objects.active().count(), 3)
+
+        member.active = True
+        member.save()
+        success, error, missed, summary = update_meetup_list()
+        self.assertEqual(summary, {'activated': 3, 'deactivated': 0, 'created': 0})
+        self.assertEqual(Meetup.objects.active().count(), 6)
+
+    def test_query_count_does_not_grow_with_members(self):
+        update_meetup_list()
+        # kept within one bulk_create batch on SQLite, which caps the variables per statement
+        for i in range(4, 18):
+            Member.objects.create(full_name=f'Member {i}')
+        self.members[1].active = False
+        self.members[1].save()
+        with self.assertNumQueries(6):
+            success, error, missed, summary = update_meetup_list()
+        self.assertEqual(success, 0)
+        self.assertEqual(summary['created'], Meetup.objects.count() - 6)
+
+
+class MeetupPairTests(TestCase):
+    def setUp(self):
+        self.members = [Member.objects.create(full_name=f'Member {i}') for i in range(3)]
+        update_meetup_list()
+
+    def test_pairs_are_ordered_member_keys(self):
+        low, mid, high = [member.pk for member in self.members]
+        pairs = set(Meetup.objects.values_list('member_low_id', 'member_high_id'))
+        self.assertEqual(pairs, {(low, mid), (low, high), (mid, high)})
+        meetup = Meetup.objects.get(member_low_id=low, member_high_id=high)
+        self.assertEqual(meetup.pair, (low, high))
+        self.assertEqual(meetup.named, 'Member 0 | Member 2')
+
+    def test_update_meetings_increments_pair(self):
+        pair = (self.members[0].pk, self.members[1].pk)
+        # one select for the names and one update, wrapped in a savepoint
+        with self.assertNumQueries(4):
+            success, error, names = update_meetings([pair])
+        self.assertEqual(success, 0)
+        self.assertEqual(names, ['Member 0 meeting Member 1'])
+        self.assertEqual(Meetup.objects.get(member_low_id=pair[0], member_high_id=pair[1]).meetings, 1)
+
+    def test_update_meetings_rejects_unknown_pair(self):
+        pair = (self.members[0].pk, self.members[1].pk)
+        success, error, names = update_meetings([pair, (self.members[2].pk, self.members[2].pk)])
+        self.assertEqual(success, 1)
+        self.assertEqual(names, [])
+        self.assertEqual(Meetup.objects.get(member_low_id=pair[0], member_high_id=pair[1]).meetings, 0)
+
+
+class CreateMeetingsTests(TestCase):
+    def setUp(self):
+        self.members = [Member.objects.create(full_name=f'Member {i}') for i in range(6)]
+        update_meetup_list()
+
+    def test_matching_strategy_sets_full_round(self):
+        self.assertEqual(create_meetings('matching')[0], 0)
+        self.assertEqual(Meetup.objects.filter(meetings=1).count(), Member.meetings_to_set())
+        self.assertEqual(MeetRecord.objects.count(), 1)
+
+    def test_matching_prefers_pairs_that_met_least(self):
+        for _ in range(3):
+            self.assertEqual(create_meetings('matching')[0], 0)
+        # whatever the first rounds were, 6 members always have a third round of new pairs left
+        self.assertFalse(Meetup.objects.filter(meetings__gt=1).exists())
+        self.assertEqual(Meetup.objects.filter(meetings=1).count(), 9)
+
+    def test_unknown_strategy_fails(self):
+        self.assertEqual(create_meetings('unknown')[0], 1)
+        self.assertEqual(MeetRecord.objects.count(), 0)
+
+    def test_failed_update_records_no_round(self):
+        # every round robin round pairs the first member, whose pairs are gone
+        Meetup.objects.filter(member_low=self.members[0]).delete()
+        with self.assertLogs('coffee_log', 'ERROR'):
+            self.assertEqual(create_meetings('round_robin')[0], 1)
+        self.assertEqual(MeetRecord.objects.count(), 0)
+        self.assertEqual(MeetPair.objects.count(), 0)
+        self.assertFalse(Meetup.objects.filter(meetings__gt=0).exists())
+
+    def test_random_strategy_sets_full_round(self):
+        self.assertEqual(create_meetings('random')[0], 0)
+        self.assertEqual(Meetup.objects.filter(meetings=1).count(), Member.meetings_to_set())
+
+    def test_random_pairs_stop_short_of_an_impossible_round(self):
+        # six members make at most three meetings, spread over two buckets of meeting counts
+        Meetup.objects.filter(member_low=self.members[0]).update(meetings=1)
+        with self.assertLogs('coffee_log', 'WARNING'):
+            success, pairs = select_random_pairs(10)
+        self.assertEqual(success, 0)
+        self.assertEqual(len(pairs), 3)
+        members = [pk for pair in pairs for pk in pair]
+        self.assertEqual(len(members), len(set(members)))
+
+    def test_random_pairs_walk_the_buckets_of_the_cached_stats(self):
+        cache.clear()
+        Meetup.stats()
+        # one query per bucket, the lowest and highest count come from the cache
+        with self.assertNumQueries(1):
+            success, pairs = select_random_pairs(3)
+        self.assertEqual(len(pairs), 3)
+
+    def test_unique_pairs_leave_their_inputs_alone(self):
+        pool = [(1, 2), (1, 3), (3, 4), (5, 6)]
+        taken = {5}
+        unique, members = get_unique_pairs(pool, taken)
+        self.assertEqual(pool, [(1, 2), (1, 3), (3, 4), (5, 6)])
+        self.assertEqual(taken, {5})
+        self.assertNotIn((5, 6), unique)
+        self.assertEqual(members, {5} | {pk for pair in unique for pk in pair})
+
+    def test_random_pairs_return_partial_results(self):
+        chosen = [(7, 8)]
+        success, pairs, members = get_random_pairs([(1, 2), (1, 3), (2, 3), (7, 9)], 3, chosen)
+        self.assertEqual((success, len(pairs), chosen), (0, 1, [(7, 8)]))
+        self.assertIn(pairs[0], [(1, 2), (1, 3), (2, 3)])
+        # nothing is picked after the deadline
+        success, pairs, members = get_random_pairs([(1, 2), (3, 4)], 2, in_float_deadline=time.monotonic() - 1)
+        self.assertEqual(pairs, [])
+
+
+class MeetPairTests(TestCase):
+    def setUp(self):
+        self.members = [Member.objects.create(full_name=f'Member {i}') for i in range(4)]
+        update_meetup_list()
+
+    def test_create_meetings_records_pairs(self):
+        self.assertEqual(create_meetings()[0], 0)
+        record = MeetRecord.objects.get()
+        pairs = list(record.pairs.values_list('member_low_id', 'member_high_id'))
+        self.assertEqual(len(pairs), 2)
+        self.assertEqual(sorted(pairs), sorted(Meetup.objects.filter(meetings=1).values_list(
+            'member_low_id', 'member_high_id')))
+        self.assertEqual(len(record.meeting_lines()), 2)
+
+    def test_between_returns_latest_meeting(self):
+        first, second = self.members[0], self.members[1]
+        for _ in range(2):
+            record = MeetRecord.objects.create(detail='')
+            MeetPair.objects.create(record=record, member_low=first, member_high=second, recorded=record.recorded)
+        self.assertEqual(MeetPair.objects.between(second.pk, first.pk).first().record, record)
+        self.assertEqual(MeetPair.objects.involving(first.pk).count(), 2)
+        self.assertFalse(MeetPair.objects.involving(self.members[2].pk).exists())
+
+    def test_record_without_pairs_uses_detail(self):
+        record = MeetRecord.objects.create(detail='Member 0 meeting Member 1\nMember 2 meeting Member 3\n')
+        self.assertEqual(record.meeting_lines(), ['Member 0 meeting Member 1', 'Member 2 meeting Member 3'])
+
+
+class PairStateTests(TestCase):
+    def setUp(self):
+        self.members = [Member.objects.create(full_name=f'Member {i}') for i in range(6)]
+        update_meetup_list()
+
+    def test_load_builds_symmetric_counts(self):
+        low, high = self.members[0].pk, self.members[1].pk
+        Meetup.objects.increment_pairs([(low, high)])
+        with self.assertNumQueries(1):
+            state = PairState.load()
+        self.assertEqual(len(state), 6)
+        self.assertEqual(state.counts[state.index[low], state.index[high]], 1)
+        self.assertEqual(state.counts[state.index[high], state.index[low]], 1)
+        self.assertEqual(state.least_met(), 0)
+
+    def test_select_round_prefers_least_met_disjoint_pairs(self):
+        state = PairState.load()
+        first = state.select_round(3)
+        state.apply(first)
+        second = state.select_round(3)
+        for pairs in (first, second):
+            self.assertEqual(len(pairs), 3)
+            self.assertEqual(len({pk for pair in pairs for pk in pair}), 6)
+        # only the last two members left over can be forced into a repeat
+        self.assertLessEqual(len(set(first) & set(second)), 1)
+
+    def test_array_strategy_sets_full_round(self):
+        self.assertEqual(create_meetings('array')[0], 0)
+        self.assertEqual(Meetup.objects.filter(meetings=1).count(), 3)
+
+
+class RoundRobinTests(TestCase):
+    def test_even_schedule_covers_every_pair_once(self):
+        members = list(range(1, 9))
+        seen = set()
+        for round_number in range(7):
+            pairs = round_robin_round(members, round_number)
+            self.assertEqual(len(pairs), 4)
+            self.assertEqual(len({pk for pair in pairs for pk in pair}), 8)
+            seen.update(pairs)
+        self.assertEqual(len(seen), 28)
+
+    def test_odd_schedule_rotates_the_bye(self):
+        members = list(range(1, 8))
+        seen = set()
+        sitting_out = set()
+        for round_number in range(7):
+            pairs = round_robin_round(members, round_number)
+            self.assertEqual(len(pairs), 3)
+            sitting_out.update(set(members) - {pk for pair in pairs for pk in pair})
+            seen.update(pairs)
+        self.assertEqual(len(seen), 21)
+        self.assertEqual(sitting_out, set(members))
+
+    def test_command_advances_the_rotation(self):
+        for i in range(5):
+            Member.objects.create(full_name=f'Member {i}')
+        update_meetup_list()
+        for _ in range(5):
+            call_command('make_meetings', strategy='round_robin', stdout=StringIO())
+        self.assertEqual(Reference.objects.get(name=ROUND_ROBIN_REF).ref_int, 5)
+        self.assertEqual(Meetup.objects.filter(meetings=1).count(), 10)
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_writes_results_and_rolls_back(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'bench.json')
+            call_command('benchmark_pairing', sizes=[6], history=2, output=output, stdout=StringIO(),
+                         stderr=StringIO())
+            with open(output) as f:
+                report = json.load(f)
+        stages = {result['stage'] for result in report['results']}
+        self.assertIn('update_meetup_list', stages)
+        self.assertIn('create_meetings_array', stages)
+        self.assertTrue(all(result['members'] == 6 for result in report['results']))
+        self.assertEqual(Member.objects.count(), 0)
+
+    def test_refuses_a_database_with_members(self):
+        Member.objects.create(full_name='Jan')
+        with self.assertRaises(CommandError):
+            call_command('benchmark_pairing', sizes=[6], stdout=StringIO(), stderr=StringIO())
+        cache.set(MEETUP_STATS_KEY, {'least': 5})
+        call_command('benchmark_pairing', sizes=[6], history=2, force=True, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(list(Member.objects.values_list('full_name', flat=True)), ['Jan'])
+        self.assertIsNone(cache.get(MEETUP_STATS_KEY))
+
+
+class CombinationListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.members = [Member.objects.create(full_name=f'Member {i}') for i in range(5)]
+        update_meetup_list()
+        Meetup.objects.increment_pairs([(self.members[0].pk, self.members[1].pk)])
+
+    @patch('cafinator.views.COMBINATIONS_PAGE_SIZE', 3)
+    def test_cursor_pages_cover_every_pair_once(self):
+        seen = []
+        url = reverse('cafe:combination_list')
+        params = {}
+        while True:
+            response = self.client.get(url, params)
+            seen.extend(obj.pk for obj in response.context['objects'])
+            if not response.context['next_after']:
+                break
+            params = {'after': response.context['next_after']}
+        self.assertEqual(len(seen), 10)
+        self.assertEqual(set(seen), set(Meetup.objects.values_list('pk', flat=True)))
+        self.assertEqual(Meetup.objects.get(pk=seen[-1]).meetings, 1)
+
+    def test_filters_by_member_and_meetings(self):
+        url = reverse('cafe:combination_list')
+        response = self.client.get(url, {'member': self.members[0].pk})
+        self.assertEqual(len(response.context['objects']), 4)
+        response = self.client.get(url, {'member': self.members[0].pk, 'meetings': 1})
+        self.assertEqual([obj.named for obj in response.context['objects']], ['Member 0 | Member 1'])
+
+
+class MeetupStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.members = [Member.objects.create(full_name=f'Member {i}') for i in range(4)]
+        update_meetup_list()
+
+    def test_stats_are_cached_until_meetings_are_updated(self):
+        self.assertEqual(Meetup.least_scheduled_combinations(), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(Meetup.highest_mtgs(), 0)
+            self.assertEqual(Meetup.least_scheduled_combinations(), 0)
+
+        update_meetings([(self.members[0].pk, self.members[1].pk)])
+        self.assertEqual(Meetup.highest_mtgs(), 1)
+        self.assertEqual(Meetup.least_scheduled_combinations(), 0)
+
+    def test_stats_follow_member_changes(self):
+        update_meetings([(self.members[0].pk, self.members[1].pk), (self.members[2].pk, self.members[3].pk)])
+        self.assertEqual(Meetup.least_scheduled_combinations(), 0)
+        Member.objects.filter(pk__in=[self.members[1].pk, self.members[3].pk]).update(active=False)
+        update_meetup_list()
+        self.assertEqual(Meetup.least_scheduled_combinations(), 0)
+        Member.objects.filter(pk=self.members[2].pk).update(active=False)
+        update_meetup_list()
+        self.assertIsNone(Meetup.least_scheduled_combinations())
+
+    def test_stats_follow_a_saved_meetup(self):
+        self.assertEqual(Meetup.highest_mtgs(), 0)
+        meetup = Meetup.objects.first()
+        meetup.meetings = 3
+        meetup.save()
+        self.assertEqual(Meetup.highest_mtgs(), 3)
+        meetup.delete()
+        self.assertEqual(Meetup.highest_mtgs(), 0)
+
+
+class ListingCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.members = [Member.objects.create(full_name=f'Member {i}') for i in range(3)]
+        update_meetup_list()
+
+    def test_repeat_views_do_not_touch_the_database(self):
+        for name in ('cafe:member_list', 'cafe:combination_list', 'cafe:meetup_list'):
+            url = reverse(name)
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(first.content, second.content)
+
+    def test_member_change_refreshes_listings(self):
+        url = reverse('cafe:member_list')
+        self.assertContains(self.client.get(url), 'Member 2')
+        member = self.members[2]
+        member.full_name = 'Renamed member'
+        member.save()
+        self.assertContains(self.client.get(url), 'Renamed member')
+
+    def test_team_rename_refreshes_listings(self):
+        url = reverse('cafe:member_list')
+        team = Team.objects.create(name='Sales')
+        Member.objects.filter(pk=self.members[0].pk).update(team=team)
+        Meetup.data_changed()
+        self.assertContains(self.client.get(url), '<td>Sales</td>')
+        team.name = 'Customer care'
+        team.save()
+        self.assertContains(self.client.get(url), '<td>Customer care</td>')
+
+    def test_bulk_meeting_update_refreshes_combinations(self):
+        url = reverse('cafe:combination_list')
+        self.client.get(url, {'meetings': 1})
+        update_meetings([(self.members[0].pk, self.members[1].pk)])
+        self.assertContains(self.client.get(url, {'meetings': 1}), 'Member 0 | Member 1')
+
+
+class FlakyConnection:
+    """Mail connection that fails the first send it is asked to make"""
+    attempts = 0
+
+    def __init__(self, backend=None, **kwargs):
+        self.backend = backend
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        FlakyConnection.attempts += 1
+        if FlakyConnection.attempts == 1:
+            raise ConnectionError('connection dropped')
+        mail.outbox.extend(messages)
+        return len(messages)
+
+
+class MailerTests(TestCase):
+    config = {'email_smtp': 'localhost', 'email_port': 1025, 'email_from': 'cafe@example.com',
+              'email_cc': '', 'email_subject': 'Coffee', 'email_to': 'dl@example.com; boss@example.com'}
+
+    def setUp(self):
+        self.jan = Member.objects.create(full_name='Jan', email='jan@example.com')
+        self.kim = Member.objects.create(full_name='Kim', email='kim@example.com')
+        self.lee = Member.objects.create(full_name='Lee')
+
+    @patch('cafinator.mailer.MAIL_BACKEND', 'django.core.mail.backends.locmem.EmailBackend')
+    def test_sends_digest_and_personal_notices(self):
+        success, report = send_round_emails(dict(self.config, email_batch_size=1),
+                                            [(self.jan.pk, self.kim.pk), (self.jan.pk, self.lee.pk)], 'digest')
+        self.assertEqual(success, 0)
+        self.assertEqual(report, {'digest': True, 'members': 3, 'sent': 4, 'failed': []})
+        recipients = sorted(tuple(message.to) for message in mail.outbox)
+        self.assertEqual(recipients, [('dl@example.com', 'boss@example.com'), ('jan@example.com',),
+                                      ('jan@example.com',), ('kim@example.com',)])
+        jan = [message.body for message in mail.outbox if message.to == ['jan@example.com']]
+        self.assertTrue(any('meeting Kim' in body for body in jan))
+
+    @patch('cafinator.mailer.MAIL_BACKEND', 'django.core.mail.backends.locmem.EmailBackend')
+    def test_view_mails_the_pairs_of_the_latest_round(self):
+        Reference.clear_cached()
+        for name, value in self.config.items():
+            Reference.objects.create(name=name, **{'ref_int' if name == 'email_port' else 'ref_str': value})
+        # the member's name no longer matches the text of the round, the pairs still find them
+        record_meetup(['Jan meeting Kim'], [(self.jan.pk, self.kim.pk)])
+        Member.objects.filter(pk=self.jan.pk).update(full_name='Jan Smit')
+        self.client.post(reverse('cafe:make_meetings'), {'email': '1'})
+        self.assertEqual(sorted(tuple(message.to) for message in mail.outbox),
+                         [('dl@example.com', 'boss@example.com'), ('jan@example.com',), ('kim@example.com',)])
+
+    @patch('cafinator.mailer.MAIL_RETRY_DELAY', 0)
+    @patch('cafinator.mailer.get_connection', FlakyConnection)
+    def test_retries_a_failed_message(self):
+        FlakyConnection.attempts = 0
+        success, report = send_round_emails(self.config, [(self.jan.pk, self.kim.pk)], 'digest')
+        self.assertEqual(success, 0)
+        self.assertEqual(report['sent'], 3)
+        self.assertEqual(FlakyConnection.attempts, 4)
+
+    @patch('cafinator.mailer.get_connection')
+    def test_connects_to_the_configured_smtp_server(self, get_connection):
+        send_round_emails(self.config, [(self.jan.pk, self.kim.pk)], 'digest')
+        get_connection.assert_called_with('django.core.mail.backends.smtp.EmailBackend', host='localhost', port=1025,
+                                          fail_silently=False)
+
+    @patch('cafinator.mailer.MAIL_RETRY_DELAY', 0)
+    @patch('cafinator.mailer.get_connection', FlakyConnection)
+    def test_reports_recipients_that_could_not_be_sent(self):
+        FlakyConnection.attempts = 0
+        success, report = send_round_emails(dict(self.config, email_retries=0), [(self.jan.pk, self.kim.pk)],
+                                            'digest')
+        self.assertEqual(success, 1)
+        self.assertEqual((report['digest'], report['members'], report['sent']), (False, 2, 2))
+        self.assertEqual(report['failed'], ['dl@example.com', 'boss@example.com'])
+
+
+class GenerationJobTests(TestCase):
+    def setUp(self):
+        for i in range(4):
+            Member.objects.create(full_name=f'Member {i}')
+        update_meetup_list()
+
+    def test_post_queues_job_and_worker_records_round(self):
+        response = self.client.post(reverse('cafe:make_meetings'), {'make_meeting': 'Schedule', 'strategy': 'array'},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job']
+        self.assertEqual(MeetRecord.objects.count(), 0)
+        self.assertEqual(self.client.get(response.json()['status_url']).json()['status'], 'queued')
+
+        call_command('run_generation_jobs', once=True, stdout=StringIO())
+        status = self.client.get(reverse('cafe:job_status', kwargs={'pk': job_id})).json()
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['meetings'].count(' meeting '), 2)
+        self.assertEqual(GenerationJob.objects.get(pk=job_id).record, MeetRecord.objects.last())
+
+    def test_failed_generation_is_reported(self):
+        job = GenerationJob.objects.create(strategy='unknown')
+        call_command('run_generation_jobs', once=True, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, GenerationJob.FAILED)
+        self.assertEqual(MeetRecord.objects.count(), 0)
+
+    def test_job_past_the_timeout_keeps_no_round(self):
+        GenerationJob.objects.create(strategy='array')
+        job = claim_next_job()
+        self.assertEqual(run_job(job, 0), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, GenerationJob.FAILED)
+        self.assertFalse(MeetRecord.objects.exists())
+
+    def test_job_claimed_again_while_it_runs_keeps_no_round(self):
+        GenerationJob.objects.create(strategy='array')
+        job = claim_next_job()
+        # reclaimed and claimed by another worker while this one still runs it
+        GenerationJob.objects.filter(pk=job.pk).update(started=job.started + timedelta(seconds=JOB_TIMEOUT + 1))
+        self.assertEqual(run_job(job), 1)
+        self.assertEqual(GenerationJob.objects.get(pk=job.pk).status, GenerationJob.RUNNING)
+        self.assertFalse(MeetRecord.objects.exists())
+        self.assertFalse(Meetup.objects.filter(meetings__gt=0).exists())
+
+    def test_job_left_running_is_run_again(self):
+        stuck = GenerationJob.objects.create(strategy='array', status=GenerationJob.RUNNING,
+                                             started=timezone.now() - timedelta(seconds=JOB_TIMEOUT + 1))
+        recent = GenerationJob.objects.create(strategy='array', status=GenerationJob.RUNNING, started=timezone.now())
+        call_command('run_generation_jobs', once=True, stdout=StringIO())
+        stuck.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertEqual(stuck.status, GenerationJob.DONE)
+        self.assertEqual(stuck.record, MeetRecord.objects.get())
+        self.assertEqual(recent.status, GenerationJob.RUNNING)
+
+
+class TeamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sales = Team.objects.create(name='Sales')
+        self.support = Team.objects.create(name='Support')
+        self.members = [Member.objects.create(full_name=f'Sales {i}', team=self.sales) for i in range(3)]
+        self.members += [Member.objects.create(full_name=f'Support {i}', team=self.support) for i in range(3)]
+        update_meetup_list()
+
+    def test_pairs_stay_within_teams(self):
+        self.assertEqual(Meetup.objects.active(self.sales).count(), 3)
+        self.assertEqual(Meetup.objects.active(self.support).count(), 3)
+        self.assertEqual(Meetup.objects.count(), 6)
+        self.assertEqual(Member.objects.active(self.sales).count(), 3)
+        # three members a team leaves one of each team without a meeting
+        self.assertEqual(Member.meetings_to_set(), 2)
+        self.assertEqual(Member.meetings_to_set(self.sales), 1)
+
+    def test_moving_a_member_moves_their_pairs(self):
+        mover = self.members[0]
+        mover.team = self.support
+        mover.save()
+        success, error, missed, summary = update_meetup_list()
+        self.assertEqual(summary, {'activated': 0, 'deactivated': 2, 'created': 3})
+        self.assertEqual(Meetup.objects.active(self.sales).count(), 1)
+        self.assertEqual(Meetup.objects.active(self.support).count(), 6)
+
+        mover.team = self.sales
+        mover.save()
+        success, error, missed, summary = update_meetup_list()
+        self.assertEqual(summary, {'activated': 2, 'deactivated': 3, 'created': 0})
+        self.assertEqual(Meetup.objects.active(self.sales).count(), 3)
+
+    def test_pairs_of_members_moving_together_are_kept(self):
+        pair = (self.members[0].pk, self.members[1].pk)
+        update_meetings([pair])
+        Member.objects.filter(pk__in=pair).update(team=self.support)
+        update_meetup_list()
+        meetup = Meetup.objects.get(member_low_id=pair[0], member_high_id=pair[1])
+        self.assertEqual((meetup.team, meetup.active, meetup.meetings), (self.support, True, 1))
+
+    def test_round_for_one_team(self):
+        self.assertEqual(create_meetings('matching', self.sales)[0], 0)
+        self.assertEqual(Meetup.objects.filter(meetings=1).count(), 1)
+        self.assertEqual(Meetup.objects.filter(meetings=1, team=self.sales).count(), 1)
+        self.assertEqual(MeetRecord.objects.get().team, self.sales)
+        self.assertEqual(Meetup.least_scheduled_combinations(self.sales), 0)
+        self.assertEqual(Meetup.highest_mtgs(self.sales), 1)
+        self.assertEqual(Meetup.highest_mtgs(self.support), 0)
+
+    def test_round_over_all_teams(self):
+        for strategy in ('random', 'matching', 'array', 'round_robin'):
+            self.assertEqual(create_meetings(strategy)[0], 0)
+        self.assertEqual(MeetRecord.objects.count(), 4)
+        self.assertEqual(MeetPair.objects.count(), 8)
+        self.assertEqual(Reference.objects.get(name=round_robin_ref(self.sales.pk)).ref_int, 1)
+        self.assertEqual(Reference.objects.get(name=round_robin_ref(self.support.pk)).ref_int, 1)
+
+    def test_generate_team_rounds(self):
+        Team.objects.create(name='Empty')
+        success, report = generate_team_rounds('array')
+        self.assertEqual(success, 0)
+        self.assertEqual(report, {'done': ['Sales', 'Support'], 'failed': [], 'timed_out': []})
+        self.assertEqual(set(MeetRecord.objects.values_list('team__name', flat=True)), {'Sales', 'Support'})
+
+    @override_settings(CAFINATOR_OPTIMIZER_WORKERS=2, CAFINATOR_OPTIMIZER_BUDGET_MS=50)
+    def test_optimized_rounds_in_worker_processes(self):
+        # as on a database with more than one writer, outside a transaction, so the teams go to the pool.
+        # Each worker is daemonic and may not start processes, the optimizer searches in the worker itself
+        database = SimpleNamespace(vendor='postgresql', in_atomic_block=False)
+        with patch('cafinator.teams.connections', MagicMock(__getitem__=Mock(return_value=database))):
+            success, report = generate_team_rounds('optimized', in_int_workers=2, in_int_timeout=30)
+        self.assertEqual(success, 0)
+        self.assertEqual(sorted(report['done']), ['Sales', 'Support'])
+
+    def test_failed_team_is_rolled_back(self):
+        success, report = generate_team_rounds('unknown', [self.sales])
+        self.assertEqual(success, 1)
+        self.assertEqual(report['failed'], ['Sales'])
+        self.assertFalse(MeetRecord.objects.exists())
+
+    def test_command_for_named_teams(self):
+        out = StringIO()
+        call_command('make_meetings', team=['Support'], strategy='round_robin', stdout=out)
+        self.assertIn('Support: done', out.getvalue())
+        self.assertEqual(MeetRecord.objects.get().team, self.support)
+
+
+class LoadConfigTests(TestCase):
+    def setUp(self):
+        Reference.clear_cached()
+        for name in ('email_smtp', 'email_from', 'email_cc', 'email_subject', 'email_to'):
+            Reference.objects.create(name=name, ref_str=f'{name} value')
+        Reference.objects.create(name='email_port', ref_int=25)
+
+    def test_config_is_read_once(self):
+        with self.assertNumQueries(1):
+            success, config = loadconfig()
+            loadconfig()
+        self.assertEqual(success, 0)
+        self.assertEqual(config['email_port'], 25)
+        self.assertEqual(config['email_to'], 'email_to value')
+
+    def test_delivery_settings_are_optional(self):
+        success, config = loadconfig()
+        self.assertEqual((config['email_workers'], config['email_batch_size'], config['email_retries']),
+                         (MAIL_WORKERS, MAIL_BATCH_SIZE, MAIL_RETRIES))
+        Reference.objects.create(name='email_workers', ref_int=2)
+        self.assertEqual(loadconfig()[1]['email_workers'], 2)
+
+    def test_saving_a_reference_clears_the_cache(self):
+        loadconfig()
+        reference = Reference.objects.get(name='email_port')
+        reference.ref_int = 2525
+        reference.save()
+        with self.assertNumQueries(1):
+            success, config = loadconfig()
+        self.assertEqual(config['email_port'], 2525)
+
+    def test_cache_expires(self):
+        loadconfig()
+        # a queryset update bypasses the signals, the change shows once the cached rows expire
+        Reference.objects.filter(name='email_port').update(ref_int=587)
+        self.assertEqual(loadconfig()[1]['email_port'], 25)
+        with patch('time.monotonic', return_value=time.monotonic() + REFERENCE_TTL):
+            self.assertEqual(loadconfig()[1]['email_port'], 587)
+
+    def test_missing_reference_fails(self):
+        Reference.objects.filter(name='email_cc').delete()
+        Reference.clear_cached()
+        self.assertEqual(loadconfig()[0], 1)
+
+
+class MemberPairDeltaTests(TestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name='Sales')
+        self.members = [Member.objects.create(full_name=f'Member {i}', team=self.team) for i in range(5)]
+        # the members created are all marked stale, reconciling them stands in for the commit
+        reconcile_stale_pairs()
+
+    def test_add_member_pairs_creates_only_the_new_pairs(self):
+        member = Member.objects.create(full_name='Member 5', team=self.team)
+        Member.objects.create(full_name='Elsewhere')
+        with self.assertNumQueries(4):
+            success, error, missed, summary = add_member_pairs(member)
+        self.assertEqual((success, missed), (0, 0))
+        self.assertEqual(summary, {'activated': 0, 'created': 5})
+        self.assertEqual(Meetup.objects.involving(member.pk).filter(team=self.team).count(), 5)
+
+    def test_deactivate_and_reactivate_touch_only_the_member(self):
+        member = self.members[0]
+        Member.objects.filter(pk=member.pk).update(active=False)
+        with self.assertNumQueries(1):
+            self.assertEqual(deactivate_member_pairs(member), (0, '', 4))
+        self.assertEqual(Meetup.objects.active().count(), 6)
+        Member.objects.filter(pk=member.pk).update(active=True)
+        self.assertEqual(reactivate_member_pairs(member), (0, '', 4))
+        self.assertEqual(Meetup.objects.active().count(), 10)
+
+    def test_views_keep_the_pairs_in_line(self):
+        # the pairs are brought in line when the request commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('cafe:member_new'),
+                             {'full_name': 'Member 5', 'active': 'on', 'team': self.team.pk})
+        self.assertEqual(Meetup.objects.active().count(), 15)
+
+        member = self.members[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('cafe:member_edit', args=[member.pk]), {'full_name': member.full_name})
+        self.assertEqual(Meetup.objects.active().count(), 10)
+
+        other = Team.objects.create(name='Support')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('cafe:member_edit', args=[member.pk]),
+                             {'full_name': member.full_name, 'active': 'on', 'team': other.pk})
+        self.assertFalse(Meetup.objects.involving(member.pk).filter(active=True).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('cafe:member_edit', args=[member.pk]),
+                             {'full_name': member.full_name, 'active': 'on', 'team': self.team.pk})
+        self.assertEqual(Meetup.objects.active().count(), 15)
+        self.assertEqual(update_meetup_list()[3], {'activated': 0, 'deactivated': 0, 'created': 0})
+
+
+def reconcile_hooks(in_lis_callbacks):
+    # the on_commit hooks that reconcile stale pairs, each is a partial of reconcile_stale_pairs
+    return [getattr(callback, 'func', callback) for callback in in_lis_callbacks].count(reconcile_stale_pairs)
+
+
+class StalePairTests(TestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name='Sales')
+        self.members = [Member.objects.create(full_name=f'Member {i}', team=self.team) for i in range(12)]
+        # the members created are all marked stale, reconciling them stands in for the commit
+        self.assertEqual(reconcile_stale_pairs(), (0, ''))
+        self.assertEqual(Meetup.objects.active().count(), 66)
+
+    def test_changes_in_a_transaction_reconcile_once(self):
+        with patch('cafinator.reconcile.update_meetup_list', wraps=update_meetup_list) as reconcile:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                for member in Member.objects.all()[:10]:
+                    member.active = False
+                    member.save()
+                self.assertFalse(Meetup.objects.filter(active=False).exists())
+        self.assertEqual(reconcile_hooks(callbacks), 1)
+        reconcile.assert_called_once()
+        self.assertEqual(Meetup.objects.active().count(), 1)
+
+    def test_rolled_back_marks_are_dropped(self):
+        member = Member.objects.get(pk=self.members[0].pk)
+        try:
+            with transaction.atomic():
+                member.active = False
+                member.save()
+                raise ValueError('rolled back')
+        except ValueError:
+            pass
+        other = Member.objects.get(pk=self.members[1].pk)
+        other.active = False
+        with patch('cafinator.reconcile.update_member_pairs', wraps=update_member_pairs) as delta:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                other.save()
+        self.assertEqual(reconcile_hooks(callbacks), 1)
+        delta.assert_called_once_with(other, False)
+        self.assertEqual(Meetup.objects.involving(member.pk).filter(active=True).count(), 10)
+
+    def test_one_member_takes_the_delta(self):
+        member = Member.objects.get(pk=self.members[0].pk)
+        member.team = Team.objects.create(name='Support')
+        with patch('cafinator.reconcile.update_member_pairs', wraps=update_member_pairs) as delta:
+            with self.captureOnCommitCallbacks(execute=True):
+                member.save()
+        delta.assert_called_once_with(member, True)
+        self.assertFalse(Meetup.objects.involving(member.pk).filter(active=True).exists())
+
+    def test_saves_that_leave_the_pairs_alone(self):
+        member = Member.objects.get(pk=self.members[0].pk)
+        member.email = 'member@example.com'
+        with self.captureOnCommitCallbacks() as callbacks:
+            member.save()
+            Member.objects.create(full_name='Away', active=False)
+        self.assertEqual(reconcile_hooks(callbacks), 0)
+
+    def test_bulk_changes_marked_by_hand(self):
+        Member.objects.filter(pk__in=[member.pk for member in self.members[:4]]).update(active=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_pairs_stale()
+        self.assertEqual(Meetup.objects.active().count(), 28)
+
+    def test_failed_reconcile_is_retried(self):
+        first, second = Member.objects.get(pk=self.members[0].pk), Member.objects.get(pk=self.members[1].pk)
+        first.active = False
+        with patch('cafinator.reconcile.update_member_pairs', return_value=(1, 'database gone', 0, {})):
+            with self.captureOnCommitCallbacks(execute=True):
+                first.save()
+        self.assertTrue(pairs_left_stale())
+        self.assertEqual(Meetup.objects.involving(first.pk).filter(active=True).count(), 11)
+        # the next change brings every pair in line, the failed one included
+        second.active = False
+        with patch('cafinator.reconcile.update_meetup_list', wraps=update_meetup_list) as reconcile:
+            with self.captureOnCommitCallbacks(execute=True):
+                second.save()
+        reconcile.assert_called_once()
+        self.assertFalse(pairs_left_stale())
+        self.assertEqual(Meetup.objects.active().count(), 45)
+
+    def test_command_reconciles_every_pair(self):
+        Member.objects.filter(pk=self.members[0].pk).update(active=False)
+        Reference.objects.create(name=PAIRS_STALE_REF)
+        call_command('reconcile_pairs', stdout=StringIO())
+        self.assertFalse(pairs_left_stale())
+        self.assertEqual(Meetup.objects.active().count(), 55)
+
+
+class StalePairMessageTests(TransactionTestCase):
+    def test_view_tells_when_the_pairs_were_not_reconciled(self):
+        team = Team.objects.create(name='Sales')
+        members = [Member.objects.create(full_name=f'Member {i}', team=team) for i in range(3)]
+        with patch('cafinator.reconcile.update_member_pairs', return_value=(1, 'database gone', 0, {})):
+            response = self.client.post(reverse('cafe:member_edit', args=[members[0].pk]),
+                                        {'full_name': members[0].full_name, 'team': team.pk}, follow=True)
+        shown = [message.message for message in response.context['messages']]
+        self.assertIn('The meetings could not be brought in line with the members, they are retried with the next '
+                      'change', shown)
+
+    def test_inactive_new_member_is_told_apart(self):
+        response = self.client.post(reverse('cafe:member_new'), {'full_name': 'Away'}, follow=True)
+        shown = [message.message for message in response.context['messages']]
+        self.assertEqual(shown, ['Member added, inactive so no meetings are set up'])
+
+
+@override_settings(CAFINATOR_SPARSE_PAIRS=True)
+class SparsePairTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.members = [Member.objects.create(full_name=f'Member {i}') for i in range(6)]
+        update_meetup_list()
+
+    def test_only_pairs_that_met_are_stored(self):
+        self.assertFalse(Meetup.objects.exists())
+        self.assertEqual(add_member_pairs(Member.objects.create(full_name='Member 6'))[3]['created'], 0)
+        self.assertEqual(create_meetings('array')[0], 0)
+        self.assertEqual(Meetup.objects.count(), 3)
+        self.assertEqual(Meetup.objects.filter(meetings=1).count(), 3)
+
+    def test_every_strategy_treats_missing_pairs_as_never_met(self):
+        for strategy in ('random', 'matching', 'array', 'round_robin'):
+            cache.clear()
+            self.assertEqual(create_meetings(strategy)[0], 0)
+            self.assertEqual(MeetPair.objects.filter(record=MeetRecord.objects.last()).count(), 3)
+        self.assertEqual(sum(Meetup.objects.values_list('meetings', flat=True)), 12)
+
+    def test_least_met_pairs_are_preferred(self):
+        for _ in range(3):
+            self.assertEqual(create_meetings('matching')[0], 0)
+        self.assertEqual(Meetup.objects.count(), 9)
+        self.assertFalse(Meetup.objects.filter(meetings__gt=1).exists())
+
+    def test_pairs_across_teams_are_rejected(self):
+        team = Team.objects.create(name='Sales')
+        Member.objects.filter(pk=self.members[0].pk).update(team=team)
+        success, error, names = update_meetings([(self.members[0].pk, self.members[1].pk)])
+        self.assertEqual(success, 1)
+        self.assertFalse(Meetup.objects.exists())
+
+    def test_prune_deletes_pairs_that_never_met(self):
+        with override_settings(CAFINATOR_SPARSE_PAIRS=False):
+            update_meetup_list()
+            with self.assertRaises(CommandError):
+                call_command('prune_unmet_pairs', stdout=StringIO())
+        update_meetings([(self.members[0].pk, self.members[1].pk)])
+        call_command('prune_unmet_pairs', stdout=StringIO())
+        self.assertEqual(list(Meetup.objects.values_list('meetings', flat=True)), [1])
+
+    def test_benchmark_storage(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'bench.json')
+            call_command('benchmark_pairing', sizes=[10], history=1, storage='sparse', output=output, force=True,
+                         stdout=StringIO(), stderr=StringIO())
+            with open(output) as f:
+                report = json.load(f)
+        self.assertEqual(report['storage'], 'sparse')
+        stored = {result['stage']: result['stored_pairs'] for result in report['results']}
+        self.assertEqual(stored['update_meetup_list'], 0)
+        self.assertEqual(stored['seed_history'], 5)
+
+
+class QueryStatsTests(TestCase):
+    def setUp(self):
+        self.members = [Member.objects.create(full_name=f'Member {i}') for i in range(4)]
+        update_meetup_list()
+
+    def test_track_queries_counts_and_keeps_the_slowest(self):
+        with track_queries('listing', in_int_slowest=2) as stats:
+            list(Member.objects.all())
+            list(Meetup.objects.all())
+            Member.objects.count()
+        self.assertEqual(stats.count, 3)
+        self.assertGreater(stats.seconds, 0)
+        report = stats.as_dict()
+        self.assertEqual(len(report['slowest']), 2)
+        self.assertGreaterEqual(report['slowest'][0]['ms'], report['slowest'][1]['ms'])
+
+    @override_settings(CAFINATOR_QUERY_STATS=True)
+    def test_log_queries_of_a_stage(self):
+        with self.assertLogs('coffee_log.sql', 'INFO') as logs:
+            update_meetings([(self.members[0].pk, self.members[1].pk)])
+        stats = json.loads(logs.records[0].getMessage())
+        self.assertEqual((stats['name'], stats['queries']), ('update_meetings', 4))
+
+    def test_nothing_logged_when_off(self):
+        with patch('cafinator.querystats.logger') as sql_logger:
+            update_meetings([(self.members[0].pk, self.members[1].pk)])
+        sql_logger.info.assert_not_called()
+
+    @override_settings(CAFINATOR_QUERY_STATS=True, CAFINATOR_SERVER_TIMING=True)
+    def test_middleware_logs_and_sets_server_timing(self):
+        with self.assertLogs('coffee_log.sql', 'INFO') as logs:
+            response = self.client.get(reverse('cafe:combination_list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[0-9.]+;desc="[0-9]+ queries", app;dur=[0-9.]+$')
+        stats = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(stats['name'], 'cafe:combination_list')
+        self.assertEqual(stats['status'], 200)
+        self.assertGreater(stats['queries'], 0)
+
+    def test_middleware_is_off_by_default(self):
+        response = self.client.get(reverse('cafe:combination_list'))
+        self.assertNotIn('Server-Timing', response)
+
+
+class TimingTests(TestCase):
+    def setUp(self):
+        self.members = [Member.objects.create(full_name=f'Member {i}') for i in range(4)]
+        update_meetup_list()
+        cache.clear()
+        reset()
+
+    def test_stages_are_timed(self):
+        self.assertEqual(create_meetings()[0], 0)
+        stages = report()
+        for stage in ('create_meetings', 'select_random_pairs', 'get_random_pairs', 'update_meetings', 'record_meetup'):
+            self.assertEqual(stages[stage]['timed'], 1)
+            self.assertEqual(stages[stage]['estimated_calls'], 1)
+        self.assertGreater(stages['create_meetings']['mean_ms'], 0)
+        self.assertIsNotNone(stages['create_meetings']['p99_ms'])
+
+    def test_histogram_buckets(self):
+        @timed('quick')
+        def quick():
+            pass
+        # a call of 0.05 ms and one of 30 ms
+        with patch('cafinator.timing.time.perf_counter', side_effect=[0, 0.00005, 1, 1.03]):
+            quick()
+            quick()
+        stage = report()['quick']
+        self.assertEqual((stage['timed'], stage['p50_ms'], stage['p99_ms']), (2, 0.1, 50))
+        self.assertEqual(stage['buckets'], {'le_0.1': 1, 'le_50': 1})
+
+    @override_settings(CAFINATOR_TIMING_SAMPLE_RATE=0)
+    def test_sampling_off(self):
+        self.assertEqual(create_meetings()[0], 0)
+        self.assertEqual(report(), {})
+
+    def test_sample_rate_of_a_stage(self):
+        @timed('sampled', sample=0.5)
+        def sampled():
+            pass
+        with patch('cafinator.timing.random.random', side_effect=[0.1, 0.9, 0.2, 0.7]):
+            for i in range(4):
+                sampled()
+        stage = report()['sampled']
+        self.assertEqual((stage['timed'], stage['sample_rate'], stage['estimated_calls']), (2, 0.5, 4))
+
+    def test_endpoint_and_command(self):
+        self.assertEqual(create_meetings()[0], 0)
+        response = self.client.get(reverse('cafe:timings'))
+        self.assertEqual(response.json()['stages']['create_meetings']['timed'], 1)
+        out = StringIO()
+        call_command('timing_report', reset=True, stdout=out)
+        self.assertIn('create_meetings', out.getvalue())
+        self.assertEqual(report(), {})
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name='Sales')
+        self.members = [Member.objects.create(full_name=f'Member {i}', team=self.team) for i in range(5)]
+        update_meetup_list()
+
+    def test_members_as_ndjson(self):
+        response = self.client.get(reverse('cafe:export', args=['members', 'ndjson']))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [member.pk for member in self.members])
+        self.assertEqual(rows[0]['team__name'], 'Sales')
+
+    def test_meetups_as_csv_in_chunks(self):
+        blocks = list(export_lines('meetups', 'csv', in_int_chunk_size=4))
+        # the header, then the 10 pairs in blocks of 4
+        self.assertEqual([block.count('\n') for block in blocks], [1, 4, 4, 2])
+        rows = list(csv.reader(''.join(blocks).splitlines()))
+        self.assertEqual(rows[0][:3], ['id', 'member_low_id', 'member_high_id'])
+        self.assertEqual(len(rows), 11)
+
+    def test_round_history(self):
+        self.assertEqual(create_meetings()[0], 0)
+        response = self.client.get(reverse('cafe:export', args=['record_pairs', 'csv']))
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 1 + Member.meetings_to_set())
+
+    def test_unknown_export(self):
+        self.assertEqual(self.client.get(reverse('cafe:export', args=['users', 'csv'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('cafe:export', args=['members', 'xml'])).status_code, 404)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_data', 'records', stdout=out)
+        self.assertEqual(out.getvalue(), '')
+        self.assertEqual(create_meetings()[0], 0)
+        call_command('export_data', 'records', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['team_id'], None)
+
+
+class MemberImportTests(TestCase):
+    def setUp(self):
+        self.sales = Team.objects.create(name='Sales')
+        self.jan = Member.objects.create(full_name='Jan', email='jan@example.com')
+        self.kim = Member.objects.create(full_name='Kim')
+        update_meetup_list()
+
+    def test_import_reconciles_once(self):
+        text = 'full_name,email,team\n' + ''.join(f'Member {i},m{i}@example.com,Sales\n' for i in range(6))
+        with patch('cafinator.member_import.update_meetup_list', wraps=update_meetup_list) as reconcile:
+            success, error, report = import_members(read_member_rows(text, 'csv'))
+        self.assertEqual((success, error), (0, ''))
+        reconcile.assert_called_once()
+        self.assertEqual((report['created'], report['updated'], report['rejected']), (6, 0, []))
+        self.assertEqual(report['pairs']['created'], 15)
+        self.assertEqual(Member.objects.filter(team=self.sales).count(), 6)
+        self.assertEqual(Meetup.objects.active(self.sales).count(), 15)
+
+    def test_updates_and_rejections(self):
+        rows = [
+            {'full_name': 'Jan', 'active': False},
+            {'full_name': 'Kim', 'team': 'Sales'},
+            {'full_name': 'Lee', 'email': 'not an email'},
+            {'full_name': 'Max', 'team': 'Marketing'},
+            {'full_name': 'Ray'},
+            {'full_name': 'Ray'},
+            {'email': 'nobody@example.com'},
+        ]
+        success, error, report = import_members(rows)
+        self.assertEqual(success, 0)
+        self.assertEqual((report['created'], report['updated'], report['unchanged']), (1, 2, 0))
+        self.assertEqual([(rejected['row'], list(rejected['errors'])) for rejected in report['rejected']],
+                         [(3, ['email']), (4, ['team']), (6, ['full_name']), (7, ['full_name'])])
+        self.jan.refresh_from_db()
+        self.kim.refresh_from_db()
+        self.assertEqual((self.jan.active, self.jan.email, self.kim.team), (False, 'jan@example.com', self.sales))
+        self.assertFalse(Meetup.objects.active().filter(member_low=self.jan).exists())
+
+    def test_unchanged_and_dry_run(self):
+        success, error, report = import_members([{'full_name': 'Jan', 'email': 'jan@example.com'}])
+        self.assertEqual((report['unchanged'], report['pairs']), (1, {}))
+        success, error, report = import_members([{'full_name': 'Lee'}], in_bool_dry_run=True)
+        self.assertEqual((success, report['created']), (0, 1))
+        self.assertFalse(Member.objects.filter(full_name='Lee').exists())
+
+    def test_view_and_command(self):
+        upload = SimpleUploadedFile('members.json', json.dumps([{'full_name': 'Lee', 'team': 'Sales'}]).encode())
+        response = self.client.post(reverse('cafe:member_import'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['report']['created'], 1)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'members.csv')
+            with open(path, 'w') as f:
+                f.write('full_name,active\nKim,false\n')
+            out = StringIO()
+            call_command('import_members', path, stdout=out)
+        self.assertIn('0 created, 1 updated', out.getvalue())
+        self.assertFalse(Member.objects.get(full_name='Kim').active)
+
+
+class SimulationTests(TestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name='Sales')
+        self.members = [Member.objects.create(full_name=f'Member {i}', team=self.team) for i in range(6)]
+        self.members += [Member.objects.create(full_name=f'Loner {i}') for i in range(4)]
+        update_meetup_list()
+        self.assertEqual(create_meetings()[0], 0)
+
+    def test_round_robin_covers_every_pair(self):
+        simulation = Simulation.load(seed=1)
+        self.assertEqual((len(simulation.lows), simulation.required), (21, 5))
+        self.assertEqual(simulation.metrics()['coverage'], round(5 / 21, 4))
+        with self.assertNumQueries(0):
+            report = simulation.run(5, 'round_robin', in_bool_per_round=True)
+        # the schedules of the team (5 rounds) and of the members without one (3 rounds) meet every pair
+        self.assertEqual(report['rounds_to_full_coverage'], 5)
+        self.assertEqual(report['end']['coverage'], 1)
+        self.assertEqual(report['end']['mean'], round((5 + 25) / 21, 4))
+        self.assertEqual(len(report['per_round']), 5)
+        self.assertEqual(Meetup.objects.filter(meetings__gt=0).count(), 5)
+
+    def test_strategies_keep_counts_even(self):
+        for strategy in ('random', 'array', 'matching'):
+            report = Simulation.load(self.team, seed=2).run(15, strategy)
+            self.assertEqual((report['pairs'], report['meetings_per_round']), (15, 3))
+            self.assertEqual(report['end']['mean'], round((3 + 45) / 15, 4))
+            self.assertLessEqual(report['end']['spread'], 2, strategy)
+        self.assertEqual(Meetup.objects.filter(meetings__gt=0).count(), 5)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('simulate_rounds', rounds=20, strategy='array', team='Sales', json=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual((report['rounds'], report['end']['coverage']), (20, 1))
+        self.assertIsNotNone(report['rounds_to_full_coverage'])
+
+
+@override_settings(CAFINATOR_OPTIMIZER_BUDGET_MS=100, CAFINATOR_OPTIMIZER_WORKERS=1)
+class OptimizerTests(TestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name='Sales')
+        self.members = [Member.objects.create(full_name=f'Member {i}', team=self.team) for i in range(6)]
+        update_meetup_list()
+
+    def test_annealing_finds_the_cheapest_round(self):
+        rng = np.random.default_rng(3)
+        cost = rng.integers(0, 20, size=(6, 6)).astype(float)
+        cost = cost + cost.T
+        problem = TeamProblem(np.arange(6), cost, np.zeros(6))
+
+        def cheapest(members):
+            if not members:
+                return 0
+            first, rest = members[0], members[1:]
+            return min(cost[first, other] + cheapest([m for m in rest if m != other]) for other in rest)
+        score, orders = anneal([problem], greedy_orders([problem], 1), time.time() + 0.05, 1)
+        self.assertEqual(score, cheapest(list(range(6))))
+        self.assertEqual(problem.score(orders[0]), score)
+
+    def test_costs_count_history_recency_and_byes(self):
+        pks = [member.pk for member in self.members]
+        Member.objects.filter(pk=pks[5]).update(active=False)
+        update_meetup_list()
+        update_meetings([(pks[0], pks[1])])
+        record_meetup(['a round'], [(pks[0], pks[1]), (pks[2], pks[3])], self.team)
+        state, problems = load_problems(self.team)
+        problem, = problems
+        # met once, and in the latest round
+        self.assertEqual(problem.cost[0, 1], COUNT_WEIGHT + RECENCY_WEIGHT)
+        self.assertEqual(problem.cost[2, 3], RECENCY_WEIGHT)
+        self.assertEqual(problem.cost[0, 2], 0)
+        self.assertEqual(list(problem.bye), [0, 0, 0, 0, BYE_WEIGHT])
+
+    def test_optimized_strategy_sets_a_fresh_round(self):
+        pks = [member.pk for member in self.members]
+        first = [(pks[0], pks[1]), (pks[2], pks[3]), (pks[4], pks[5])]
+        update_meetings(first)
+        record_meetup(['a round'], first, self.team)
+        self.assertEqual(create_meetings('optimized')[0], 0)
+        self.assertEqual(Meetup.objects.filter(meetings=1).count(), 6)
+        self.assertFalse(Meetup.objects.filter(meetings=2).exists())
+
+    @override_settings(CAFINATOR_OPTIMIZER_WORKERS=2)
+    def test_search_across_processes_keeps_to_the_budget(self):
+        start = time.monotonic()
+        success, pairs = select_optimized_pairs(3)
+        self.assertLess(time.monotonic() - start, 3 * 0.1)
+        self.assertEqual(success, 0)
+        self.assertEqual(len({pk for pair in pairs for pk in pair}), 6)
+
+    def test_large_team_keeps_to_the_budget(self):
+        rng = np.random.default_rng(5)
+        cost = rng.integers(0, 5, size=(3001, 3001)).astype(np.float32)
+        problem = TeamProblem(np.arange(3001), cost + cost.T, np.zeros(3001))
+        for workers in (1, 2):
+            start = time.monotonic()
+            score, (order,) = search_round([problem], 100, workers, 1)
+            self.assertLess(time.monotonic() - start, 3 * 0.1)
+            self.assertEqual(sorted(order), list(range(3001)))
+            self.assertEqual(problem.score(order), score)
+
+    def test_greedy_round_stops_at_the_deadline(self):
+        problem = TeamProblem(np.arange(7), np.zeros((7, 7), dtype=np.float32), np.zeros(7))
+        order = greedy_order(problem, np.random.default_rng(1), 0)
+        self.assertEqual(sorted(order), list(range(7)))
@@ -0,0 +1,147 @@
+import functools
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+# upper bounds of the latency buckets in milliseconds, the last bucket takes everything slower
+BUCKET_BOUNDS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+TIMING_KEY = 'cafinator:timing'
+# seconds between flushes of this process's histograms into the shared cache
+FLUSH_INTERVAL = 30
+
+
+class Histogram:
+    """
+    Latency histogram of one stage, the counts since the last flush to the shared cache
+    """
+
+    def __init__(self, sample):
+        self.sample = sample  # rate fixed by the decorator, None follows CAFINATOR_TIMING_SAMPLE_RATE
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.total_us = 0
+
+    def sample_rate(self):
+        return settings.CAFINATOR_TIMING_SAMPLE_RATE if self.sample is None else self.sample
+
+
+STAGES = {}  # stage name: Histogram
+_lock = threading.Lock()
+_last_flush = [time.monotonic()]
+
+
+def timed(stage=None, sample=None):
+    """
+    Record the latency of a sample of the calls to the decorated function in the histogram of its stage.
+    A call that is not sampled costs a random() and a compare
+    Parameters
+    ==========
+    stage : name of the stage, the function name when None
+    sample : share of the calls timed, CAFINATOR_TIMING_SAMPLE_RATE when None
+    """
+    def decorator(func):
+        histogram = STAGES.setdefault(stage or func.__name__, Histogram(sample))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if random.random() >= histogram.sample_rate():
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(histogram, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def record(in_obj_histogram, in_float_seconds):
+    milliseconds = in_float_seconds * 1000
+    with _lock:
+        in_obj_histogram.buckets[bisect_left(BUCKET_BOUNDS_MS, milliseconds)] += 1
+        in_obj_histogram.total_us += int(milliseconds * 1000)
+    if time.monotonic() - _last_flush[0] >= FLUSH_INTERVAL:
+        flush()
+
+
+def _add(key, value):
+    try:
+        cache.incr(key, value)
+    except ValueError:
+        if not cache.add(key, value, None):
+            cache.incr(key, value)
+
+
+def flush():
+    """
+    Add the counts of this process to the shared cache and start counting from zero,
+    so the report covers every process using the cache
+    """
+    with _lock:
+        _last_flush[0] = time.monotonic()
+        pending = []
+        for name, histogram in STAGES.items():
+            if histogram.total_us or any(histogram.buckets):
+                pending.append((name, histogram.buckets, histogram.total_us))
+                histogram.buckets = [0] * len(histogram.buckets)
+                histogram.total_us = 0
+    for name, buckets, total_us in pending:
+        _add(f'{TIMING_KEY}:{name}:total_us', total_us)
+        for index, count in enumerate(buckets):
+            if count:
+                _add(f'{TIMING_KEY}:{name}:{index}', count)
+
+
+def _percentile(buckets, count, share):
+    # upper bound of the bucket holding the given share of the calls
+    target = count * share
+    seen = 0
+    for index, bucket in enumerate(buckets):
+        seen += bucket
+        if seen >= target:
+            return BUCKET_BOUNDS_MS[index] if index < len(BUCKET_BOUNDS_MS) else None
+    return None
+
+
+def report():
+    """
+    The histograms of every stage that has been timed
+    Returns
+    =======
+    stages - {stage: {'timed', 'sample_rate', 'estimated_calls', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'buckets'}}
+    """
+    flush()
+    stages = {}
+    for name, histogram in sorted(STAGES.items()):
+        keys = [f'{TIMING_KEY}:{name}:{index}' for index in range(len(BUCKET_BOUNDS_MS) + 1)]
+        values = cache.get_many(keys + [f'{TIMING_KEY}:{name}:total_us'])
+        buckets = [values.get(key, 0) for key in keys]
+        timed_calls = sum(buckets)
+        if not timed_calls:
+            continue
+        rate = histogram.sample_rate()
+        stages[name] = {
+            'timed': timed_calls,
+            'sample_rate': rate,
+            'estimated_calls': round(timed_calls / rate) if rate else None,
+            'mean_ms': round(values.get(f'{TIMING_KEY}:{name}:total_us', 0) / timed_calls / 1000, 3),
+            'p50_ms': _percentile(buckets, timed_calls, 0.5),
+            'p90_ms': _percentile(buckets, timed_calls, 0.9),
+            'p99_ms': _percentile(buckets, timed_calls, 0.99),
+            'buckets': {f'le_{bound}' if bound is not None else 'slower': count for bound, count in
+                        zip(BUCKET_BOUNDS_MS + [None], buckets) if count},
+        }
+    return stages
+
+
+def reset():
+    # drop the counts, of this process and in the shared cache
+    with _lock:
+        for histogram in STAGES.values():
+            histogram.buckets = [0] * len(histogram.buckets)
+            histogram.total_us = 0
+    cache.delete_many([f'{TIMING_KEY}:{name}:{key}' for name in STAGES
+                       for key in list(range(len(BUCKET_BOUNDS_MS) + 1)) + ['total_us']])
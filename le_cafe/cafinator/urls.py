@@ -1,17 +1,21 @@
 from django.urls import path, re_path
 
-from .views import (combination_list, member_edit, member_list, member_new,
-                    meet_test, make_meetings, meetup_list)
+from .views import (combination_list, export, job_status, member_edit, member_import, member_list, member_new,
+                    meet_test, make_meetings, meetup_list, timings)
 
 app_name = 'cafinator'
 
 urlpatterns = [
     path('combination_list', combination_list, name='combination_list'),
+    path('export/<slug:dataset>.<slug:fmt>', export, name='export'),
     # path('make_permutations', make_permutations, name='make_permutations'),
     path('make_meetings', make_meetings, name='make_meetings'),
+    path('job/<int:pk>', job_status, name='job_status'),
     path('meet_test', meet_test, name='meet_test'),
     path('meetup_list', meetup_list, name='meetup_list'),
     re_path('member/(?P<pk>\d+)', member_edit, name='member_edit'),
+    path('member_import', member_import, name='member_import'),
     path('member_list', member_list, name='member_list'),
     path('member_new', member_new, name='member_new'),
+    path('timings', timings, name='timings'),
 ]
@@ -2,37 +2,59 @@ import logging
 
 from django.contrib import messages
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Q
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
-
-# from core.sendmail import send_text_email
-from .forms import MemberForm, SetMeetingForm
-from .models import Meetup, Member, MeetRecord
-from .meeting import (create_meetings, loadconfig, update_meetup_list)
+from django.template.loader import render_to_string
+from django.urls import reverse
+
+from .caching import cached_fragment
+from .export import EXPORT_FORMATS, EXPORTS, export_lines
+from .forms import CombinationFilterForm, MemberForm, MemberImportForm, SetMeetingForm
+from .models import GenerationJob, Meetup, Member, MeetRecord
+from .mailer import send_round_emails
+from .meeting import loadconfig
+from .member_import import import_members, read_member_rows
+from .reconcile import pairs_left_stale
+from .timing import report as timing_report
 
 logger = logging.getLogger('coffee_log')
 
+COMBINATIONS_PAGE_SIZE = 100
+
 
 #  ####################  Member view ###################  #
+@transaction.non_atomic_requests
 def member_list(request):
     """
     Standard tabular listing of members
+    The table is served from the fragment cache until a member, meetup or record changes,
+    read only so a cache hit does not need a transaction (or a connection)
     :param request:
     :return: render template
     """
     logger.info('Start')
-    objects = Member.objects.all()
     template = 'member_list.html'
     context = {
         'title': 'Member list',
-        'objects': objects,
+        'content': cached_fragment('member_list', request, lambda: render_to_string(
+            'member_list_content.html', {'objects': Member.objects.all().select_related('team')})),
     }
 
     return render(request, template, context)
 
 
+def report_stale_pairs(request):
+    # runs after the reconcile added on commit by the member's save, and tells when it failed
+    if pairs_left_stale():
+        messages.error(request, "The meetings could not be brought in line with the members, "
+                                "they are retried with the next change")
+
+
 def member_new(request):
     """
-    create a new member and create all permutations of meetings
+    create a new member, whose permutations of meetings are created when the request commits
     :param request:
     :return: render
     """
@@ -42,13 +64,12 @@ def member_new(request):
         form = MemberForm(request.POST)
         if form.is_valid():
             member = form.save()
-            # branch off to create permutations if user is active
+            # the meetings of an active member are added once the request commits (cafinator.reconcile)
             if member.active:
-                local_int_success, local_str_error, local_int_missed = update_meetup_list()
-                if local_int_success == 0 and local_int_missed == 0:
-                    messages.success(request, "Additional meetings added for the new member")
-                else:
-                    messages.error(request, "Meetup creation failed")
+                messages.success(request, "Member added, their meetings are set up once the change is saved")
+                transaction.on_commit(lambda: report_stale_pairs(request))
+            else:
+                messages.success(request, "Member added, inactive so no meetings are set up")
             return redirect('cafe:member_list')
         else:
             logger.error(f'Form: {form.errors}')
@@ -63,10 +84,43 @@ def member_new(request):
     return render(request, template, context)
 
 
+def member_import(request):
+    """
+    add or update many members from a CSV or JSON file, the meetings are updated once for all of them
+    :param request:
+    :return: render
+    """
+    template = 'member_import.html'
+    report = None
+    form = MemberImportForm(request.POST or None, request.FILES or None)
+    if request.method == 'POST' and form.is_valid():
+        upload = form.cleaned_data['file']
+        try:
+            rows = read_member_rows(upload.read().decode('utf-8-sig'),
+                                    'csv' if upload.name.lower().endswith('.csv') else 'json')
+        except (ValueError, UnicodeDecodeError) as e:
+            messages.error(request, f'The file could not be read: {e}')
+        else:
+            local_int_success, local_str_error, report = import_members(rows, form.cleaned_data['dry_run'])
+            if local_int_success != 0:
+                messages.error(request, f'Member import failed: {local_str_error}')
+            elif form.cleaned_data['dry_run']:
+                messages.info(request, 'Checked only, nothing was saved')
+            else:
+                messages.success(request, f'{report["created"]} members added, {report["updated"]} updated')
+
+    context = {
+        'title': 'Import members',
+        'form': form,
+        'report': report,
+    }
+    return render(request, template, context)
+
+
 def member_edit(request, pk):
     """
     update member detail or status
-    Change in status will update the meeting permutation statuses
+    Change in status or team will update the meeting permutation statuses of this member
     :param request:
     :param pk: for the member
     :return: render
@@ -85,13 +139,10 @@ def member_edit(request, pk):
         # form = MemberForm(request.POST)
         if form.is_valid():
             member.save()
-            if 'active' in form.changed_data:
-                logger.debug('update meeting statuses')
-                local_int_success, local_str_error, local_int_missed = update_meetup_list()
-                if local_int_success == 0 and local_int_missed == 0:
-                    messages.success(request, "Meetings altered for the updated member")
-                else:
-                    messages.error(request, "Meeting alteration failed")
+            # a change in status or team marks the member's meetings stale, they are altered on commit
+            if 'active' in form.changed_data or 'team' in form.changed_data:
+                messages.success(request, "Member updated, their meetings are brought in line once the change is saved")
+                transaction.on_commit(lambda: report_stale_pairs(request))
 
             return redirect('cafe:member_list')
         else:
@@ -106,23 +157,66 @@ def member_edit(request, pk):
 
 
 #  ####################  Combinations ###################  #
+def combination_page(request):
+    """
+    Context for one page of combinations
+    Paged on (meetings, id) with a cursor rather than an offset, so every page is one bounded
+    query on the meetings index however large the table grows
+    :param request:
+    :return: context dict
+    """
+    form = CombinationFilterForm(request.GET or None)
+    qs = Meetup.objects.all().only('named', 'meetings')
+    after = ''
+    if form.is_valid():
+        if form.cleaned_data['active']:
+            qs = qs.filter(active=form.cleaned_data['active'] == 'yes')
+        member = form.cleaned_data['member']
+        if member:
+            qs = qs.filter(Q(member_low=member) | Q(member_high=member))
+        if form.cleaned_data['meetings'] is not None:
+            qs = qs.filter(meetings=form.cleaned_data['meetings'])
+        after = form.cleaned_data['after']
+    if after:
+        after_meetings, after_pk = (int(part) for part in after.split('_'))
+        qs = qs.filter(Q(meetings__gt=after_meetings) | Q(meetings=after_meetings, pk__gt=after_pk))
+    objects = list(qs.order_by('meetings', 'pk')[:COMBINATIONS_PAGE_SIZE + 1])
+    next_after = ''
+    if len(objects) > COMBINATIONS_PAGE_SIZE:
+        objects = objects[:COMBINATIONS_PAGE_SIZE]
+        next_after = f'{objects[-1].meetings}_{objects[-1].pk}'
+
+    filters = request.GET.copy()
+    filters.pop('after', None)
+    context = {
+        'objects': objects,
+        'form': form,
+        'filters': filters.urlencode(),
+        'next_after': next_after,
+        'is_first_page': not after,
+    }
+    return context
+
+
+@transaction.non_atomic_requests
 def combination_list(request):
     """
     Display combinations of meetings and number of times utilised (arranged)
+    Each page is served from the fragment cache until the data changes
     :param request:
     :return: render
     """
     logger.info('Start')
-    objects = Meetup.objects.all()
-
     template = 'combination_list.html'
     context = {
         'title': 'Meetup list',
-        'objects': objects,
+        'content': cached_fragment('combination_list', request, lambda: render_to_string(
+            'combination_list_content.html', combination_page(request))),
     }
     return render(request, template, context)
 
 
+@transaction.non_atomic_requests
 def meetup_list(request):
     """
     Displays the most recent 3 meeting sets that were arranged
@@ -130,11 +224,11 @@ def meetup_list(request):
     :return: render
     """
     logger.info('Start')
-    objects = MeetRecord.objects.last_3()
     template = 'meetup_list.html'
     context = {
         'title': 'Meetups list',
-        'objects': objects,
+        'content': cached_fragment('meetup_list', request, lambda: render_to_string(
+            'meetup_list_content.html', {'objects': MeetRecord.objects.last_3()})),
     }
     return render(request, template, context)
 
@@ -148,7 +242,7 @@ def get_latest_meeting_record():
     logger.info('Start')
     no_qs = False
     try:
-        last_meeting = MeetRecord.objects.all().order_by('pk').last()
+        last_meeting = MeetRecord.objects.with_pairs().order_by('pk').last()
         if not last_meeting:
             no_qs = True
     except ObjectDoesNotExist:
@@ -158,7 +252,7 @@ def get_latest_meeting_record():
         last_mtg = 'None'
         last_set = ''
     else:
-        last_mtg = last_meeting.detail.strip()
+        last_mtg = '\n'.join(last_meeting.meeting_lines())
         last_set = last_meeting.recorded
     return last_mtg, last_set
 
@@ -191,28 +285,33 @@ def make_meetings(request):
     logger.info('Start')
     last_mtg, last_set = get_latest_meeting_record()
 
-    form = SetMeetingForm()
+    form = SetMeetingForm(request.POST or None)
     template = 'create_meeting.html'
+    job = None
     if request.method == "POST":
-        if 'make_meeting' in request.POST:
-            result = create_meetings()
-            if result == 0:
-                last_mtg, last_set = get_latest_meeting_record()
-                messages.success(request, "New meeting set created")
-            else:
-                messages.success(request, "New meeting set failed")
-            redirect('cafe:meetup_list')
+        if 'make_meeting' in request.POST and form.is_valid():
+            # generated by the run_generation_jobs worker, the page polls job_status until it is done
+            job = GenerationJob.objects.create(strategy=form.cleaned_data['strategy'] or 'random')
+            if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                return JsonResponse({'job': job.pk, 'status': job.status,
+                                     'status_url': reverse('cafe:job_status', kwargs={'pk': job.pk})}, status=202)
+            messages.success(request, f"New meeting set queued as job {job.pk}")
         if 'email' in request.POST:
             local_int_success, local_dict_config = loadconfig()
             if local_int_success == 0:
                 try:
                     local_str_body = make_email_body(last_mtg, False)
-                    logger.error('Missing email functionality todo')
-                    # send_text_email(local_dict_config.get('email_smtp'), local_dict_config.get('email_port'),
-                    #                 local_dict_config.get('email_from'), local_dict_config.get('email_to'),
-                    #                 local_dict_config.get('email_cc'), local_dict_config.get('email_subject'),
-                    #                 local_str_body, None, None)
-                    messages.success(request, "Email sent to the DL")
+                    last_record = MeetRecord.objects.order_by('pk').last()
+                    last_pairs = list(last_record.pairs.values_list('member_low_id', 'member_high_id')
+                                      if last_record else [])
+                    local_int_success, local_dict_report = send_round_emails(local_dict_config, last_pairs,
+                                                                             local_str_body)
+                    if local_int_success == 0:
+                        messages.success(request, f"Email sent to the DL and {local_dict_report['members']} members")
+                    else:
+                        digest = 'sent' if local_dict_report['digest'] else 'not sent'
+                        messages.error(request, f"Email to the DL {digest}, {local_dict_report['members']} members "
+                                                f"notified, not sent to {', '.join(local_dict_report['failed'])}")
                 except Exception as e:
                     logger.error(f'Email sending failed: {e}')
                     messages.error(request, 'Email not successfully sent')
@@ -228,11 +327,56 @@ def make_meetings(request):
         'form': form,
         'meetings': last_mtg,
         'created': last_set,
+        'job': job,
     }
     # print(f'{context}')
     return render(request, template, context)
 
 
+@transaction.non_atomic_requests
+def job_status(request, pk):
+    """
+    Lightweight status of a generation job for the make meetings page to poll
+    :param request:
+    :param pk: for the job
+    :return: json
+    """
+    job = GenerationJob.objects.filter(pk=pk).values('pk', 'status', 'error', 'record__detail', 'finished').first()
+    if job is None:
+        return JsonResponse({'error': 'No such job found'}, status=404)
+    return JsonResponse({
+        'job': job['pk'],
+        'status': job['status'],
+        'error': job['error'],
+        'meetings': job['record__detail'],
+        'finished': job['finished'],
+    })
+
+
+def timings(request):
+    """
+    Latency histograms of the timed stages, over every process sharing the cache
+    :param request:
+    :return: json
+    """
+    return JsonResponse({'stages': timing_report()})
+
+
+def export(request, dataset, fmt):
+    """
+    Stream a dataset as NDJSON or CSV, read and sent a chunk at a time
+    :param request:
+    :param dataset: name in EXPORTS
+    :param fmt: ndjson or csv
+    :return: streaming attachment
+    """
+    if dataset not in EXPORTS or fmt not in EXPORT_FORMATS:
+        raise Http404('No such export')
+    response = StreamingHttpResponse(export_lines(dataset, fmt), content_type=EXPORT_FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{fmt}"'
+    return response
+
+
 def meet_test(request):
     """
     Test function with a URL to do development with, Once feature is developed
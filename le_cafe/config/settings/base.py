@@ -134,6 +134,7 @@ AUTH_PASSWORD_VALIDATORS = [
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#middleware
 MIDDLEWARE = [
+    "cafinator.querystats.QueryStatsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -279,3 +280,21 @@ ACCOUNT_FORMS = {"signup": "le_cafe.users.forms.UserSignupForm"}
 SOCIALACCOUNT_ADAPTER = "le_cafe.users.adapters.SocialAccountAdapter"
 # https://django-allauth.readthedocs.io/en/latest/forms.html
 SOCIALACCOUNT_FORMS = {"signup": "le_cafe.users.forms.UserSocialSignupForm"}
+
+
+# cafinator
+# ------------------------------------------------------------------------------
+# store only the pairs that have met, a pair of teammates without a Meetup row counts as never met
+CAFINATOR_SPARSE_PAIRS = env.bool("CAFINATOR_SPARSE_PAIRS", False)
+# log the query count, SQL time and slowest statements of every request
+CAFINATOR_QUERY_STATS = env.bool("CAFINATOR_QUERY_STATS", False)
+# and send them in a Server-Timing header
+CAFINATOR_SERVER_TIMING = env.bool("CAFINATOR_SERVER_TIMING", False)
+# number of the slowest statements logged
+CAFINATOR_SLOW_QUERIES = env.int("CAFINATOR_SLOW_QUERIES", 5)
+# share of the calls to the timed stages recorded in the latency histograms, 0 turns the timing off.
+# Kept low in production, the local and test settings record every call
+CAFINATOR_TIMING_SAMPLE_RATE = env.float("CAFINATOR_TIMING_SAMPLE_RATE", 0.01)
+# milliseconds the optimized pairing strategy searches for a round, and the processes it searches on
+CAFINATOR_OPTIMIZER_BUDGET_MS = env.int("CAFINATOR_OPTIMIZER_BUDGET_MS", 500)
+CAFINATOR_OPTIMIZER_WORKERS = env.int("CAFINATOR_OPTIMIZER_WORKERS", 4)
@@ -58,3 +58,5 @@ INSTALLED_APPS += ["django_extensions"]  # noqa F405
 
 # Your stuff...
 # ------------------------------------------------------------------------------
+# every call to a timed stage is recorded
+CAFINATOR_TIMING_SAMPLE_RATE = env.float("CAFINATOR_TIMING_SAMPLE_RATE", 1.0)
@@ -31,3 +31,5 @@ TEMPLATES[0]["OPTIONS"]["debug"] = True  # type: ignore # noqa F405
 
 # Your stuff...
 # ------------------------------------------------------------------------------
+# every call to a timed stage is recorded
+CAFINATOR_TIMING_SAMPLE_RATE = env.float("CAFINATOR_TIMING_SAMPLE_RATE", 1.0)